@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""
+ベンチマーク用のアンケートファイル（合成データ）を作成するスクリプト
+
+実際のアンケートファイルと同じ形式の「data」シートと「質問対応表」シートを持つ
+Excelファイルと、クライアント設定ファイルを作成する。
+
+- 固定質問（modules.aggregation.FIXED_QUESTIONS）はすべてのファイルに含まれる
+- それ以外の質問は共通の質問群からファイルごとに選ばれ、ファイルごとに質問番号が異なる
+  （質問マスターで質問文をキーに対応付ける必要がある状態）
+- 単一回答（SA）は選択肢の番号、複数回答（MA）は選択肢ごとの 0/1 の列（Q-001_1 など）、
+  自由回答（FA）は「Q-001_FA」の列になる
+
+使用例:
+    python benchmarks/generate_survey_workbooks.py --output-dir bench_data \\
+        --files 5 --respondents 2000 --questions 60 --clients 8
+"""
+
+import argparse
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.aggregation import FIXED_QUESTIONS
+
+SETTINGS_FILENAME = 'client_settings.xlsx'
+
+# 自由回答の例（値の種類が多くなるように番号を付けて使う）
+FA_SAMPLES = ['特になし', '価格が安いから', 'デザインが好きだから', '友人に勧められた', '使いやすい', 'その他']
+
+
+def question_pool(size):
+    """
+    固定質問以外の質問文の一覧を作成する
+
+    Args:
+        size: 質問数
+
+    Returns:
+        list: 質問文のリスト
+    """
+    return [f"ベンチマーク質問{i + 1:03d}について当てはまるものをお選びください。" for i in range(size)]
+
+
+def build_question_sheet(questions, rng):
+    """
+    質問対応表シートの内容を作成する
+
+    Args:
+        questions: (質問番号, 質問文, 区分, 選択肢数) のリスト
+        rng: numpy.random.Generator
+
+    Returns:
+        pandas.DataFrame: ヘッダーなしで書き込む質問対応表（1行目: タイトル、3行目: 見出し）
+    """
+    rows = [['質問対応表', None, None, None], [None, None, None, None], ['番号', '条件', '内容', '区分']]
+    for q_num, text, kind, choices in questions:
+        rows.append([q_num, '必須回答' if rng.random() < 0.8 else '任意回答', text, kind])
+        if kind != 'FA':
+            for choice in range(1, choices + 1):
+                rows.append([choice, None, f"選択肢{choice}", None])
+        rows.append([None, None, None, None])
+    return pd.DataFrame(rows)
+
+
+def build_data_sheet(questions, respondents, fa_every, rng, start):
+    """
+    dataシートの内容を作成する
+
+    Args:
+        questions: (質問番号, 質問文, 区分, 選択肢数) のリスト
+        respondents: 回答者数
+        fa_every: この数の質問ごとに1つ、FA列を追加する（0の場合は追加しない）
+        rng: numpy.random.Generator
+        start: 最初の回答日時
+
+    Returns:
+        pandas.DataFrame: dataシートのデータ
+    """
+    columns = {'NO': np.arange(1, respondents + 1)}
+    # 回答日時はおおむね回答順（一部は前後する）の文字列
+    offsets = np.sort(rng.integers(0, 60 * 24 * 30, respondents)) + rng.integers(-30, 30, respondents)
+    response_times = pd.Timestamp(start) + pd.to_timedelta(offsets, unit='min')
+    columns['回答日時'] = response_times.strftime('%Y/%m/%d %H:%M:%S')
+
+    for i, (q_num, _, kind, choices) in enumerate(questions):
+        if kind == 'SA':
+            values = rng.integers(1, choices + 1, respondents).astype(float)
+            values[rng.random(respondents) < 0.1] = np.nan
+            columns[q_num] = values
+        elif kind == 'MA':
+            for choice in range(1, choices + 1):
+                columns[f"{q_num}_{choice}"] = (rng.random(respondents) < 0.3).astype(int)
+        else:
+            columns[q_num] = fa_values(respondents, rng)
+        if fa_every and kind != 'FA' and i % fa_every == fa_every - 1:
+            columns[f"{q_num}_FA"] = fa_values(respondents, rng)
+    return pd.DataFrame(columns)
+
+
+def fa_values(respondents, rng):
+    """自由回答の列の値を作成する（約半数は未回答）"""
+    samples = np.array(FA_SAMPLES, dtype=object)[rng.integers(0, len(FA_SAMPLES), respondents)]
+    numbers = rng.integers(1, max(respondents // 2, 2), respondents)
+    values = np.array([f"{sample}（{number}）" for sample, number in zip(samples, numbers)], dtype=object)
+    values[rng.random(respondents) < 0.5] = None
+    return values
+
+
+def generate_survey_workbook(path, question_texts, respondents, fa_every=4, seed=0,
+                             start='2024-01-01'):
+    """
+    1つのアンケートファイルを作成する
+
+    Args:
+        path: 保存先のパス
+        question_texts: このファイルに含める質問文のリスト（この順に Q-001 から番号を付ける）
+        respondents: 回答者数
+        fa_every: この数の質問ごとに1つ、FA列を追加する
+        seed: 乱数のシード
+        start: 最初の回答日時
+
+    Returns:
+        str: 保存先のパス
+    """
+    rng = np.random.default_rng(seed)
+    questions = []
+    for i, text in enumerate(question_texts):
+        kind = rng.choice(['SA', 'SA', 'MA', 'FA'], p=[0.45, 0.25, 0.2, 0.1])
+        questions.append((f"Q-{i + 1:03d}", text, str(kind), int(rng.integers(2, 8))))
+
+    data_df = build_data_sheet(questions, respondents, fa_every, rng, start)
+    question_df = build_question_sheet(questions, rng)
+    with pd.ExcelWriter(path, engine='xlsxwriter') as writer:
+        data_df.to_excel(writer, sheet_name='data', index=False)
+        question_df.to_excel(writer, sheet_name='質問対応表', index=False, header=False)
+    return path
+
+
+def generate_benchmark_dataset(output_dir, files=3, respondents=1000, questions=40,
+                               fa_every=4, clients=5, questions_per_client=5, seed=0):
+    """
+    ベンチマーク用のアンケートファイル一式とクライアント設定ファイルを作成する
+
+    Args:
+        output_dir: 保存先のフォルダ
+        files: アンケートファイル数
+        respondents: 1ファイルあたりの回答者数
+        questions: 1ファイルあたりの質問数（固定質問を含む）
+        fa_every: この数の質問ごとに1つ、FA列を追加する
+        clients: クライアント数
+        questions_per_client: 1クライアントあたりの集計対象の質問数
+        seed: 乱数のシード
+
+    Returns:
+        dict: {'data_paths': アンケートファイルのパスのリスト, 'settings_path': クライアント設定ファイルのパス}
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    # ファイル間で一部の質問が共通になるよう、1ファイル分の1.5倍の質問群から選ぶ
+    other_count = max(questions - len(FIXED_QUESTIONS), 0)
+    pool = question_pool(int(other_count * 1.5) + 1)
+
+    data_paths = []
+    for index in range(files):
+        selected = list(rng.choice(pool, size=min(other_count, len(pool)), replace=False))
+        # 固定質問の位置もファイルごとに変える
+        texts = selected[:index % 3] + FIXED_QUESTIONS + selected[index % 3:]
+        path = os.path.join(output_dir, f"benchmark_survey_{index + 1:03d}.xlsx")
+        start = pd.Timestamp('2024-01-01') + pd.Timedelta(days=7 * index)
+        generate_survey_workbook(path, texts, respondents, fa_every, seed + index + 1, start)
+        data_paths.append(path)
+
+    settings = []
+    for index in range(clients):
+        for text in rng.choice(pool, size=min(questions_per_client, len(pool)), replace=False):
+            settings.append({'クライアント名': f"ベンチマーク{index + 1:03d}社", '集計対象の質問文': text})
+    settings_path = os.path.join(output_dir, SETTINGS_FILENAME)
+    pd.DataFrame(settings, columns=['クライアント名', '集計対象の質問文']).to_excel(settings_path, index=False)
+    return {'data_paths': data_paths, 'settings_path': settings_path}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="ベンチマーク用のアンケートファイルを作成する")
+    parser.add_argument("--output-dir", required=True, help="保存先のフォルダ")
+    parser.add_argument("--files", type=int, default=3, help="アンケートファイル数（デフォルト: 3）")
+    parser.add_argument("--respondents", type=int, default=1000, help="1ファイルあたりの回答者数（デフォルト: 1000）")
+    parser.add_argument("--questions", type=int, default=40, help="1ファイルあたりの質問数（デフォルト: 40）")
+    parser.add_argument("--fa-every", type=int, default=4,
+                        help="この数の質問ごとに1つFA列を追加する（0で追加しない、デフォルト: 4）")
+    parser.add_argument("--clients", type=int, default=5, help="クライアント数（デフォルト: 5）")
+    parser.add_argument("--questions-per-client", type=int, default=5,
+                        help="1クライアントあたりの集計対象の質問数（デフォルト: 5）")
+    parser.add_argument("--seed", type=int, default=0, help="乱数のシード（デフォルト: 0）")
+    args = parser.parse_args(argv)
+
+    dataset = generate_benchmark_dataset(
+        args.output_dir, args.files, args.respondents, args.questions, args.fa_every,
+        args.clients, args.questions_per_client, args.seed
+    )
+    print(f"{len(dataset['data_paths'])}個のアンケートファイルとクライアント設定を '{args.output_dir}' に作成しました。")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
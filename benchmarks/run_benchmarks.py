@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+"""
+質問マスター作成・データ集計・Excel出力の処理時間を計測するベンチマーク
+
+generate_survey_workbooks.py で作成した合成データを複数のサイズで処理し、
+結果をJSONで保存する。以前の結果と比較して、処理時間が遅くなった箇所を表示できる。
+
+使用例:
+    # 小・中サイズを計測して benchmarks/results/ に保存する
+    python benchmarks/run_benchmarks.py --sizes small medium
+
+    # 以前の結果と比較し、20%以上遅くなった場合は終了コード1を返す
+    python benchmarks/run_benchmarks.py --compare benchmarks/results/前回の結果.json --fail-on-regression
+
+終了コード:
+    0: 計測が完了（--fail-on-regression の場合は、遅くなった処理がない）
+    1: 比較した結果、遅くなった処理がある（--fail-on-regression の場合のみ）
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import pandas as pd
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from benchmarks.generate_survey_workbooks import generate_benchmark_dataset
+from modules.aggregation import aggregate_data
+from modules.question_master import create_question_master
+from modules.export import write_merged_workbook, write_client_workbook
+from modules.workbook_loader import LocalSurveyFile
+from modules.pipeline_trace import PipelineTrace, KIND_STAGE
+
+# 結果の形式を変更した場合は値を上げる
+RESULT_VERSION = 1
+
+# 計測するデータのサイズ（generate_benchmark_dataset の引数）
+SIZES = {
+    'small': {'files': 3, 'respondents': 500, 'questions': 30, 'clients': 3},
+    'medium': {'files': 6, 'respondents': 3000, 'questions': 60, 'clients': 8},
+    'large': {'files': 10, 'respondents': 10000, 'questions': 100, 'clients': 15},
+}
+
+DEFAULT_RESULTS_DIR = os.path.join(ROOT_DIR, 'benchmarks', 'results')
+DEFAULT_DATA_DIR = os.path.join(tempfile.gettempdir(), 'tri_merger_benchmarks')
+
+# 比較時に、この割合以上遅くなった処理を報告する
+DEFAULT_REGRESSION_THRESHOLD = 0.2
+
+logger = logging.getLogger('benchmarks')
+
+
+def dataset_dir(data_dir, params):
+    """データのサイズごとの保存先（同じ設定のデータは再利用する）"""
+    key = hashlib.sha256(json.dumps(params, sort_keys=True).encode('utf-8')).hexdigest()[:12]
+    return os.path.join(data_dir, key)
+
+
+def prepare_dataset(data_dir, params):
+    """
+    合成データを作成する（同じ設定で作成済みの場合は再利用する）
+
+    Returns:
+        dict: {'data_paths': アンケートファイルのパスのリスト, 'settings_path': クライアント設定ファイルのパス}
+    """
+    output_dir = dataset_dir(data_dir, params)
+    manifest_path = os.path.join(output_dir, 'manifest.json')
+    if os.path.exists(manifest_path):
+        with open(manifest_path, encoding='utf-8') as f:
+            return json.load(f)
+    dataset = generate_benchmark_dataset(output_dir, **params)
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump(dataset, f, ensure_ascii=False)
+    return dataset
+
+
+def time_call(func, repeat):
+    """
+    関数を repeat 回実行して処理時間を計測する
+
+    Returns:
+        dict: {'min': 最小, 'median': 中央値, 'runs': 各回の処理時間（秒）}
+        object: 最後の実行結果
+    """
+    runs = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        runs.append(time.perf_counter() - start)
+    return {'min': min(runs), 'median': statistics.median(runs), 'runs': runs}, result
+
+
+def run_size(size, params, args):
+    """
+    1つのサイズのデータについて各処理の時間を計測する
+
+    Returns:
+        dict: 計測結果
+    """
+    dataset = prepare_dataset(args.data_dir, params)
+    data_paths = dataset['data_paths']
+    client_settings_df = pd.read_excel(dataset['settings_path'])
+    load_files = lambda: [LocalSurveyFile(path) for path in data_paths]
+    timings = {}
+
+    logger.info(f"[{size}] 質問マスター作成")
+    timings['create_question_master'], question_master_df = time_call(
+        lambda: create_question_master(load_files()), args.repeat
+    )
+
+    logger.info(f"[{size}] データ集計")
+    traces = []
+
+    def aggregate():
+        trace = PipelineTrace()
+        traces.append(trace)
+        return aggregate_data(
+            load_files(), question_master_df, client_settings_df,
+            max_workers=args.workers, column_projection=args.column_projection, trace=trace
+        )
+
+    timings['aggregate_data'], (client_results, merged_df, _) = time_call(aggregate, args.repeat)
+    # 処理段階ごとの時間（最後の実行）
+    stages = {
+        record['stage']: record['seconds']
+        for record in traces[-1].to_records() if record['kind'] == KIND_STAGE
+    }
+
+    with tempfile.TemporaryDirectory() as output_dir:
+        logger.info(f"[{size}] 中間データの出力")
+        merged_path = os.path.join(output_dir, 'merged.xlsx')
+        timings['write_merged_workbook'], _ = time_call(
+            lambda: write_merged_workbook(merged_df, merged_path), args.repeat
+        )
+
+        logger.info(f"[{size}] クライアント別の出力")
+
+        def write_clients():
+            for index, client_info in enumerate(client_results.values()):
+                write_client_workbook(client_info, os.path.join(output_dir, f"client_{index}.xlsx"))
+
+        timings['write_client_workbooks'], _ = time_call(write_clients, args.repeat)
+
+    return {
+        'size': size,
+        'params': params,
+        'input_bytes': sum(os.path.getsize(path) for path in data_paths),
+        'merged_shape': list(merged_df.shape),
+        'clients': len(client_results),
+        'timings': timings,
+        'stages': stages,
+    }
+
+
+def git_commit():
+    """現在のコミットのハッシュ（取得できない場合は None）"""
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT_DIR,
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment_info():
+    """計測環境の情報"""
+    return {
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def compare_results(current, previous, threshold=DEFAULT_REGRESSION_THRESHOLD):
+    """
+    以前の結果と比較し、処理時間の変化を表にする
+
+    各処理の最小の処理時間（min）を比較する。
+
+    Args:
+        current: 今回の結果
+        previous: 以前の結果（同じ形式のJSONを読み込んだ辞書）
+        threshold: この割合以上遅くなった処理を「遅くなった」とする
+
+    Returns:
+        pandas.DataFrame: サイズ・処理ごとの以前/今回の処理時間と比率
+        list: 遅くなった (サイズ, 処理) のリスト
+    """
+    previous_results = {result['size']: result for result in previous.get('results', [])}
+    rows = []
+    regressions = []
+    for result in current['results']:
+        before = previous_results.get(result['size'])
+        if before is None or before.get('params') != result['params']:
+            continue
+        for name, timing in result['timings'].items():
+            if name not in before['timings']:
+                continue
+            old, new = before['timings'][name]['min'], timing['min']
+            ratio = new / old if old else float('nan')
+            rows.append({'サイズ': result['size'], '処理': name, '以前(秒)': round(old, 3),
+                         '今回(秒)': round(new, 3), '比率': round(ratio, 2)})
+            if old and ratio > 1 + threshold:
+                regressions.append((result['size'], name))
+    return pd.DataFrame(rows, columns=['サイズ', '処理', '以前(秒)', '今回(秒)', '比率']), regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="質問マスター作成・データ集計・Excel出力のベンチマーク")
+    parser.add_argument("--sizes", nargs='+', choices=list(SIZES), default=['small', 'medium'],
+                        help="計測するデータのサイズ（デフォルト: small medium）")
+    parser.add_argument("--repeat", type=int, default=3, help="各処理の実行回数（デフォルト: 3）")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="ファイル読み込みのワーカープロセス数（デフォルト: 1 = 逐次処理）")
+    parser.add_argument("--column-projection", action="store_true",
+                        help="集計に必要な列のみ読み込む（デフォルトは画面・run_aggregation.py と同じくすべての列）")
+    parser.add_argument("--data-dir", default=DEFAULT_DATA_DIR,
+                        help="合成データの保存先（同じ設定のデータは再利用する）")
+    parser.add_argument("--output", default=None,
+                        help="結果のJSONの保存先（デフォルト: benchmarks/results/日時_コミット.json）")
+    parser.add_argument("--compare", default=None, help="比較する以前の結果のJSON")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_REGRESSION_THRESHOLD,
+                        help="この割合以上遅くなった処理を報告する（デフォルト: 0.2 = 20%%）")
+    parser.add_argument("--fail-on-regression", action="store_true",
+                        help="遅くなった処理がある場合に終了コード1を返す")
+    args = parser.parse_args(argv)
+    if args.repeat < 1:
+        parser.error("--repeat は1以上を指定してください。")
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s', force=True)
+    # 計測中の modules のログは表示しない
+    logging.getLogger().setLevel(logging.WARNING)
+    logger.setLevel(logging.INFO)
+
+    commit = git_commit()
+    report = {
+        'version': RESULT_VERSION,
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'commit': commit,
+        'environment': environment_info(),
+        'options': {'repeat': args.repeat, 'workers': args.workers, 'column_projection': args.column_projection},
+        'results': [],
+    }
+    for size in args.sizes:
+        logger.info(f"--- {size}: {SIZES[size]} ---")
+        result = run_size(size, SIZES[size], args)
+        report['results'].append(result)
+        for name, timing in result['timings'].items():
+            logger.info(f"  {name}: {timing['min']:.3f}秒（中央値 {timing['median']:.3f}秒）")
+
+    output = args.output
+    if output is None:
+        os.makedirs(DEFAULT_RESULTS_DIR, exist_ok=True)
+        output = os.path.join(
+            DEFAULT_RESULTS_DIR, f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{commit or 'unknown'}.json"
+        )
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=1)
+    logger.info(f"結果を '{output}' に保存しました。")
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            previous = json.load(f)
+        comparison_df, regressions = compare_results(report, previous, args.threshold)
+        if comparison_df.empty:
+            logger.info("比較できる結果がありません（サイズの設定が異なります）。")
+        else:
+            print(comparison_df.to_string(index=False))
+        if regressions:
+            logger.warning(
+                f"{args.threshold:.0%}以上遅くなった処理: "
+                + ', '.join(f"{size}/{name}" for size, name in regressions)
+            )
+            if args.fail_on_regression:
+                return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,11 +1,42 @@
 import pandas as pd
+import numpy as np
 import io
+import os
+import hashlib
+import json
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 import logging
+from modules.workbook_loader import load_survey_workbook, SurveyWorkbook
+from modules.incremental import sort_survey_run, merge_sorted_runs, frame_fingerprint
+from modules.dtype_optimizer import optimize_dtypes, summarize_memory_report
+from modules.column_blocks import ColumnBlockStore
+from modules.response_order import order_by_response_time
+from modules.pipeline_trace import PipelineTrace, KIND_FILE, KIND_CLIENT
+from modules.shared_cache import KIND_AGGREGATION
+from modules.export import MAPPING_COLUMNS
+from modules.background_job import JobCancelled
+from modules.filename_index import (
+    get_filename_index, repair_filename, format_ambiguous_matches, MATCH_EXACT, MATCH_AMBIGUOUS, MATCH_LABELS
+)
 
 # ログ設定
 logging.basicConfig(level=logging.INFO)
 
+# 並列読み込みを行う最小ファイル数（これ未満は逐次処理の方が速い）
+PARALLEL_MIN_FILES = 4
+
+# 進捗を通知する処理段階（progress_callback の stage）
+PROGRESS_READ = '読み込み'
+PROGRESS_MERGE = '結合'
+PROGRESS_CLIENTS = 'クライアント別集計'
+# 全体の進捗に対する各処理段階の重み（BackgroundJob の stage_weights）
+PROGRESS_WEIGHTS = {PROGRESS_READ: 0.7, PROGRESS_MERGE: 0.1, PROGRESS_CLIENTS: 0.2}
+
+# 集計計画の形式を変更した場合は値を上げ、以前の集計計画を無効にする
+CLIENT_PLAN_VERSION = 2
+
 # 全クライアントに共通で含まれる固定質問
 FIXED_QUESTIONS = [
     'あなたの年代性別を教えてください。',
@@ -23,7 +54,7 @@ def extract_question_mapping_from_survey(uploaded_file):
     アンケートファイルの質問対応表シートから質問とその選択肢を抽出する
 
     Args:
-        uploaded_file: アップロードされたExcelファイル
+        uploaded_file: アップロードされたExcelファイル、または SurveyWorkbook
 
     Returns:
         list: 質問対応表と同じ形式の辞書のリスト
@@ -31,38 +62,670 @@ def extract_question_mapping_from_survey(uploaded_file):
                {'番号': '1', '条件': '', '内容': '選択肢1', '区分': ''}, ...]
     """
     try:
-        # 質問対応表シートが存在するかチェック
-        xl_file = pd.ExcelFile(uploaded_file)
-        if '質問対応表' not in xl_file.sheet_names:
-            return []
-
-        # 質問対応表シートを読み込み
-        question_df = pd.read_excel(uploaded_file, sheet_name='質問対応表', header=1)
-
-        # データをクリーンアップ
-        mapping_data = []
-        for _, row in question_df.iterrows():
-            # 空行をスキップ
-            if pd.isna(row.iloc[0]) and pd.isna(row.iloc[2]):
+        return load_survey_workbook(uploaded_file).question_mapping()
+
+    except Exception as e:
+        logging.warning(f"質問対応表の読み込みに失敗: {e}")
+        return []
+
+
+def build_prefix_index(mapping):
+    """
+    「キー + '_'」で始まる列名を高速に検索するためのインデックスを作成する
+
+    Args:
+        mapping: 質問番号 → 質問文、または 質問文 → 質問番号 の辞書
+
+    Returns:
+        dict: 文字列のキー → 元の辞書での登場順
+    """
+    return {key: order for order, key in enumerate(mapping) if isinstance(key, str)}
+
+
+def find_prefix(col, prefix_index):
+    """
+    列名が「キー + '_'」で始まるキーを探す
+
+    列名を '_' の位置で区切った各接頭辞をインデックスで引くため、
+    キーの数に関係なく列名の '_' の数だけの検索で済む。
+    複数のキーが該当する場合は、元の辞書で最初に登場するキーを返す
+    （辞書を先頭から走査して最初に一致したキーを採用する場合と同じ結果）。
+
+    Args:
+        col: 列名
+        prefix_index: build_prefix_index で作成したインデックス
+
+    Returns:
+        str: 該当するキー（見つからない場合は None）
+    """
+    col_str = str(col)
+    found_key = None
+    found_order = None
+    pos = col_str.find('_')
+    while pos != -1:
+        order = prefix_index.get(col_str[:pos])
+        if order is not None and (found_order is None or order < found_order):
+            found_key = col_str[:pos]
+            found_order = order
+        pos = col_str.find('_', pos + 1)
+    return found_key
+
+
+def build_text_to_question_map(question_master_df):
+    """
+    質問マスターから 質問文 → 質問番号 の辞書を作成する
+
+    すべてのファイル列から質問マッピングを収集する（固定質問を含む全質問を確実にマッピング）。
+    同じ質問文が複数のファイルにある場合は、列の並び順で最初のファイルの質問番号を使用する。
+
+    Args:
+        question_master_df: 質問マスターデータフレーム
+
+    Returns:
+        dict: 質問文 → 質問番号 の辞書（最初に見つかったファイル列・行の順）
+    """
+    file_columns = [col for col in question_master_df.columns if col != '質問文' and col.endswith('.xlsx')]
+    if not file_columns:
+        return {}
+
+    # ファイル列ごとに縦に並べ（列の順 → 行の順）、各質問文の最初の質問番号を採用する
+    long_df = question_master_df[['質問文'] + file_columns].melt(
+        id_vars='質問文', value_vars=file_columns, var_name='ファイル名', value_name='質問番号'
+    )
+    long_df = long_df.dropna(subset=['質問文', '質問番号']).drop_duplicates(subset='質問文')
+    return dict(zip(long_df['質問文'], long_df['質問番号']))
+
+
+def build_question_block_index(question_mapping, question_master_df):
+    """
+    質問文から、クライアント別マッピングに載せる行を引くための索引を作成する
+
+    質問対応表データを一度だけ走査し、各質問文について最初に登場した質問行と、
+    その直後から次の質問行までの選択肢行（番号が数字で内容がある行）をまとめる。
+    質問対応表に見つからない質問文は、質問マスターで最初に該当する行の
+    最初の質問番号を使った1行をフォールバックとして登録する。
+
+    Args:
+        question_mapping: 全ファイルの質問対応表データ（辞書のリスト）
+        question_master_df: 質問マスターデータフレーム
+
+    Returns:
+        dict: 質問文 → 質問対応表形式の辞書のリスト
+    """
+    question_blocks = {}
+    current_block = None
+    for entry in question_mapping:
+        # 質問のメイン行（番号がQ-で始まる）
+        if entry['番号'].startswith('Q-'):
+            current_block = None
+            if entry['内容'] not in question_blocks:
+                current_block = [entry]
+                question_blocks[entry['内容']] = current_block
+        # 選択肢（数字の番号で内容がある）
+        elif current_block is not None and entry['番号'].isdigit() and entry['内容'].strip():
+            current_block.append(entry)
+
+    # 質問対応表に見つからない場合のフォールバック（質問マスターの最初の質問番号）
+    file_columns = [col for col in question_master_df.columns if col.endswith('.xlsx')]
+    if file_columns:
+        # 各行で最初に値がある質問番号を求める
+        numbers = question_master_df[file_columns].to_numpy(dtype=object)
+        has_number = pd.notna(numbers)
+        first_numbers = numbers[np.arange(len(numbers)), has_number.argmax(axis=1)]
+        fallback_df = pd.DataFrame({
+            '質問文': question_master_df['質問文'].to_numpy(),
+            '番号': first_numbers,
+            '有効': has_number.any(axis=1)
+        })
+        # 同じ質問文が複数行ある場合は最初の行のみを使用
+        fallback_df = fallback_df.drop_duplicates(subset='質問文')
+        fallback_df = fallback_df[fallback_df['有効']]
+        for question_text, q_num in zip(fallback_df['質問文'], fallback_df['番号']):
+            if question_text not in question_blocks:
+                question_blocks[question_text] = [{
+                    '番号': q_num,
+                    '条件': '',
+                    '内容': question_text,
+                    '区分': ''
+                }]
+
+    return question_blocks
+
+
+def build_rename_map(columns, q_to_text_map):
+    """
+    dataシートの列名（質問番号）を質問文に変換するための辞書を作成する
+
+    Args:
+        columns: dataシートの列名
+        q_to_text_map: 質問番号 → 質問文 の辞書
+
+    Returns:
+        dict: 元の列名 → 変換後の列名（変換対象の列のみ）
+    """
+    new_columns = {}
+    prefix_index = build_prefix_index(q_to_text_map)
+    for col in columns:
+        if col in q_to_text_map:
+            new_columns[col] = q_to_text_map[col]
+        else:
+            # FA列などのサフィックス付きの列（例: Q-001_FA）
+            q_num = find_prefix(col, prefix_index)
+            if q_num is not None:
+                suffix = str(col).replace(q_num, '')
+                new_columns[col] = f"{q_to_text_map[q_num]}{suffix}"
+    return new_columns
+
+
+def build_column_plan(client_settings_df):
+    """
+    いずれかのクライアントの集計に必要な列を判定するための情報を作成する
+
+    固定質問とクライアント設定の質問文の和集合を求める。
+    質問文と完全一致する列と、「質問文 + '_'」で始まる列（FA列など）が必要な列となる。
+
+    Args:
+        client_settings_df: クライアント設定データフレーム
+
+    Returns:
+        dict: {'questions': 質問文のリスト, 'prefix_index': 前方一致検索用インデックス}
+    """
+    questions = list(dict.fromkeys(FIXED_QUESTIONS + client_settings_df['集計対象の質問文'].tolist()))
+    return {
+        'questions': questions,
+        'prefix_index': build_prefix_index(questions),
+    }
+
+
+def is_required_column(column_name, column_plan):
+    """
+    列（質問文に変換後の列名）がいずれかのクライアントの集計に必要かを判定する
+
+    Args:
+        column_name: 質問文に変換後の列名
+        column_plan: build_column_plan で作成した必要列の情報
+
+    Returns:
+        bool: 必要な列の場合True
+    """
+    if 'columns' in column_plan:
+        return column_name in column_plan['columns']
+    if column_name in ('NO', '回答日時') or column_name in column_plan['prefix_index']:
+        return True
+    return find_prefix(column_name, column_plan['prefix_index']) is not None
+
+
+def column_plan_from_client_plan(client_settings_df, client_plan):
+    """
+    キャッシュから読み込んだ集計計画から、読み込む列の情報を作成する
+
+    集計計画はファイルごとのヘッダーが同じ場合だけ再利用されるため、各クライアントが選ぶ列
+    （source_columns）の和集合が、build_column_plan で判定する必要な列と一致する。
+    列名の前方一致の検索をせずに、列名の集合で判定できる。
+
+    Args:
+        client_settings_df: クライアント設定データフレーム
+        client_plan: 集計計画（compile_client_plan の戻り値）
+
+    Returns:
+        dict: build_column_plan と同じ情報に 'columns'（必要な列名の集合）を加えたもの
+    """
+    column_plan = build_column_plan(client_settings_df)
+    column_plan['columns'] = {
+        column for client in client_plan['clients'] for column in client['source_columns']
+    } | {'NO', '回答日時'}
+    return column_plan
+
+
+def read_plan_inputs(workbook, q_to_text_map):
+    """
+    集計計画のキャッシュキー用に、1つのファイルのヘッダーと質問対応表を確認する
+
+    dataシートはヘッダー行だけを読み込む（解析済みの場合は解析結果の列名を使う）。
+
+    Args:
+        workbook: SurveyWorkbook
+        q_to_text_map: 質問番号 → 質問文 の辞書
+
+    Returns:
+        list: [質問文に変換後のdataシートの列名のリスト, 質問対応表シートのフィンガープリント]
+              （読み込めない場合は None、集計でも読み込めないため集計計画は保存されない）
+    """
+    try:
+        data_columns = workbook.data_columns
+        new_columns = build_rename_map(data_columns, q_to_text_map)
+        question_sheet = workbook.question_sheet
+    except Exception as e:
+        logging.warning(f"Failed to read headers of {workbook.name} for the client plan: {e}")
+        return None
+    return [
+        [str(new_columns.get(col, col)) for col in data_columns],
+        None if question_sheet is None else frame_fingerprint(question_sheet),
+    ]
+
+
+def client_plan_key(client_settings_df, question_master_df, file_inputs):
+    """
+    クライアント別の集計計画の入力からキャッシュキーを計算する
+
+    クライアントごとの質問文、質問マスターの内容、ファイルごとのヘッダー（質問文に変換後の列名）と
+    質問対応表から計算する。dataシートの値は読み込まないため、集計の前にキーを求められる。
+
+    Args:
+        client_settings_df: クライアント設定データフレーム
+        question_master_df: 質問マスターデータフレーム
+        file_inputs: ファイルごとの read_plan_inputs の戻り値のリスト（アップロード順）
+
+    Returns:
+        str: SHA-256のハッシュ値
+    """
+    digest = hashlib.sha256()
+    clients = [
+        [client_name, group['集計対象の質問文'].tolist()]
+        for client_name, group in client_settings_df.groupby('クライアント名')
+    ]
+    inputs = {
+        'version': CLIENT_PLAN_VERSION,
+        'clients': clients,
+        'files': file_inputs,
+    }
+    digest.update(json.dumps(inputs, ensure_ascii=False, default=repr).encode('utf-8'))
+    digest.update(frame_fingerprint(question_master_df).encode('ascii'))
+    return digest.hexdigest()
+
+
+def compile_client_plan(client_settings_df, question_master_df, columns, question_mapping, key=None):
+    """
+    クライアント設定と質問マスターから、クライアント別の集計計画を作成する
+
+    クライアントごとに、固定質問を加えた質問文、中間データから選ぶ列（質問文と完全一致する列、
+    「質問文 + '_'」で始まるFA列などの列、NO・回答日時）、出力する列名（質問番号に再変換した列名）、
+    マッピングシートの行（質問対応表形式の質問行 + 選択肢行）を求める。
+    選ぶ列・出力する列名・マッピング行がすべて同じクライアントには同じ出力グループ（'output_group'）を付け、
+    集計結果と出力ファイルをグループごとに一度だけ作成できるようにする（基準ファイル名のみクライアントごとに異なる）。
+    集計計画は辞書とリストだけで構成し、JSONで保存・確認できる。
+
+    Args:
+        client_settings_df: クライアント設定データフレーム
+        question_master_df: 質問マスターデータフレーム
+        columns: 中間データ（全結合データ）の列名
+        question_mapping: 全ファイルの質問対応表データ（辞書のリスト）
+        key: 集計計画のキャッシュキー（client_plan_key、集計計画に記録する）
+
+    Returns:
+        dict: {'version', 'key', 'clients': [{'client_name', 'questions', 'source_columns',
+               'output_columns', 'mapping_rows', 'output_group'}, ...]}（クライアント名の順）
+    """
+    # 質問文 → 質問対応表の行（質問行 + 選択肢行）の索引
+    question_blocks = build_question_block_index(question_mapping, question_master_df)
+    # 質問文 → 質問番号 の対応はクライアントに依存しないため、全クライアントで共有する
+    text_to_q_map = build_text_to_question_map(question_master_df)
+    text_prefix_index = build_prefix_index(text_to_q_map)
+
+    client_questions = [
+        (client_name, list(dict.fromkeys(FIXED_QUESTIONS + group['集計対象の質問文'].tolist())))
+        for client_name, group in client_settings_df.groupby('クライアント名')
+    ]
+
+    # 質問文 → 「質問文 + '_'」で始まる列（列の順）を、列名を '_' の位置で区切って一度だけ求める
+    columns = list(columns)
+    column_set = set(columns)
+    all_questions = {q for _, questions in client_questions for q in questions if isinstance(q, str)}
+    suffixed_columns = {}
+    for col in columns:
+        col_str = str(col)
+        pos = col_str.find('_')
+        while pos != -1:
+            if col_str[:pos] in all_questions:
+                suffixed_columns.setdefault(col_str[:pos], []).append(col)
+            pos = col_str.find('_', pos + 1)
+
+    # 列名を質問文から質問番号へ再変換（FA列も考慮、全クライアントで共有する）
+    output_names = {}
+
+    def output_name(col_name):
+        if col_name not in output_names:
+            q_text = find_prefix(col_name, text_prefix_index)
+            if q_text is not None:
+                suffix = str(col_name).replace(q_text, '')
+                output_names[col_name] = text_to_q_map[q_text] + suffix
+            # サフィックスがなく、完全一致する場合
+            elif col_name in text_to_q_map:
+                output_names[col_name] = text_to_q_map[col_name]
+            else:
+                output_names[col_name] = col_name
+        return output_names[col_name]
+
+    clients = []
+    for client_name, questions in client_questions:
+        source_columns = ['NO']
+        for q in questions:
+            if q in column_set:
+                source_columns.append(q)
+            source_columns.extend(suffixed_columns.get(q, []))
+        source_columns = list(dict.fromkeys(source_columns))
+        if '回答日時' in column_set:
+            source_columns.append('回答日時')
+
+        output_columns = [output_name(col) for col in source_columns]
+        # 質問とその選択肢（質問対応表に見つからない場合は質問マスターの質問番号）
+        mapping_rows = [
+            {column: row[column] for column in MAPPING_COLUMNS}
+            for q in questions for row in question_blocks.get(q, [])
+        ]
+        # 出力内容（列・列名・マッピング行）が同じクライアントを同じグループにする
+        output_group = hashlib.sha256(json.dumps(
+            [source_columns, output_columns, mapping_rows], ensure_ascii=False, default=repr
+        ).encode('utf-8')).hexdigest()[:16]
+        clients.append({
+            'client_name': client_name,
+            'questions': questions,
+            'source_columns': source_columns,
+            'output_columns': output_columns,
+            'mapping_rows': mapping_rows,
+            'output_group': output_group,
+        })
+    return {'version': CLIENT_PLAN_VERSION, 'key': key, 'clients': clients}
+
+
+def summarize_client_plan(client_plan):
+    """
+    集計計画の概要（クライアントごとの質問数・列数・マッピング行数・出力グループ）を返す
+
+    Args:
+        client_plan: compile_client_plan で作成した集計計画
+
+    Returns:
+        pandas.DataFrame: クライアント名、質問数、列数、マッピング行数、出力グループの一覧
+    """
+    return pd.DataFrame([
+        {
+            'クライアント名': client['client_name'],
+            '質問数': len(client['questions']),
+            '列数': len(client['source_columns']),
+            'マッピング行数': len(client['mapping_rows']),
+            '出力グループ': client['output_group'],
+        }
+        for client in client_plan['clients']
+    ], columns=['クライアント名', '質問数', '列数', 'マッピング行数', '出力グループ'])
+
+
+def _ingest_survey_file(uploaded_file, filename, q_to_text_map, cache=None, column_plan=None):
+    """
+    1つのアンケートファイルを読み込み、列名を質問番号から質問文へ変換する
+
+    Args:
+        uploaded_file: アップロードされたExcelファイル、または SurveyWorkbook
+        filename: 文字化け対策済みのファイル名（ログ表示用）
+        q_to_text_map: 質問番号 → 質問文 の辞書
+        cache: 解析済みシートのキャッシュ（Noneの場合は使用しない）
+        column_plan: build_column_plan で作成した必要列の情報（Noneの場合はすべての列を読み込む）
+
+    Returns:
+        pandas.DataFrame: 列名変換済みのデータ（読み込めなかった場合は None）
+        list: このファイルの質問対応表データ
+        list: ログメッセージのリスト
+    """
+    logs = []
+    file_question_mapping = []
+    try:
+        # ファイルを一度だけ開き、dataシートと質問対応表を同じハンドルから読み込む
+        workbook = load_survey_workbook(uploaded_file, cache)
+        if column_plan is None:
+            df_data = workbook.data
+            new_columns = build_rename_map(df_data.columns, q_to_text_map)
+        else:
+            # ヘッダーから変換後の列名を求め、集計に必要な列だけを読み込む
+            data_columns = workbook.data_columns
+            new_columns = build_rename_map(data_columns, q_to_text_map)
+            usecols = [
+                i for i, col in enumerate(data_columns)
+                if is_required_column(new_columns.get(col, col), column_plan)
+            ]
+            if not usecols:
+                logs.append(f"'{filename}' には集計対象の列がありません。スキップします。")
+                return None, file_question_mapping, logs
+            df_data = workbook.read_data(usecols=usecols)
+            logs.append(f"'{filename}' の {len(data_columns)}列のうち {len(usecols)}列を読み込みます。")
+        if df_data.empty:
+            logs.append(f"'{filename}' のdataシートは空です。スキップします。")
+            return None, file_question_mapping, logs
+
+        # 🆕 このファイルの質問対応表データを抽出して追加
+        file_question_mapping = extract_question_mapping_from_survey(workbook)
+        if file_question_mapping:
+            logs.append(f"'{filename}' から {len(file_question_mapping)} 行の質問対応表データを抽出")
+
+        df_data = df_data.rename(columns=new_columns)
+
+        logs.append(f"'{filename}' のデータを読み込み完了。({len(df_data)}件)")
+        return df_data, file_question_mapping, logs
+
+    except Exception as e:
+        logs.append(f"'{filename}' のデータシート処理中にエラー: {e}")
+        return None, file_question_mapping, logs
+
+
+def _ingest_survey_payload(name, content, filename, q_to_text_map, cache=None, column_plan=None,
+                           track_memory=False):
+    """
+    ワーカープロセス用: バイト列からファイルを復元して _ingest_survey_file を実行する
+
+    Returns:
+        tuple: _ingest_survey_file の戻り値
+        dict: ワーカープロセス内での計測結果（seconds、track_memory=True の場合は peak_bytes / retained_bytes）
+    """
+    trace = PipelineTrace(track_memory=track_memory)
+    with trace.span('読み込み'):
+        uploaded_file = io.BytesIO(content)
+        uploaded_file.name = name
+        result = _ingest_survey_file(uploaded_file, filename, q_to_text_map, cache, column_plan)
+    trace.close()
+    record = trace.spans[0]
+    return result, {key: record[key] for key in ('seconds', 'peak_bytes', 'retained_bytes')}
+
+
+def _report_progress(progress_callback, stage, completed, total, name=''):
+    """進捗を通知する（progress_callback が None の場合は何もしない）"""
+    if progress_callback is not None:
+        progress_callback(stage, completed, total, name)
+
+
+def _file_size(uploaded_file):
+    """アップロードされたファイルのサイズ（bytes）を返す"""
+    size = getattr(uploaded_file, 'size', None)
+    if isinstance(size, int):
+        return size
+    return len(load_survey_workbook(uploaded_file).read_bytes())
+
+
+def _frame_metrics(df):
+    """計測用に、データの行数・列数を返す（データがない場合は空の辞書）"""
+    if df is None:
+        return {}
+    return {'rows': len(df), 'cols': len(df.columns)}
+
+
+def _run_ingestion(ingest_tasks, max_workers, parallel_min_files, logs, cache=None, column_plan=None,
+                   trace=None, progress_callback=None):
+    """
+    ファイルの読み込みタスクを実行し、アップロード順に結果を返す
+
+    タスク数が parallel_min_files 未満、またはワーカー数が1の場合は逐次処理する。
+    dataシートを解析済みの SurveyWorkbook は並列実行の対象にせず、解析結果をそのまま使う。
+    プロセスプールが利用できない環境では逐次処理にフォールバックする。
+    ファイルごとの処理時間・行数・列数・ファイルサイズを trace に記録する。
+
+    Args:
+        ingest_tasks: (uploaded_file, filename, q_to_text_map, file_logs) のリスト
+        max_workers: ワーカープロセス数（Noneの場合はCPU数）
+        parallel_min_files: 並列読み込みを行う最小ファイル数
+        logs: ログメッセージのリスト（並列実行の情報を追記する）
+        cache: 解析済みシートのキャッシュ（Noneの場合は使用しない）
+        column_plan: 必要列の情報（Noneの場合はすべての列を読み込む）
+        trace: 処理時間の記録先（PipelineTrace、Noneの場合は記録しない）
+        progress_callback: ファイルを1つ読み込むごとに呼び出す関数（aggregate_data と同じ）
+
+    Returns:
+        list: _ingest_survey_file の戻り値のリスト（ingest_tasks と同じ順序）
+    """
+    if trace is None:
+        trace = PipelineTrace()
+    results = [None] * len(ingest_tasks)
+    total = len(ingest_tasks)
+    _report_progress(progress_callback, PROGRESS_READ, 0, total)
+    # dataシートを解析済みのワークブック（質問マスター作成ページで読み込んだファイルなど）は
+    # ワーカープロセスに渡さず、解析結果をそのまま使う
+    parallel_indices = [
+        index for index, task in enumerate(ingest_tasks)
+        if not (isinstance(task[0], SurveyWorkbook) and task[0].is_data_parsed)
+    ]
+    workers = min(max_workers or os.cpu_count() or 1, len(parallel_indices))
+    if workers > 1 and len(parallel_indices) >= parallel_min_files:
+        try:
+            payloads = []
+            for index in parallel_indices:
+                uploaded_file, filename, q_to_text_map, _ = ingest_tasks[index]
+                workbook = load_survey_workbook(uploaded_file)
+                payloads.append((
+                    workbook.name, workbook.read_bytes(), filename, q_to_text_map, cache, column_plan,
+                    trace.track_memory
+                ))
+
+            logs.append(f"{len(payloads)}個のファイルを{workers}プロセスで並列に読み込みます。")
+            context = multiprocessing.get_context('spawn')
+            with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+                futures = [executor.submit(_ingest_survey_payload, *payload) for payload in payloads]
+                try:
+                    for done, (index, payload, future) in enumerate(zip(parallel_indices, payloads, futures), start=1):
+                        result, stats = future.result()
+                        # ワーカープロセスで計測したメモリは、そのプロセス内での値
+                        trace.add('読み込み', stats.pop('seconds'), name=payload[2], kind=KIND_FILE,
+                                  bytes=len(payload[1]), **stats, **_frame_metrics(result[0]))
+                        results[index] = result
+                        _report_progress(progress_callback, PROGRESS_READ, done, total, payload[2])
+                except JobCancelled:
+                    # 開始前のファイルは読み込まずに終了する
+                    for future in futures:
+                        future.cancel()
+                    raise
+        except JobCancelled:
+            raise
+        except Exception as e:
+            logging.warning(f"Parallel ingestion failed, falling back to serial: {e}")
+            logs.append(f"並列読み込みに失敗したため、逐次処理に切り替えます。({e})")
+            results = [None] * len(ingest_tasks)
+
+    done = sum(result is not None for result in results)
+    for index, (uploaded_file, filename, q_to_text_map, _) in enumerate(ingest_tasks):
+        if results[index] is not None:
+            continue
+        with trace.span('読み込み', filename, KIND_FILE, bytes=_file_size(uploaded_file)) as span:
+            result = _ingest_survey_file(uploaded_file, filename, q_to_text_map, cache, column_plan)
+            span.update(_frame_metrics(result[0]))
+        results[index] = result
+        done += 1
+        _report_progress(progress_callback, PROGRESS_READ, done, total, filename)
+    return results
+
+
+def _merge_incremental(ingest_tasks, max_workers, parallel_min_files, logs, store,
+                       cache=None, column_plan=None, column_blocks=False, trace=None, progress_callback=None):
+    """
+    増分集計: 前回から変更のないファイルは保存済みの読み込み結果を使い、
+    新規・変更されたファイルだけを読み込んで回答日時順に併合する
+
+    Args:
+        ingest_tasks: (uploaded_file, filename, q_to_text_map, file_logs) のリスト
+        max_workers: ワーカープロセス数（Noneの場合はCPU数）
+        parallel_min_files: 並列読み込みを行う最小ファイル数
+        logs: ログメッセージのリスト
+        store: ファイルごとの読み込み結果の保存先（IncrementalStore）
+        cache: 解析済みシートのキャッシュ（Noneの場合は使用しない）
+        column_plan: 必要列の情報（Noneの場合はすべての列を読み込む）
+        column_blocks: Trueの場合、全結合せずにファイルごとの列ブロックのまま返す
+        trace: 処理時間の記録先（PipelineTrace、Noneの場合は記録しない）
+        progress_callback: 進捗を通知する関数（aggregate_data と同じ、読み込むファイルの数で通知する）
+
+    Returns:
+        pandas.DataFrame | ColumnBlockStore: 中間データ（全結合データ、回答日時順）
+        list: 全ファイルの質問対応表データ
+        int: データを読み込めたファイルの数
+    """
+    if trace is None:
+        trace = PipelineTrace()
+    fingerprints = []
+    entries = {}
+    pending = {}
+    with trace.span('増分集計の照合', bytes=0) as span:
+        for task in ingest_tasks:
+            uploaded_file, filename, q_to_text_map, _ = task
+            content = load_survey_workbook(uploaded_file).read_bytes()
+            span['bytes'] += len(content)
+            key = store.fingerprint(content, filename, q_to_text_map, column_plan)
+            fingerprints.append(key)
+            if key in entries or key in pending:
                 continue
+            entry = store.load(key)
+            if entry is None:
+                pending[key] = task
+            else:
+                entries[key] = entry
 
-            # 4列の構造に変換
+    logs.append(
+        f"増分集計: {len(ingest_tasks)}個のファイルのうち {len(ingest_tasks) - len(pending)}個は"
+        f"前回の読み込み結果を再利用し、{len(pending)}個を読み込みます。"
+    )
+    with trace.span('読み込み', bytes=sum(_file_size(task[0]) for task in pending.values())) as span:
+        ingest_results = _run_ingestion(
+            list(pending.values()), max_workers, parallel_min_files, logs, cache, column_plan, trace,
+            progress_callback
+        )
+        for key, (df_data, file_question_mapping, ingest_logs) in zip(pending, ingest_results):
             entry = {
-                '番号': str(row.iloc[0]) if pd.notna(row.iloc[0]) else '',
-                '条件': str(row.iloc[1]) if pd.notna(row.iloc[1]) else '',
-                '内容': str(row.iloc[2]) if pd.notna(row.iloc[2]) else '',
-                '区分': str(row.iloc[3]) if pd.notna(row.iloc[3]) else ''
+                'data': None if df_data is None else sort_survey_run(df_data),
+                'rows': 0 if df_data is None else len(df_data),
+                'mapping': file_question_mapping,
+                'logs': ingest_logs,
             }
-            mapping_data.append(entry)
+            entries[key] = entry
+            # 読み込めなかったファイルは次回も読み込み直す
+            if df_data is not None:
+                store.store(key, entry)
+        span.update(rows=sum(entries[key]['rows'] for key in pending))
+
+    # アップロード順に結果を統合する
+    comprehensive_question_mapping = []
+    runs = []
+    for (_, _, _, file_logs), key in zip(ingest_tasks, fingerprints):
+        entry = entries[key]
+        logs.extend(file_logs)
+        logs.extend(entry['logs'])
+        comprehensive_question_mapping.extend(entry['mapping'])
+        if entry['data'] is not None:
+            runs.append((entry['data'], entry['rows']))
 
-        return mapping_data
+    if not runs:
+        raise ValueError("集計対象のデータが見つかりませんでした。")
 
-    except Exception as e:
-        logging.warning(f"質問対応表の読み込みに失敗: {e}")
-        return []
+    _report_progress(progress_callback, PROGRESS_MERGE, 0, 1)
+    logs.append("--- 全データの結合処理を開始 ---")
+    with trace.span('結合') as span:
+        if column_blocks:
+            merged_df = ColumnBlockStore([df for df, _ in runs], [rows for _, rows in runs])
+            logs.append(f"全ファイルのデータを列ブロックのまま保持しました。合計: {len(merged_df)}件、{len(merged_df.columns)}列")
+        else:
+            merged_df = merge_sorted_runs(runs)
+            logs.append(f"全ファイルのデータを回答日時順に併合しました。合計: {len(merged_df)}件")
+        span.update(_frame_metrics(merged_df))
+    return merged_df, comprehensive_question_mapping, len(runs)
 
 
-def aggregate_data(data_files, question_master_df, client_settings_df):
+def aggregate_data(data_files, question_master_df, client_settings_df,
+                   max_workers=None, parallel_min_files=PARALLEL_MIN_FILES, cache=None,
+                   column_projection=False, incremental_store=None,
+                   optimize_memory=False, memory_report=None, column_blocks=False, trace=None,
+                   result_cache=None, progress_callback=None, plan_cache=None, plan_report=None):
     """
     クライアント設定に基づき、アンケートデータを集計し、
     クライアントごとに個別のデータフレームとして返す。
@@ -71,10 +734,43 @@ def aggregate_data(data_files, question_master_df, client_settings_df):
         data_files: アップロードされたデータファイルのリスト
         question_master_df: 質問マスターデータフレーム
         client_settings_df: クライアント設定データフレーム
+        max_workers: ファイル読み込みに使うワーカープロセス数（Noneの場合はCPU数、1の場合は逐次処理）
+        parallel_min_files: 並列読み込みを行う最小ファイル数（これより少ない場合は逐次処理）
+        cache: 解析済みシートのキャッシュ（ParsedWorkbookCache、Noneの場合は使用しない）
+        column_projection: Trueの場合、いずれかのクライアントの集計に必要な列だけを読み込む
+                           （中間データもそれらの列のみになる）
+        incremental_store: 増分集計の保存先（IncrementalStore、Noneの場合は全ファイルを読み込む）
+                           指定した場合、前回から変更のないファイルは読み込み結果を再利用し、
+                           回答日時が同じ行はファイルの順序・ファイル内の行の順序で並べる
+        optimize_memory: Trueの場合、中間データの各列を値を変えずにメモリの少ない型に変換する
+                         （選択肢列 → 欠損値対応の小さい整数型/カテゴリ型、自由回答 → Arrow文字列型）
+        memory_report: リストを渡すと、optimize_memory=True の場合に列ごとのメモリ使用量
+                       （optimize_dtypes のレポートの各行の辞書）を追加する
+        column_blocks: Trueの場合、全ファイルを横に連結せず、ファイルごとの列ブロックのまま保持し、
+                       クライアント別のデータは必要な列だけを各ブロックから組み立てる
+                       （ファイルごとに質問が異なり、列の和集合が大きい場合にメモリを削減できる）
+        trace: PipelineTrace を渡すと、処理段階（照合・読み込み・結合・並べ替え・型の最適化・
+               クライアント別集計など）、ファイル、クライアントごとの処理時間と
+               行数・列数・読み込んだバイト数を記録する
+               （PipelineTrace(track_memory=True) の場合はピークメモリ・増加メモリも記録する）
+        result_cache: 共有キャッシュ（SharedMemoryCache）を渡すと、ファイルの内容・質問マスター・
+                      クライアント設定・集計の設定が同じ集計結果を再利用する
+                      （再利用した結果は他のセッションと共有しているため、変更しないこと）
+        progress_callback: progress_callback(stage, completed, total, name) の形で進捗を通知する関数
+                           stage: '読み込み'（ファイルごと）、'結合'（0/1 → 1/1）、'クライアント別集計'（クライアントごと）
+                           completed / total: 完了した件数 / 全体の件数、name: 完了したファイル名・開始するクライアント名
+                           関数が例外（JobCancelled など）を送出すると、その時点で集計を中断する
+        plan_cache: 集計計画のキャッシュ（ClientPlanCache、Noneの場合は毎回作成する）
+                    読み込みの前にファイルのヘッダーと質問対応表だけを確認してキーを求め、
+                    クライアント設定・質問マスター・ヘッダー・質問対応表が同じ場合は
+                    クライアント別の列の選択・列名の変換・マッピング行を求める処理を省略する
+                    （column_projection=True の場合は、集計計画で選ぶ列だけを読み込む）
+        plan_report: リストを渡すと、クライアントごとの集計計画（compile_client_plan の 'clients' の各要素）を追加する
     
     Returns:
         dict: クライアント名をキー、データフレームを値とする辞書
-        pandas.DataFrame: 中間データ（全結合データ）
+              （出力グループが同じクライアントは同じデータフレームを共有するため、変更しないこと）
+        pandas.DataFrame | ColumnBlockStore: 中間データ（全結合データ、column_blocks=True の場合は ColumnBlockStore）
         list: ログメッセージのリスト
     """
     # ファイルが空の場合のエラーチェック
@@ -82,6 +778,16 @@ def aggregate_data(data_files, question_master_df, client_settings_df):
         raise ValueError("データファイルがアップロードされていません。少なくとも1つのExcelファイルを選択してください。")
 
     logging.info(f"Received {len(data_files)} data files for aggregation")
+    if trace is None:
+        trace = PipelineTrace()
+    if result_cache is not None:
+        return _aggregate_with_result_cache(
+            result_cache, data_files, question_master_df, client_settings_df, trace, memory_report,
+            max_workers=max_workers, parallel_min_files=parallel_min_files, cache=cache,
+            column_projection=column_projection, incremental_store=incremental_store,
+            optimize_memory=optimize_memory, column_blocks=column_blocks, progress_callback=progress_callback,
+            plan_cache=plan_cache, plan_report=plan_report
+        )
     logs = []
     all_data_list = []
 
@@ -93,262 +799,295 @@ def aggregate_data(data_files, question_master_df, client_settings_df):
 
     # 🆕 質問対応表の包括的データを収集
     comprehensive_question_mapping = []
+    ingest_tasks = []
 
+    matching_span = trace.begin('ファイル名の照合')
+    # 質問マスターのファイル列の索引（文字化けの修正・正規化は question_master.py と共通）
+    filename_index = get_filename_index(question_master_df)
+    target_files = []
     for uploaded_file in data_files:
-        # ファイル名の文字化け対策（question_master.pyと同じ処理）
-        original_filename = uploaded_file.name
-        filename = original_filename
-        
-        # デバッグ用ログ
-        logging.info(f"Original filename in aggregation: {repr(original_filename)}")
-        
-        # 文字化けの検出と修正
-        try:
-            # 一般的な文字化けパターンをチェック
-            if any(ord(c) > 127 and ord(c) < 256 for c in filename):
-                # Latin-1でエンコードされた可能性がある場合
-                try:
-                    filename = filename.encode('latin-1').decode('utf-8')
-                except:
-                    pass
-            
-            # それでも文字化けしている場合は、安全なファイル名を生成
-            if '�' in filename or any(ord(c) > 0xFFFF for c in filename):
-                import hashlib
-                # ファイル名のハッシュ値を使用
-                file_hash = hashlib.md5(uploaded_file.name.encode('utf-8', errors='ignore')).hexdigest()[:8]
-                filename = f"file_{file_hash}.xlsx"
-                logging.warning(f"Filename contains invalid characters in aggregation. Using safe name: {filename}")
-        except Exception:
-            # エラーが発生した場合は、安全なデフォルト名を使用
-            import time
-            filename = f"file_{int(time.time())}.xlsx"
-            
+        filename = repair_filename(uploaded_file.name)
         if filename.endswith('.xlsx') and not filename.startswith('~'):
-            logs.append(f"'{filename}' の処理を開始...")
-            
-            # question_master_dfの列から対応するファイル名の列を探す
-            # 文字化けしたファイル名と修正後のファイル名の両方をチェック
-            file_column = None
-            q_to_text_map = {}
-
-            # 1. 完全一致をチェック
-            if filename in question_master_df.columns:
-                file_column = filename
-            elif original_filename in question_master_df.columns:
-                file_column = original_filename
-            # 2. Plus_マージ完成データ.xlsx の特別なケース
-            elif "Plus_マージ完成データ" in filename:
-                for col in question_master_df.columns:
-                    if "Plus2" in col and not col.startswith("[コピー]"):
-                        file_column = col
-                        break
-            # 3. 部分一致での検索（fallback）
-            else:
-                # ファイル名の主要部分を抽出して検索
-                clean_filename = filename.replace(".xlsx", "")
-                for col in question_master_df.columns:
-                    if col.endswith('.xlsx') and clean_filename in col:
-                        file_column = col
-                        break
-
-            if file_column:
-                file_mapping = question_master_df[['質問文', file_column]].dropna()
-                q_to_text_map = dict(zip(file_mapping[file_column], file_mapping['質問文']))
-                logs.append(f"'{filename}' の質問マッピングを取得しました。({len(q_to_text_map)}個の質問)")
+            target_files.append((uploaded_file, filename))
+    resolutions = filename_index.resolve_files([uploaded_file.name for uploaded_file, _ in target_files])
+
+    # 対応する列の候補が複数あるファイルは、読み込みの前にまとめて報告する（以前と同様に最初の候補の列を使う）
+    ambiguous = format_ambiguous_matches(resolutions)
+    if ambiguous:
+        logs.append(f"質問マスターに対応する列の候補が複数あるファイルがあります。最初の候補の列を使用します。\n{ambiguous}")
+        logging.warning(f"Ambiguous question master columns; using the first candidate.\n{ambiguous}")
+
+    # 汎用マッピング（対応する列がないファイルに使う、最初のファイル列のマッピング）
+    first_file_col = filename_index.columns[0] if filename_index.columns else None
+
+    for (uploaded_file, filename), resolution in zip(target_files, resolutions):
+        original_filename = uploaded_file.name
+        file_logs = [f"'{filename}' の処理を開始..."]
+        file_column = resolution['column']
+        q_to_text_map = {}
+
+        if file_column:
+            file_mapping = question_master_df[['質問文', file_column]].dropna()
+            q_to_text_map = dict(zip(file_mapping[file_column], file_mapping['質問文']))
+            if resolution['match'] == MATCH_AMBIGUOUS:
+                file_logs.append(f"'{filename}' に対応する列の候補が複数あるため、最初の候補の '{file_column}' 列を使用します。（候補: {' / '.join(resolution['candidates'])}）")
+            elif resolution['match'] != MATCH_EXACT:
+                file_logs.append(f"'{filename}' を質問マスターの '{file_column}' 列に対応付けました。（{MATCH_LABELS[resolution['match']]}）")
+            file_logs.append(f"'{filename}' の質問マッピングを取得しました。({len(q_to_text_map)}個の質問)")
+        else:
+            # 具体的なファイルマッピングが見つからない場合でも、ファイルを処理する
+            file_logs.append(f"'{filename}' (元: '{original_filename}') に対応する列が見つかりません。")
+            file_logs.append(f"利用可能な列: {filename_index.columns}")
+
+            if first_file_col:
+                temp_mapping = question_master_df[['質問文', first_file_col]].dropna()
+                q_to_text_map = dict(zip(temp_mapping[first_file_col], temp_mapping['質問文']))
+                file_logs.append(f"'{filename}' では '{first_file_col}' のマッピングを代替使用します。({len(q_to_text_map)}個の質問)")
             else:
-                # 具体的なファイルマッピングが見つからない場合でも、ファイルを処理する
-                # すべてのファイルから利用可能なマッピングを収集
-                logs.append(f"'{filename}' (元: '{original_filename}') に対応する列が見つかりません。")
-                logs.append(f"利用可能な列: {[col for col in question_master_df.columns if col.endswith('.xlsx')]}")
-
-                # 汎用マッピングとして最初に見つかったファイルのマッピングを使用
-                first_file_col = None
-                for col in question_master_df.columns:
-                    if col != '質問文' and col.endswith('.xlsx'):
-                        first_file_col = col
-                        break
-
-                if first_file_col:
-                    temp_mapping = question_master_df[['質問文', first_file_col]].dropna()
-                    q_to_text_map = dict(zip(temp_mapping[first_file_col], temp_mapping['質問文']))
-                    logs.append(f"'{filename}' では '{first_file_col}' のマッピングを代替使用します。({len(q_to_text_map)}個の質問)")
-                else:
-                    logs.append(f"'{filename}' では利用可能なマッピングがありません。元の列名を使用します。")
-
-                logging.warning(f"File column not found for {filename} or {original_filename}. Using generic mapping from {first_file_col}.")
-                logging.info(f"Available columns: {list(question_master_df.columns)}")
-            
-            try:
-                df_data = pd.read_excel(uploaded_file, sheet_name='data')
-                if df_data.empty:
-                    logs.append(f"'{filename}' のdataシートは空です。スキップします。")
-                    continue
-
-                # 🆕 このファイルの質問対応表データを抽出して追加
-                file_question_mapping = extract_question_mapping_from_survey(uploaded_file)
-                if file_question_mapping:
-                    comprehensive_question_mapping.extend(file_question_mapping)
-                    logs.append(f"'{filename}' から {len(file_question_mapping)} 行の質問対応表データを抽出")
-
-                new_columns = {}
-                for col in df_data.columns:
-                    if col in q_to_text_map:
-                        new_columns[col] = q_to_text_map[col]
-                    else:
-                        for q_num, q_text in q_to_text_map.items():
-                            if str(col).startswith(q_num + '_'):
-                                suffix = str(col).replace(q_num, '')
-                                new_columns[col] = f"{q_text}{suffix}"
-                                break
-                df_data.rename(columns=new_columns, inplace=True)
-                
+                file_logs.append(f"'{filename}' では利用可能なマッピングがありません。元の列名を使用します。")
+
+            logging.warning(f"File column not found for {filename} or {original_filename}. Using generic mapping from {first_file_col}.")
+
+        ingest_tasks.append((uploaded_file, filename, q_to_text_map, file_logs))
+    trace.end(matching_span)
+    file_count = len(ingest_tasks)
+
+    # 集計計画のキャッシュを読み込みの前に確認する（ファイルのヘッダー・質問対応表だけを読み込む）
+    # ファイルは SurveyWorkbook として開いたまま、読み込みで再利用する
+    plan_key = None
+    client_plan = None
+    if plan_cache is not None:
+        with trace.span('集計計画の照合', rows=file_count):
+            ingest_tasks = [
+                (load_survey_workbook(uploaded_file, cache), filename, q_to_text_map, file_logs)
+                for uploaded_file, filename, q_to_text_map, file_logs in ingest_tasks
+            ]
+            plan_key = client_plan_key(client_settings_df, question_master_df, [
+                read_plan_inputs(workbook, q_to_text_map) for workbook, _, q_to_text_map, _ in ingest_tasks
+            ])
+            client_plan = plan_cache.load(plan_key)
+
+    # 各ファイルの読み込み・変換（ファイル数が多い場合はワーカープロセスで並列実行）
+    column_plan = None
+    if column_projection:
+        if client_plan is None:
+            column_plan = build_column_plan(client_settings_df)
+        else:
+            # キャッシュの集計計画で選ぶ列だけを読み込む
+            column_plan = column_plan_from_client_plan(client_settings_df, client_plan)
+        logs.append(f"集計に必要な列のみを読み込みます。（対象の質問数: {len(column_plan['questions'])}）")
+    if incremental_store is not None:
+        merged_df, comprehensive_question_mapping, data_file_count = _merge_incremental(
+            ingest_tasks, max_workers, parallel_min_files, logs, incremental_store, cache, column_plan,
+            column_blocks, trace, progress_callback
+        )
+    else:
+        with trace.span('読み込み', bytes=sum(_file_size(task[0]) for task in ingest_tasks)) as span:
+            ingest_results = _run_ingestion(
+                ingest_tasks, max_workers, parallel_min_files, logs, cache, column_plan, trace,
+                progress_callback
+            )
+            span.update(rows=sum(len(result[0]) for result in ingest_results if result[0] is not None))
+
+        # アップロード順に結果を統合する（並列実行時も出力が決定的になるように）
+        for (_, _, _, file_logs), (df_data, file_question_mapping, ingest_logs) in zip(ingest_tasks, ingest_results):
+            logs.extend(file_logs)
+            logs.extend(ingest_logs)
+            if file_question_mapping:
+                comprehensive_question_mapping.extend(file_question_mapping)
+            if df_data is not None:
                 all_data_list.append(df_data)
-                logs.append(f"'{filename}' のデータを読み込み完了。({len(df_data)}件)")
+        data_file_count = len(all_data_list)
+        # 読み込みに使った SurveyWorkbook（解析済みのシートを含む）を解放する
+        ingest_tasks = ingest_results = None
 
-            except Exception as e:
-                logs.append(f"'{filename}' のデータシート処理中にエラー: {e}")
+        if not all_data_list:
+            raise ValueError("集計対象のデータが見つかりませんでした。")
 
-    if not all_data_list:
-        raise ValueError("集計対象のデータが見つかりませんでした。")
-    
-    logs.append("--- 全データの結合処理を開始 ---")
-    merged_df = pd.concat(all_data_list, ignore_index=True, sort=False)
-    logs.append(f"全ファイルのデータを結合しました。合計: {len(merged_df)}件")
+        _report_progress(progress_callback, PROGRESS_MERGE, 0, 1)
+        logs.append("--- 全データの結合処理を開始 ---")
+        with trace.span('結合') as span:
+            if column_blocks:
+                # 横に連結せず、回答日時の並び順だけを全体で計算する
+                merged_df = ColumnBlockStore(all_data_list)
+                logs.append(f"全ファイルのデータを列ブロックのまま保持しました。合計: {len(merged_df)}件、{len(merged_df.columns)}列")
+            else:
+                merged_df = pd.concat(all_data_list, ignore_index=True, sort=False)
+                logs.append(f"全ファイルのデータを結合しました。合計: {len(merged_df)}件")
+            span.update(_frame_metrics(merged_df))
+
+        if not column_blocks and '回答日時' in merged_df.columns:
+            with trace.span('回答日時の並べ替え') as span:
+                # ファイルごとに回答日時を変換・並べ替えし、並べ替え済みのファイル同士を併合した順に並べる
+                # （回答日時が変換できない行は除外し、同じ日時はファイルの順序・ファイル内の順序を保つ）
+                response_times, order = order_by_response_time(all_data_list)
+                merged_df['回答日時'] = response_times
+                merged_df = merged_df.take(order)
+                span.update(_frame_metrics(merged_df))
+            logs.append(f"回答日時でソートしました。")
+
+    if optimize_memory:
+        with trace.span('型の最適化', **_frame_metrics(merged_df)):
+            if column_blocks:
+                report_df = merged_df.optimize_dtypes()
+            else:
+                merged_df, report_df = optimize_dtypes(merged_df, report=True)
+        logs.append(summarize_memory_report(report_df))
+        if memory_report is not None:
+            memory_report.extend(report_df.to_dict('records'))
+
+    _report_progress(progress_callback, PROGRESS_MERGE, 1, 1)
 
-    if '回答日時' in merged_df.columns:
-        merged_df['回答日時'] = pd.to_datetime(merged_df['回答日時'], errors='coerce')
-        merged_df.dropna(subset=['回答日時'], inplace=True)
-        merged_df.sort_values(by='回答日時', inplace=True)
-        logs.append(f"回答日時でソートしました。")
+    # 集計計画のキーは全ファイルのヘッダー・質問対応表から求めているため、
+    # データを読み込めなかった（スキップした）ファイルがある場合はキャッシュを使わない
+    plan_inputs_valid = plan_key is not None and data_file_count == file_count
+    if client_plan is not None and plan_inputs_valid:
+        logs.append("同じクライアント設定・質問マスター・ファイルのヘッダーの集計計画をキャッシュから再利用しました。")
+    else:
+        with trace.span('集計計画の作成', rows=len(comprehensive_question_mapping)) as span:
+            # クライアントごとに選ぶ列・出力する列名・マッピング行を一度だけ求める
+            client_plan = compile_client_plan(
+                client_settings_df, question_master_df, merged_df.columns, comprehensive_question_mapping,
+                plan_key if plan_inputs_valid else None
+            )
+            if plan_cache is not None and plan_inputs_valid:
+                client_plan = plan_cache.store(plan_key, client_plan)
+            span.update(cols=len(client_plan['clients']))
+    if plan_report is not None:
+        plan_report.extend(client_plan['clients'])
 
-    # クライアント別の集計
+    # クライアント別の集計（集計計画に従って列を選び、列名とマッピングシートを作成する）
+    # 出力グループが同じクライアントは、最初のクライアントのデータとマッピングを共有する
     client_results = {}
+    group_outputs = {}  # 出力グループ -> (データ, マッピング, 最初のクライアント名)
     logs.append("--- クライアント別集計処理を開始 ---")
+    clients_span = trace.begin('クライアント別集計')
+    client_count = len(client_plan['clients'])
     
-    for client_name, group in client_settings_df.groupby('クライアント名'):
+    for client_index, client in enumerate(client_plan['clients']):
+        client_name = client['client_name']
+        _report_progress(progress_callback, PROGRESS_CLIENTS, client_index, client_count, client_name)
+        client_span = trace.begin('クライアント別集計', client_name, KIND_CLIENT)
         logs.append(f"'{client_name}' の集計を開始します...")
+        logs.append(f"'{client_name}' には固定質問を含む合計 {len(client['questions'])} 個の質問を集計します。")
         
-        # クライアント設定から質問を取得
-        questions_to_aggregate = group['集計対象の質問文'].tolist()
-        
-        # 固定質問を追加（重複を除外）
-        all_questions = list(dict.fromkeys(FIXED_QUESTIONS + questions_to_aggregate))
-        logs.append(f"'{client_name}' には固定質問を含む合計 {len(all_questions)} 個の質問を集計します。")
-        
-        cols_to_select = ['NO']
-        for q in all_questions:
-            if q in merged_df.columns:
-                cols_to_select.append(q)
-            for col in merged_df.columns:
-                if str(col).startswith(q + '_'):
-                    cols_to_select.append(col)
-        
-        cols_to_select = list(dict.fromkeys(cols_to_select))
-        
-        if '回答日時' in merged_df.columns:
-            cols_to_select.append('回答日時')
-        
+        cols_to_select = client['source_columns']
         if len(cols_to_select) <= 1:
             logs.append(f"'{client_name}' の集計対象の質問がデータ内に見つかりませんでした。")
+            trace.end(client_span, rows=0, cols=0)
+            continue
+
+        output_group = client['output_group']
+        if output_group in group_outputs:
+            output_client_data, base_mapping_df, shared_client = group_outputs[output_group]
+            logs.append(f"'{client_name}' は '{shared_client}' と同じ列・マッピングのため、集計結果を共有します。")
+            client_results[client_name] = {
+                'data': output_client_data,
+                'base_file': f"{client_name}専用マッピング",
+                'mapping': base_mapping_df,
+                'output_group': output_group,
+            }
+            trace.end(client_span, **_frame_metrics(output_client_data))
             continue
             
         client_data = merged_df[cols_to_select]
+        if optimize_memory and column_blocks:
+            # ブロックごとに異なるカテゴリ型などは連結時に object 型に戻るため、組み立て後に再度変換する
+            client_data = optimize_dtypes(client_data)
         
-        base_mapping_df = pd.DataFrame()
-        text_to_q_map = {}
-        
-        # すべてのファイルから質問マッピングを収集（固定質問を含む全質問を確実にマッピング）
-        for file_col in question_master_df.columns:
-            if file_col != '質問文' and file_col.endswith('.xlsx'):
-                temp_mapping = question_master_df[['質問文', file_col]].dropna()
-                for _, row in temp_mapping.iterrows():
-                    if row['質問文'] not in text_to_q_map:
-                        text_to_q_map[row['質問文']] = row[file_col]
-        
-        # 🆕 質問対応表形式のマッピングを作成（質問 + 選択肢を含む）
-        # クライアントの質問リストに該当する質問対応表データを抽出
-        client_mapping_data = []
-
-        for question_text in all_questions:
-            # comprehensive_question_mapping から該当する質問とその選択肢を探す
-            question_found = False
-            for mapping_entry in comprehensive_question_mapping:
-                # 質問のメイン行を探す（番号がQ-で始まり、内容が質問文と一致）
-                if (mapping_entry['番号'].startswith('Q-') and
-                    mapping_entry['内容'] == question_text):
-
-                    # 質問のメイン行を追加
-                    client_mapping_data.append(mapping_entry)
-                    question_found = True
-
-                    # この質問の選択肢も探して追加
-                    question_index = comprehensive_question_mapping.index(mapping_entry)
-
-                    # 質問の直後から次の質問までの選択肢を収集
-                    for i in range(question_index + 1, len(comprehensive_question_mapping)):
-                        choice_entry = comprehensive_question_mapping[i]
-
-                        # 次の質問（Q-で始まる）が見つかったら停止
-                        if choice_entry['番号'].startswith('Q-'):
-                            break
-
-                        # 選択肢（数字の番号で内容がある）を追加
-                        if (choice_entry['番号'].isdigit() and
-                            choice_entry['内容'].strip()):
-                            client_mapping_data.append(choice_entry)
-
-                    break
-
-            # もし質問対応表に見つからない場合は、従来の方法でフォールバック
-            if not question_found:
-                matching_rows = question_master_df[question_master_df['質問文'] == question_text]
-                if not matching_rows.empty:
-                    row = matching_rows.iloc[0]
-                    for col in question_master_df.columns:
-                        if col.endswith('.xlsx') and pd.notna(row[col]):
-                            client_mapping_data.append({
-                                '番号': row[col],
-                                '条件': '',
-                                '内容': question_text,
-                                '区分': ''
-                            })
-                            break
-
-        # DataFrameを作成
-        if client_mapping_data:
-            base_mapping_df = pd.DataFrame(client_mapping_data)
-            # 列の順序を調整
-            base_mapping_df = base_mapping_df[['番号', '条件', '内容', '区分']]
-        else:
-            # フォールバック：空のDataFrame
-            base_mapping_df = pd.DataFrame(columns=['番号', '条件', '内容', '区分'])
-
+        # 🆕 質問対応表形式のマッピング（質問 + 選択肢を含む）
+        base_mapping_df = pd.DataFrame(client['mapping_rows'], columns=MAPPING_COLUMNS)
         logs.append(f"'{client_name}' のマッピング: {len(base_mapping_df)}行（質問+選択肢を含む）")
 
         # client_dataの列名を質問文から質問番号へ再変換（FA列も考慮）
-        final_rename_map = {}
-        for col_name in client_data.columns:
-            # FA列などのサフィックスが付いているかチェック
-            is_suffixed = False
-            for q_text, q_num in text_to_q_map.items():
-                if str(col_name).startswith(q_text + '_'):
-                    suffix = str(col_name).replace(q_text, '')
-                    final_rename_map[col_name] = q_num + suffix
-                    is_suffixed = True
-                    break
-            # サフィックスがなく、完全一致する場合
-            if not is_suffixed and col_name in text_to_q_map:
-                final_rename_map[col_name] = text_to_q_map[col_name]
-
+        final_rename_map = {
+            col_name: output_col
+            for col_name, output_col in zip(cols_to_select, client['output_columns'])
+            if output_col != col_name
+        }
         output_client_data = client_data.rename(columns=final_rename_map)
         
         client_results[client_name] = {
             'data': output_client_data,
             'base_file': f"{client_name}専用マッピング",
-            'mapping': base_mapping_df
+            'mapping': base_mapping_df,
+            'output_group': output_group,
         }
+        group_outputs[output_group] = (output_client_data, base_mapping_df, client_name)
         
         logs.append(f"'{client_name}' の集計が完了しました。")
+        trace.end(client_span, **_frame_metrics(output_client_data))
+
+    trace.end(clients_span)
+    if len(group_outputs) < len(client_results):
+        logs.append(f"{len(client_results)}社の集計結果を{len(group_outputs)}種類の列・マッピングから作成しました。")
+    _report_progress(progress_callback, PROGRESS_CLIENTS, client_count, client_count)
     
-    return client_results, merged_df, logs
\ No newline at end of file
+    return client_results, merged_df, logs
+
+
+def aggregation_cache_key(data_files, question_master_df, client_settings_df, column_projection=False,
+                          incremental=False, optimize_memory=False, column_blocks=False):
+    """
+    集計結果を特定するキーを計算する
+
+    ファイルの内容のハッシュ・ファイル名（アップロード順）、質問マスターとクライアント設定の内容、
+    集計結果に影響する設定から計算する（並列数やキャッシュの有無は含めない）。
+
+    Returns:
+        str: SHA-256のハッシュ値
+    """
+    digest = hashlib.sha256()
+    for uploaded_file in data_files:
+        content = load_survey_workbook(uploaded_file).read_bytes()
+        digest.update(hashlib.sha256(content).digest())
+        digest.update(str(uploaded_file.name).encode('utf-8', errors='replace'))
+    digest.update(frame_fingerprint(question_master_df).encode('ascii'))
+    digest.update(frame_fingerprint(client_settings_df).encode('ascii'))
+    settings = {
+        'column_projection': bool(column_projection),
+        'incremental': bool(incremental),
+        'optimize_memory': bool(optimize_memory),
+        'column_blocks': bool(column_blocks),
+    }
+    digest.update(json.dumps(settings, sort_keys=True).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def _aggregate_with_result_cache(result_cache, data_files, question_master_df, client_settings_df,
+                                 trace, memory_report, plan_report=None, **options):
+    """
+    共有キャッシュにある集計結果を再利用し、ない場合は集計して保存する
+
+    同じ入力を複数のセッションが同時に集計した場合は、1つのセッションだけが集計する。
+
+    Returns:
+        tuple: aggregate_data の戻り値
+    """
+    with trace.span('集計結果の照合'):
+        key = aggregation_cache_key(
+            data_files, question_master_df, client_settings_df, options['column_projection'],
+            options['incremental_store'] is not None, options['optimize_memory'], options['column_blocks']
+        )
+
+    def aggregate():
+        report = []
+        plans = []
+        client_results, merged_df, logs = aggregate_data(
+            data_files, question_master_df, client_settings_df,
+            memory_report=report, trace=trace, plan_report=plans, **options
+        )
+        return {
+            'results': client_results, 'merged': merged_df, 'logs': logs,
+            'memory_report': report, 'plan_report': plans,
+        }
+
+    entry, hit = result_cache.get_or_create((KIND_AGGREGATION, key), aggregate)
+    logs = list(entry['logs'])
+    if hit:
+        logs.append("同じファイル・設定の集計結果を共有キャッシュから再利用しました。")
+    if memory_report is not None:
+        memory_report.extend(entry['memory_report'])
+    if plan_report is not None:
+        plan_report.extend(entry['plan_report'])
+    return entry['results'], entry['merged'], logs
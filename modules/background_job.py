@@ -0,0 +1,150 @@
+import logging
+import threading
+import time
+import traceback
+
+# ログ設定
+logging.basicConfig(level=logging.INFO)
+
+# ジョブの状態
+STATUS_PENDING = 'pending'
+STATUS_RUNNING = 'running'
+STATUS_DONE = 'done'
+STATUS_FAILED = 'failed'
+STATUS_CANCELLED = 'cancelled'
+
+
+class JobCancelled(Exception):
+    """ジョブの中止が要求されたことを示す例外（進捗の通知時に送出する）"""
+
+
+class BackgroundJob:
+    """
+    時間のかかる処理を別スレッドで実行し、進捗・残り時間・結果を保持するクラス
+
+    処理は progress_callback(stage, completed, total, name) を1つ受け取る関数として渡す。
+    処理が progress_callback を呼ぶたびに進捗を更新し、cancel() が呼ばれていれば
+    JobCancelled を送出して処理を中断する（中止は次の進捗の通知で反映される）。
+
+    全体の進捗は、処理段階ごとの進捗（completed / total）を stage_weights の重みで合計した値とする。
+    Streamlitのセッションからは、セッション状態に保存したジョブの進捗を定期的に確認して表示し、
+    完了後に result をセッションに保存する（別スレッドからはセッション状態を変更しない）。
+
+    使い方:
+        job = BackgroundJob(
+            lambda progress_callback: aggregate_data(..., progress_callback=progress_callback),
+            stage_weights=PROGRESS_WEIGHTS
+        )
+        job.start()
+        ...
+        if job.status == STATUS_DONE:
+            results = job.result
+    """
+
+    def __init__(self, func, stage_weights=None, name='background-job'):
+        self.func = func
+        self.stage_weights = dict(stage_weights or {})
+        self.name = name
+        self.status = STATUS_PENDING
+        self.result = None
+        self.error = None
+        self.error_traceback = None
+        self.stage = ''
+        self.detail = ''
+        self.started_at = None
+        self.finished_at = None
+        self._stage_progress = {}
+        self._lock = threading.Lock()
+        self._cancel_requested = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+
+    def start(self):
+        """別スレッドで処理を開始する"""
+        self.started_at = time.perf_counter()
+        self.status = STATUS_RUNNING
+        self._thread.start()
+        return self
+
+    def _run(self):
+        try:
+            self.result = self.func(self.report_progress)
+            self.status = STATUS_DONE
+        except JobCancelled:
+            logging.info(f"Job '{self.name}' was cancelled")
+            self.status = STATUS_CANCELLED
+        except Exception as e:
+            logging.error(f"Job '{self.name}' failed: {e}")
+            self.error = e
+            self.error_traceback = traceback.format_exc()
+            self.status = STATUS_FAILED
+        finally:
+            self.finished_at = time.perf_counter()
+
+    def report_progress(self, stage, completed, total, name=''):
+        """
+        処理から進捗を受け取る（progress_callback として処理に渡す）
+
+        Args:
+            stage: 処理段階の名前
+            completed: 完了した件数
+            total: 全体の件数
+            name: 対象のファイル名・クライアント名
+
+        Raises:
+            JobCancelled: 中止が要求されている場合
+        """
+        if self._cancel_requested.is_set():
+            raise JobCancelled()
+        with self._lock:
+            self._stage_progress[stage] = min(completed / total, 1.0) if total else 1.0
+            self.stage = stage
+            self.detail = name
+
+    def cancel(self):
+        """処理の中止を要求する"""
+        self._cancel_requested.set()
+
+    @property
+    def cancel_requested(self):
+        """中止が要求されているかを返す"""
+        return self._cancel_requested.is_set()
+
+    @property
+    def is_running(self):
+        """処理中（開始前を含む）かを返す"""
+        return self.status in (STATUS_PENDING, STATUS_RUNNING)
+
+    @property
+    def progress(self):
+        """全体の進捗（0.0〜1.0）"""
+        if self.status == STATUS_DONE:
+            return 1.0
+        with self._lock:
+            if not self.stage_weights:
+                return self._stage_progress.get(self.stage, 0.0)
+            total_weight = sum(self.stage_weights.values())
+            done = sum(
+                weight * self._stage_progress.get(stage, 0.0) for stage, weight in self.stage_weights.items()
+            )
+        return min(done / total_weight, 1.0) if total_weight else 0.0
+
+    @property
+    def elapsed_seconds(self):
+        """開始からの経過時間（秒、終了した場合は処理時間）"""
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.perf_counter()) - self.started_at
+
+    @property
+    def eta_seconds(self):
+        """これまでの進捗の速さから見積もった残り時間（秒、見積もれない場合は None）"""
+        progress = self.progress
+        if not self.is_running or progress <= 0:
+            return None
+        return self.elapsed_seconds * (1 - progress) / progress
+
+    def join(self, timeout=None):
+        """処理の終了を待つ"""
+        if self._thread.is_alive():
+            self._thread.join(timeout)
+        return not self._thread.is_alive()
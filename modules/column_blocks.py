@@ -0,0 +1,184 @@
+import pandas as pd
+import numpy as np
+import logging
+
+from modules.dtype_optimizer import optimize_dtypes
+from modules.response_order import order_by_response_time
+
+# ログ設定
+logging.basicConfig(level=logging.INFO)
+
+# to_frame / iter_frames で一度に組み立てる行数
+DEFAULT_CHUNK_ROWS = 10000
+
+
+class ColumnBlockStore:
+    """
+    ファイルごとの列ブロックのまま全結合データを保持するクラス
+
+    ファイルごとに質問が異なる場合、全ファイルを横に連結すると
+    （全回答者数 × 全ファイルの列の和集合）の大部分が欠損値になる。
+    このクラスはファイルごとのデータフレーム（そのファイルにある列だけ）を保持し、
+    回答日時の並び順だけを全体で一度計算しておく。クライアント別のデータは
+    必要な列だけを各ブロックから集めて組み立てる。
+
+    pd.concat(ignore_index=True, sort=False) → 回答日時の変換・欠損行の除外・並べ替え
+    を行った全結合データと同じ列順・行順・インデックス・値の結果を返す。
+    DataFrame と同じく columns・len()・store[列名のリスト] で利用できる。
+    """
+
+    def __init__(self, blocks, rows=None):
+        """
+        Args:
+            blocks: ファイルごとのデータフレームのリスト（アップロード順）
+                    インデックスはファイル内の行位置（読み込んだままの場合は RangeIndex）
+            rows: ファイルごとの元の行数のリスト（Noneの場合は各ブロックの行数）
+                  全体のインデックスは、この行数で連結した場合の行位置になる
+                  （増分集計で保存した、並べ替え・欠損行の除外済みのブロック用）
+        """
+        self.blocks = list(blocks)
+        rows = [len(block) for block in self.blocks] if rows is None else list(rows)
+        offsets = np.cumsum([0] + rows[:-1]).astype(np.int64)
+
+        # 全体のインデックス（全ファイルを順に連結した場合の行位置）
+        self._labels = np.concatenate(
+            [block.index.to_numpy(dtype=np.int64) + offset for block, offset in zip(self.blocks, offsets)]
+        ) if self.blocks else np.array([], dtype=np.int64)
+        # ブロックを連結したときの各ブロックの開始位置
+        self._starts = np.cumsum([0] + [len(block) for block in self.blocks]).astype(np.int64)
+
+        # 列の和集合（pd.concat(sort=False) と同じく最初に現れた順）
+        self.columns = pd.Index(list(dict.fromkeys(
+            column for block in self.blocks for column in block.columns
+        )))
+
+        # 回答日時の変換と並び順の計算（全結合データと同じ処理を回答日時の列だけに行う）
+        self._dates = None
+        if '回答日時' in self.columns:
+            dates, self._order = order_by_response_time(self.blocks)
+            self._dates = dates.take(self._order)
+        else:
+            self._order = np.arange(len(self._labels), dtype=np.int64)
+
+    def __len__(self):
+        return len(self._order)
+
+    @property
+    def shape(self):
+        return (len(self), len(self.columns))
+
+    def _gather(self, columns, positions=None):
+        """
+        指定した列を各ブロックから集め、ブロックを連結した位置をインデックスとして返す
+
+        Args:
+            columns: 列名のリスト
+            positions: ブロックを連結したときの行位置（昇順、Noneの場合はすべての行）
+        """
+        parts = []
+        for i, block in enumerate(self.blocks):
+            block_columns = [column for column in columns if column in block.columns]
+            part = block[block_columns]
+            if positions is None:
+                local = None
+            else:
+                lo, hi = np.searchsorted(positions, [self._starts[i], self._starts[i + 1]])
+                local = positions[lo:hi] - self._starts[i]
+                part = part.iloc[local]
+            if local is not None and len(local) == 0:
+                continue
+            part = part.set_axis(
+                self._starts[i] + (np.arange(len(block)) if local is None else local), axis=0
+            )
+            parts.append(part)
+
+        frame = pd.concat(parts, sort=False) if parts else pd.DataFrame()
+        return frame.reindex(columns=columns)
+
+    def _select_positions(self, columns, order, all_rows=True):
+        """
+        並び順 order（ブロックを連結した行位置）の行について、指定した列のデータフレームを返す
+
+        all_rows=True の場合はすべての行を連結してから選ぶ（列の型が全結合データと同じになる）。
+        False の場合は order の行だけを連結する（一部の行だけを組み立てる場合用）。
+        """
+        if all_rows:
+            frame = self._gather(columns).take(order)
+        else:
+            frame = self._gather(columns, np.sort(order)).loc[order]
+        if self._dates is not None and '回答日時' in frame.columns:
+            frame['回答日時'] = self._dates.loc[order].to_numpy()
+        if self._dates is not None:
+            frame.index = pd.Index(self._labels[order])
+        elif all_rows:
+            frame.index = pd.RangeIndex(len(order))
+        else:
+            # 回答日時がない場合は連結した順のまま（インデックスは連結した位置）
+            frame.index = pd.Index(order)
+        return frame
+
+    def select(self, columns):
+        """
+        指定した列だけの全結合データを返す（全結合データの store[columns] と同じ結果）
+
+        Args:
+            columns: 列名のリスト
+
+        Returns:
+            pandas.DataFrame: 回答日時順の指定列のデータ
+        """
+        missing = [column for column in columns if column not in self.columns]
+        if missing:
+            raise KeyError(f"{missing} not in index")
+        return self._select_positions(list(columns), self._order)
+
+    def __getitem__(self, columns):
+        if isinstance(columns, str):
+            return self.select([columns])[columns]
+        return self.select(columns)
+
+    def iter_frames(self, chunk_rows=DEFAULT_CHUNK_ROWS):
+        """
+        全列の全結合データを行の順に chunk_rows 行ずつ組み立てて返す
+
+        Yields:
+            pandas.DataFrame: 全結合データの一部（列はすべての列）
+        """
+        columns = list(self.columns)
+        if len(self) == 0:
+            yield self._select_positions(columns, self._order)
+            return
+        for start in range(0, len(self), chunk_rows):
+            yield self._select_positions(columns, self._order[start:start + chunk_rows], all_rows=False)
+
+    def to_frame(self):
+        """全結合データを1つのデータフレームとして組み立てる"""
+        return self.select(list(self.columns))
+
+    def memory_usage(self):
+        """各ブロックのメモリ使用量の合計（bytes）を返す"""
+        return int(sum(block.memory_usage(index=True, deep=True).sum() for block in self.blocks))
+
+    def optimize_dtypes(self):
+        """
+        各ブロックの列の型を optimize_dtypes で最適化する
+
+        Returns:
+            pandas.DataFrame: 列ごとのメモリ使用量のレポート（全ブロックの合計）
+        """
+        reports = []
+        for i, block in enumerate(self.blocks):
+            self.blocks[i], report_df = optimize_dtypes(block, report=True)
+            reports.append(report_df)
+        if not reports:
+            return pd.DataFrame(columns=['列名', '変換前の型', '変換後の型', '変換前(bytes)', '変換後(bytes)'])
+
+        report_df = pd.concat(reports, ignore_index=True)
+        join_types = lambda types: ' / '.join(dict.fromkeys(types))
+        report_df = report_df.groupby('列名', sort=False).agg({
+            '変換前の型': join_types,
+            '変換後の型': join_types,
+            '変換前(bytes)': 'sum',
+            '変換後(bytes)': 'sum',
+        }).reset_index()
+        return report_df
@@ -0,0 +1,148 @@
+import pandas as pd
+import numpy as np
+import sys
+import logging
+
+# ログ設定
+logging.basicConfig(level=logging.INFO)
+
+try:
+    import pyarrow  # noqa: F401  Arrow形式の文字列型に使用
+    ARROW_STRINGS_AVAILABLE = True
+except ImportError:
+    ARROW_STRINGS_AVAILABLE = False
+
+# 値の種類がこの割合以下の文字列列はカテゴリ型にする
+CATEGORY_MAX_RATIO = 0.5
+
+# 整数値だけの列に使う欠損値対応の整数型（小さい順）
+NULLABLE_INT_DTYPES = [
+    (pd.Int8Dtype(), np.iinfo(np.int8)),
+    (pd.Int16Dtype(), np.iinfo(np.int16)),
+    (pd.Int32Dtype(), np.iinfo(np.int32)),
+]
+
+
+def _smallest_nullable_int(values):
+    """整数値だけの配列を表現できる最小の欠損値対応整数型を返す（表現できない場合は None）"""
+    if not np.isfinite(values).all() or not (values == np.round(values)).all():
+        return None
+    # -0.0 は整数にすると符号が失われるため変換しない
+    if (np.signbit(values) & (values == 0)).any():
+        return None
+    low, high = values.min(), values.max()
+    for dtype, info in NULLABLE_INT_DTYPES:
+        if info.min <= low and high <= info.max:
+            return dtype
+    return None
+
+
+def _intern_strings(series):
+    """同じ文字列を1つのオブジェクトにまとめる（Arrowが使えない環境用）"""
+    values = series.to_numpy(dtype=object, copy=True)
+    mask = pd.notna(values)
+    values[mask] = [sys.intern(v) for v in values[mask]]
+    return pd.Series(values, index=series.index, name=series.name, dtype=object)
+
+
+def optimize_column(series):
+    """
+    列の値を変えずに、よりメモリの少ない型に変換する
+
+    - 整数値だけの小数列（選択肢コードが欠損値のため float64 になったもの）→ Int8/Int16/Int32
+    - 整数列 → 値が収まる最小の整数型
+    - 値の種類が少ない文字列列（選択肢・属性など）→ カテゴリ型
+    - 値の種類が多い文字列列（自由回答など）→ Arrow形式の文字列型（pyarrowがない場合は文字列を共有）
+    - それ以外（日時・真偽値・型が混在した列など）→ 変換しない
+
+    Args:
+        series: 変換する列
+
+    Returns:
+        pandas.Series: 変換後の列
+    """
+    dtype = series.dtype
+    if not isinstance(dtype, np.dtype):
+        # カテゴリ型・拡張型は変換済みとみなす
+        return series
+
+    if dtype.kind == 'f':
+        values = series.to_numpy()
+        values = values[~np.isnan(values)]
+        if len(values) == 0:
+            return series
+        int_dtype = _smallest_nullable_int(values)
+        return series.astype(int_dtype) if int_dtype is not None else series
+
+    if dtype.kind in 'iu':
+        return pd.to_numeric(series, downcast='integer' if dtype.kind == 'i' else 'unsigned')
+
+    if dtype.kind == 'O':
+        non_null = series.dropna()
+        if len(non_null) == 0 or pd.api.types.infer_dtype(non_null, skipna=False) != 'string':
+            return series
+        if non_null.nunique() <= len(non_null) * CATEGORY_MAX_RATIO:
+            return series.astype('category')
+        if ARROW_STRINGS_AVAILABLE:
+            return series.astype(pd.StringDtype('pyarrow'))
+        return _intern_strings(series)
+
+    return series
+
+
+def optimize_dtypes(df, report=False):
+    """
+    データフレームの各列を、値を変えずによりメモリの少ない型に変換する
+
+    Args:
+        df: 変換するデータフレーム（変更しない）
+        report: Trueの場合、列ごとのメモリ使用量のレポートも返す
+
+    Returns:
+        pandas.DataFrame: 変換後のデータフレーム
+        pandas.DataFrame: 列ごとのメモリ使用量のレポート（report=True の場合のみ）
+                          列: 列名, 変換前の型, 変換後の型, 変換前(bytes), 変換後(bytes)
+    """
+    columns = {}
+    rows = []
+    for position in range(df.shape[1]):
+        series = df.iloc[:, position]
+        optimized = optimize_column(series)
+        columns[position] = optimized
+        if report:
+            rows.append({
+                '列名': str(df.columns[position]),
+                '変換前の型': str(series.dtype),
+                '変換後の型': str(optimized.dtype),
+                '変換前(bytes)': int(series.memory_usage(index=False, deep=True)),
+                '変換後(bytes)': int(optimized.memory_usage(index=False, deep=True)),
+            })
+
+    optimized_df = pd.concat(columns, axis=1) if columns else df.copy()
+    optimized_df.columns = df.columns
+    optimized_df.index = df.index
+
+    if not report:
+        return optimized_df
+    report_df = pd.DataFrame(rows, columns=['列名', '変換前の型', '変換後の型', '変換前(bytes)', '変換後(bytes)'])
+    return optimized_df, report_df
+
+
+def summarize_memory_report(report_df):
+    """
+    メモリ使用量のレポートを1行の文字列にまとめる
+
+    Args:
+        report_df: optimize_dtypes が返すレポート
+
+    Returns:
+        str: 変換前後の合計と削減率
+    """
+    before = report_df['変換前(bytes)'].sum()
+    after = report_df['変換後(bytes)'].sum()
+    reduction = (1 - after / before) * 100 if before else 0
+    converted = int((report_df['変換前の型'] != report_df['変換後の型']).sum())
+    return (
+        f"メモリ使用量: {before / 1024 / 1024:.1f}MB → {after / 1024 / 1024:.1f}MB"
+        f"（{reduction:.0f}%削減、{converted}/{len(report_df)}列の型を変換）"
+    )
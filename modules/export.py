@@ -0,0 +1,435 @@
+import pandas as pd
+import numpy as np
+import atexit
+import io
+import logging
+import math
+import os
+import tempfile
+import threading
+import zipfile
+from datetime import date, datetime
+from xml.sax.saxutils import escape
+
+import xlsxwriter
+
+from modules.column_blocks import ColumnBlockStore
+
+# ログ設定
+logging.basicConfig(level=logging.INFO)
+
+# pandas の to_excel と同じ見た目にするための書式
+HEADER_FORMAT = {'bold': True, 'border': 1, 'align': 'center', 'valign': 'top'}
+DATETIME_FORMAT = 'yyyy-mm-dd hh:mm:ss'
+DATE_FORMAT = 'yyyy-mm-dd'
+
+# 質問対応表形式のマッピングの列
+MAPPING_COLUMNS = ['番号', '条件', '内容', '区分']
+
+# 同じ出力グループのクライアントで共有するExcelファイル（テンプレート）の基準ファイル名
+# （クライアントごとに共有文字列の中のこの文字列だけを置き換える）
+BASE_FILE_PLACEHOLDER = 'TRI_MERGER_BASE_FILE_PLACEHOLDER'
+SHARED_STRINGS_PATH = 'xl/sharedStrings.xml'
+
+# 出力先を指定しない中間データの一時ファイルの保存先と容量上限（環境変数で変更可能）
+DEFAULT_EXPORT_DIR = os.environ.get(
+    'TRI_MERGER_EXPORT_DIR', os.path.join(tempfile.gettempdir(), 'tri_merger_exports')
+)
+DEFAULT_EXPORT_MAX_BYTES = int(os.environ.get('TRI_MERGER_EXPORT_MAX_BYTES', 2 * 1024 * 1024 * 1024))
+
+# このプロセスで作成した一時ファイル（プロセスの終了時に削除する）
+_temp_exports = set()
+_temp_exports_lock = threading.Lock()
+
+
+def remove_temp_export(path):
+    """
+    write_merged_workbook で作成した一時ファイルを削除する（既に削除されている場合は何もしない）
+
+    Args:
+        path: 一時ファイルのパス
+    """
+    with _temp_exports_lock:
+        _temp_exports.discard(path)
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+@atexit.register
+def remove_temp_exports():
+    """このプロセスで作成した一時ファイルをすべて削除する"""
+    with _temp_exports_lock:
+        paths = list(_temp_exports)
+    for path in paths:
+        remove_temp_export(path)
+
+
+def _evict_temp_exports(export_dir, max_bytes, keep):
+    """
+    保存先の一時ファイルの合計が容量上限を超えている場合、更新日時の古いものから削除する
+
+    セッションの終了・期限切れで参照されなくなった一時ファイルも、ここで削除される。
+    """
+    files = []
+    for name in os.listdir(export_dir):
+        path = os.path.join(export_dir, name)
+        try:
+            files.append((os.path.getmtime(path), os.path.getsize(path), path))
+        except OSError:
+            # 削除と同時に参照した場合
+            continue
+    total = sum(size for _, size, _ in files)
+    for _, size, path in sorted(files):
+        if total <= max_bytes:
+            break
+        if path == keep:
+            continue
+        remove_temp_export(path)
+        total -= size
+        logging.info(f"Removed old export file {path}")
+
+
+def write_frame_streaming(workbook, sheet_name, df):
+    """
+    データフレームを1行ずつシートに書き込む
+
+    constant_memory モードのワークブックでも使えるよう、行の順に書き込む。
+    欠損値は空セル、日時は日時書式のセルとして書き込む（pandas の to_excel と同じ）。
+    ColumnBlockStore の場合は、一定の行数ずつ組み立てながら書き込む。
+
+    Args:
+        workbook: xlsxwriter.Workbook
+        sheet_name: シート名
+        df: 書き込むデータフレーム、または ColumnBlockStore
+
+    Returns:
+        xlsxwriter.worksheet.Worksheet: 書き込んだシート
+    """
+    worksheet = workbook.add_worksheet(sheet_name)
+    header_format = workbook.add_format(HEADER_FORMAT)
+    datetime_format = workbook.add_format({'num_format': DATETIME_FORMAT})
+    date_format = workbook.add_format({'num_format': DATE_FORMAT})
+
+    worksheet.write_row(0, 0, [str(col) for col in df.columns], header_format)
+
+    frames = df.iter_frames() if isinstance(df, ColumnBlockStore) else [df]
+    rows = (row for frame in frames for row in frame.itertuples(index=False, name=None))
+    for row_idx, row in enumerate(rows, start=1):
+        for col_idx, value in enumerate(row):
+            if value is None or value is pd.NaT or value is pd.NA:
+                continue
+            if isinstance(value, float):
+                if math.isnan(value):
+                    continue
+                if math.isinf(value):
+                    # pandas の to_excel と同様に文字列として書き込む
+                    worksheet.write_string(row_idx, col_idx, 'inf' if value > 0 else '-inf')
+                    continue
+            if isinstance(value, datetime):
+                worksheet.write_datetime(row_idx, col_idx, value, datetime_format)
+            elif isinstance(value, date):
+                worksheet.write_datetime(row_idx, col_idx, value, date_format)
+            else:
+                worksheet.write(row_idx, col_idx, value)
+
+    return worksheet
+
+
+def write_merged_workbook(merged_df, path=None):
+    """
+    中間データ（全結合データ）のExcelファイルを一定のメモリ使用量で書き出す
+
+    xlsxwriter の constant_memory モードで1行ずつ一時ファイルへ書き出すため、
+    行数が増えてもメモリ使用量はほぼ一定になる。フォント（Calibri）は
+    行ごとの設定ではなく、ワークブックの既定の書式として指定する。
+
+    Args:
+        merged_df: aggregate_data が返す中間データ（DataFrame または ColumnBlockStore）
+        path: 出力先のパス（Noneの場合は DEFAULT_EXPORT_DIR に一時ファイルを作成する。
+              一時ファイルは不要になったら remove_temp_export で削除する。削除しなかった場合も、
+              容量上限（DEFAULT_EXPORT_MAX_BYTES）を超えたときとプロセスの終了時に削除される）
+
+    Returns:
+        str: 出力したExcelファイルのパス
+    """
+    temporary = path is None
+    if temporary:
+        os.makedirs(DEFAULT_EXPORT_DIR, exist_ok=True)
+        fd, path = tempfile.mkstemp(prefix='merged_', suffix='.xlsx', dir=DEFAULT_EXPORT_DIR)
+        os.close(fd)
+        with _temp_exports_lock:
+            _temp_exports.add(path)
+
+    workbook = xlsxwriter.Workbook(path, {
+        'constant_memory': True,
+        'default_format_properties': {'font_name': 'Calibri'},
+    })
+    try:
+        try:
+            write_frame_streaming(workbook, '全結合データ', merged_df)
+        finally:
+            workbook.close()
+    except Exception:
+        if temporary:
+            remove_temp_export(path)
+        raise
+    if temporary:
+        _evict_temp_exports(DEFAULT_EXPORT_DIR, DEFAULT_EXPORT_MAX_BYTES, keep=path)
+    return path
+
+
+def build_merged_workbook(merged_df):
+    """
+    中間データ（全結合データ）のExcelファイルを作成する
+
+    Args:
+        merged_df: aggregate_data が返す中間データ
+
+    Returns:
+        bytes: Excelファイルの内容
+    """
+    path = write_merged_workbook(merged_df)
+    try:
+        with open(path, 'rb') as f:
+            return f.read()
+    finally:
+        remove_temp_export(path)
+
+
+def format_mapping_rows(mapping_df):
+    """
+    質問対応表形式のマッピングに、質問ごとの区切りの空行を挿入し、各行の種類を判定する
+
+    区切りの空行は2つ目以降の質問行（番号がQ-で始まる行）の直前に挿入する。
+
+    Args:
+        mapping_df: 質問対応表形式（番号, 条件, 内容, 区分）のデータフレーム
+
+    Returns:
+        pandas.DataFrame: 空行を挿入した4列のデータフレーム
+        numpy.ndarray: 各行の種類（'question': 質問行, 'empty': 空行, 'choice': 選択肢行）
+    """
+    source = mapping_df.reindex(columns=MAPPING_COLUMNS, fill_value='')
+    is_question = source['番号'].astype(str).str.startswith('Q-').to_numpy()
+
+    # 各行の移動先 = 元の位置 + それまでに挿入した空行の数
+    needs_separator = is_question & (np.cumsum(is_question) > 1)
+    positions = np.arange(len(source)) + np.cumsum(needs_separator)
+    total_rows = len(source) + int(needs_separator.sum())
+
+    values = np.full((total_rows, len(MAPPING_COLUMNS)), '', dtype=object)
+    values[positions] = source.to_numpy(dtype=object)
+    formatted_df = pd.DataFrame(values, columns=MAPPING_COLUMNS)
+
+    numbers = formatted_df['番号'].astype(str)
+    row_kinds = np.select(
+        [numbers.str.startswith('Q-').to_numpy(), (numbers.str.strip() == '').to_numpy()],
+        ['question', 'empty'],
+        default='choice'
+    )
+    return formatted_df, row_kinds
+
+
+def write_mapping_sheet(workbook, sheet_name, mapping_df):
+    """
+    質問対応表形式のマッピングを書式付きでシートに書き込む
+
+    行の種類ごとの書式を事前に作成し、各行を write_row で1回ずつ書き込む。
+
+    Args:
+        workbook: xlsxwriter.Workbook
+        sheet_name: シート名
+        mapping_df: 質問対応表形式（番号, 条件, 内容, 区分）のデータフレーム
+
+    Returns:
+        xlsxwriter.worksheet.Worksheet: 書き込んだシート
+    """
+    formatted_df, row_kinds = format_mapping_rows(mapping_df)
+
+    # 基準質問マッピング専用のフォーマット設定
+    header_format = workbook.add_format({
+        'font_name': 'Calibri',
+        'bold': True,
+        'border': 1,
+        'bg_color': '#F2F2F2'
+    })
+    row_formats = {
+        'question': workbook.add_format({
+            'font_name': 'Calibri',
+            'bold': True,
+            'border': 1,
+            'bg_color': '#E6F3FF'
+        }),
+        'choice': workbook.add_format({
+            'font_name': 'Calibri',
+            'border': 1
+        }),
+        'empty': workbook.add_format({
+            'font_name': 'Calibri'
+        }),
+    }
+
+    worksheet = workbook.add_worksheet(sheet_name)
+    worksheet.write_row(0, 0, MAPPING_COLUMNS, header_format)
+    for row_idx, (values, kind) in enumerate(zip(formatted_df.to_numpy().tolist(), row_kinds), start=1):
+        worksheet.write_row(row_idx, 0, values, row_formats[kind])
+
+    # 列幅を自動調整
+    worksheet.set_column('A:A', 10)  # 番号
+    worksheet.set_column('B:B', 12)  # 条件
+    worksheet.set_column('C:C', 50)  # 内容
+    worksheet.set_column('D:D', 8)   # 区分
+    return worksheet
+
+
+def build_client_workbook(client_info):
+    """
+    クライアント別の集計結果Excelファイルを作成する
+
+    Args:
+        client_info: aggregate_data が返すクライアントごとの結果
+                     （'data', 'base_file', 'mapping' を含む辞書）
+
+    Returns:
+        bytes: Excelファイルの内容
+    """
+    buffer = io.BytesIO()
+    with pd.ExcelWriter(buffer, engine='xlsxwriter') as writer:
+        # データシート
+        client_info['data'].to_excel(writer, sheet_name='元データ', index=False)
+
+        # 基準ファイル情報
+        base_info_df = pd.DataFrame([{'基準ファイル名': client_info['base_file']}])
+        base_info_df.to_excel(writer, sheet_name='基準ファイル情報', index=False)
+
+        # マッピング情報 (新フォーマット: 質問対応表形式)
+        mapping_df = None
+        workbook = writer.book
+        calibri_format = workbook.add_format({'font_name': 'Calibri'})
+
+        if not client_info['mapping'].empty:
+            mapping_df = client_info['mapping']
+
+            # 質問対応表形式の場合 (4列: 番号, 条件, 内容, 区分)
+            if '番号' in mapping_df.columns and '内容' in mapping_df.columns:
+                write_mapping_sheet(workbook, '基準質問マッピング', mapping_df)
+            else:
+                # 古いフォーマットのフォールバック
+                if '質問番号' in mapping_df.columns and '質問文' in mapping_df.columns:
+                    mapping_df = mapping_df[['質問番号', '質問文']]
+                mapping_df.to_excel(writer, sheet_name='基準質問マッピング', index=False)
+                for row in range(len(mapping_df) + 1):
+                    writer.sheets['基準質問マッピング'].set_row(row, None, calibri_format)
+
+        # Set Calibri font for the data sheets
+        for row in range(len(client_info['data']) + 1):
+            writer.sheets['元データ'].set_row(row, None, calibri_format)
+        for row in range(len(base_info_df) + 1):
+            writer.sheets['基準ファイル情報'].set_row(row, None, calibri_format)
+
+    buffer.seek(0)
+    return buffer.getvalue()
+
+
+def build_client_workbook_template(client_info):
+    """
+    同じ出力グループ（データとマッピングが同じ）のクライアントで共有するExcelファイルを作成する
+
+    基準ファイル名を仮の文字列にして作成し、personalize_client_workbook で
+    クライアントごとの基準ファイル名に置き換える。
+
+    Args:
+        client_info: aggregate_data が返すクライアントごとの結果
+
+    Returns:
+        bytes: Excelファイルの内容
+    """
+    return build_client_workbook(dict(client_info, base_file=BASE_FILE_PLACEHOLDER))
+
+
+def personalize_client_workbook(template, client_info):
+    """
+    共有のExcelファイル（build_client_workbook_template）の基準ファイル名を、クライアントの基準ファイル名に置き換える
+
+    データシートを書き込み直さず、共有文字列（xl/sharedStrings.xml）の基準ファイル名だけを置き換える。
+    基準ファイル名の前後に空白・制御文字がある場合や、仮の文字列が1つに特定できない場合は
+    build_client_workbook で作成し直す（出力内容は同じ）。
+
+    Args:
+        template: build_client_workbook_template で作成したExcelファイルの内容
+        client_info: aggregate_data が返すクライアントごとの結果
+
+    Returns:
+        bytes: Excelファイルの内容
+    """
+    base_file = str(client_info['base_file'])
+    placeholder = f"<t>{BASE_FILE_PLACEHOLDER}</t>".encode('utf-8')
+    if base_file != base_file.strip() or any(ord(c) < 32 for c in base_file):
+        return build_client_workbook(client_info)
+
+    source = zipfile.ZipFile(io.BytesIO(template))
+    shared_strings = source.read(SHARED_STRINGS_PATH)
+    if shared_strings.count(placeholder) != 1:
+        return build_client_workbook(client_info)
+
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as output:
+        for item in source.infolist():
+            if item.filename == SHARED_STRINGS_PATH:
+                content = shared_strings.replace(placeholder, f"<t>{escape(base_file)}</t>".encode('utf-8'))
+            else:
+                content = source.read(item)
+            output.writestr(item, content)
+    return buffer.getvalue()
+
+
+def write_client_workbook(client_info, path):
+    """
+    クライアント別の集計結果Excelファイルをディスクに書き込む
+
+    ワーカープロセスから呼び出せるように、モジュールのトップレベルに定義している。
+
+    Args:
+        client_info: aggregate_data が返すクライアントごとの結果
+        path: 出力先のパス
+
+    Returns:
+        str: 出力先のパス
+    """
+    content = build_client_workbook(client_info)
+    with open(path, 'wb') as f:
+        f.write(content)
+    return path
+
+
+def write_client_workbooks(tasks):
+    """
+    同じ出力グループのクライアント別の集計結果Excelファイルをまとめてディスクに書き込む
+
+    クライアントが複数の場合は、共有のExcelファイルを一度だけ作成し、基準ファイル名だけを置き換えて書き込む。
+    ワーカープロセスから呼び出せるように、モジュールのトップレベルに定義している。
+
+    Args:
+        tasks: (クライアント名, aggregate_data が返すクライアントごとの結果, 出力先のパス) のリスト
+
+    Returns:
+        list: (クライアント名, 出力先のパス, エラーメッセージ（成功した場合は None）) のリスト
+    """
+    template = None
+    if len(tasks) > 1:
+        template = build_client_workbook_template(tasks[0][1])
+    results = []
+    for client_name, client_info, path in tasks:
+        try:
+            if template is None:
+                content = build_client_workbook(client_info)
+            else:
+                content = personalize_client_workbook(template, client_info)
+            with open(path, 'wb') as f:
+                f.write(content)
+            results.append((client_name, path, None))
+        except Exception as e:
+            results.append((client_name, path, str(e)))
+    return results
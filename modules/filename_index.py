@@ -0,0 +1,188 @@
+import hashlib
+import logging
+import re
+import unicodedata
+from functools import lru_cache
+
+# ログ設定
+logging.basicConfig(level=logging.INFO)
+
+# 照合の方法（resolve の結果の 'match'）
+MATCH_EXACT = 'exact'              # 列名と完全一致
+MATCH_NORMALIZED = 'normalized'    # 正規化したファイル名が一致
+MATCH_ALIAS = 'alias'              # 特別な対応付け（Plus_マージ完成データ → Plus2の列）
+MATCH_PARTIAL = 'partial'          # 正規化したファイル名が1つの列名に含まれる
+MATCH_AMBIGUOUS = 'ambiguous'      # 候補の列が複数ある（最初の候補の列を使う）
+MATCH_MISSING = 'missing'          # 候補の列がない
+MATCH_LABELS = {
+    MATCH_EXACT: '完全一致',
+    MATCH_NORMALIZED: '正規化して一致',
+    MATCH_ALIAS: '特別な対応付け',
+    MATCH_PARTIAL: '部分一致',
+    MATCH_AMBIGUOUS: '候補が複数',
+    MATCH_MISSING: '該当なし',
+}
+
+# Plus_マージ完成データ.xlsx は、質問マスターの Plus2 の列（コピーを除く）に対応付ける
+PLUS_MERGED_FILENAME = 'Plus_マージ完成データ'
+PLUS_COLUMN_MARKER = 'Plus2'
+COPY_PREFIX = '[コピー]'
+
+# コピーしたファイルに付く接尾辞（例: 「アンケート (2).xlsx」「アンケート - コピー.xlsx」）
+_COPY_SUFFIX_PATTERN = re.compile(r'(\s*\(\d+\)|\s*-\s*コピー)+$')
+_EXTENSION = '.xlsx'
+
+
+@lru_cache(maxsize=4096)
+def repair_filename(filename):
+    """
+    アップロードされたファイル名の文字化けを修正する（同じファイル名の結果は再利用する）
+
+    UTF-8のファイル名がLatin-1として解釈された場合は元に戻す。それでも不正な文字が残る場合は、
+    元のファイル名のハッシュ値から安全なファイル名（file_xxxxxxxx.xlsx）を作成する。
+    質問マスターの列名とデータ集計でのファイル名の照合で共通に使う。
+
+    Args:
+        filename: アップロードされたファイル名
+
+    Returns:
+        str: 修正したファイル名
+    """
+    repaired = filename
+    # 一般的な文字化けパターンをチェック（Latin-1でエンコードされた可能性がある場合）
+    if any(127 < ord(c) < 256 for c in repaired):
+        try:
+            repaired = repaired.encode('latin-1').decode('utf-8')
+        except UnicodeError:
+            pass
+
+    # それでも文字化けしている場合は、ファイル名のハッシュ値を使用する
+    if '�' in repaired or any(ord(c) > 0xFFFF for c in repaired):
+        file_hash = hashlib.md5(filename.encode('utf-8', errors='ignore')).hexdigest()[:8]
+        repaired = f"file_{file_hash}.xlsx"
+        logging.warning(f"Filename {filename!r} contains invalid characters. Using safe name: {repaired}")
+    return repaired
+
+
+@lru_cache(maxsize=4096)
+def normalize_filename(filename):
+    """
+    ファイル名を照合用に正規化する
+
+    文字化けを修正し、Unicode正規化（NFKC、全角英数字・括弧を半角にする）、大文字・小文字の統一、
+    拡張子・コピーの接頭辞（[コピー]）・接尾辞（(2)、- コピー）の除去を行う。
+
+    Args:
+        filename: ファイル名
+
+    Returns:
+        str: 正規化したファイル名
+    """
+    key = unicodedata.normalize('NFKC', repair_filename(filename)).strip().casefold()
+    if key.endswith(_EXTENSION):
+        key = key[:-len(_EXTENSION)]
+    prefix = unicodedata.normalize('NFKC', COPY_PREFIX).casefold()
+    if key.startswith(prefix):
+        key = key[len(prefix):]
+    return _COPY_SUFFIX_PATTERN.sub('', key).strip()
+
+
+class FilenameIndex:
+    """
+    質問マスターのファイル列（.xlsx で終わる列）を、ファイル名から引くための索引
+
+    列名そのものと正規化した列名の辞書を一度だけ作成し、アップロードされたファイル名から
+    O(1) で列を引く。正規化した列名が同じ列が複数ある場合や、部分一致の候補が複数ある場合は
+    以前の照合処理と同様に最初の候補の列を使い、候補の一覧を返して呼び出し側で報告できるようにする。
+    """
+
+    def __init__(self, columns):
+        self.columns = [col for col in columns if isinstance(col, str) and col != '質問文' and col.endswith(_EXTENSION)]
+        self._exact = set(self.columns)
+        self._normalized = {}  # 正規化した列名 -> 列名のリスト（列の順）
+        for col in self.columns:
+            self._normalized.setdefault(normalize_filename(col), []).append(col)
+        self._plus_columns = [
+            col for col in self.columns if PLUS_COLUMN_MARKER in col and not col.startswith(COPY_PREFIX)
+        ]
+
+    def resolve(self, filename):
+        """
+        ファイル名に対応する列を探す
+
+        完全一致（元のファイル名、文字化けを修正したファイル名）→ 正規化したファイル名の一致 →
+        Plus_マージ完成データの対応付け → 正規化したファイル名を含む列（部分一致）の順に探す。
+
+        Args:
+            filename: アップロードされたファイル名
+
+        Returns:
+            dict: 'column'（列名、候補が複数の場合は最初の候補、見つからない場合は None）、
+                  'match'（照合の方法、MATCH_*）、'candidates'（候補の列名のリスト）
+        """
+        for name in (repair_filename(filename), filename):
+            if name in self._exact:
+                return {'column': name, 'match': MATCH_EXACT, 'candidates': [name]}
+
+        key = normalize_filename(filename)
+        candidates = self._normalized.get(key)
+        match = MATCH_NORMALIZED
+        if not candidates and PLUS_MERGED_FILENAME.casefold() in key:
+            candidates = self._plus_columns
+            match = MATCH_ALIAS
+        if not candidates and key:
+            # 完全一致しない場合のみ列名を走査する
+            candidates = [col for normalized, cols in self._normalized.items() if key in normalized for col in cols]
+            match = MATCH_PARTIAL
+
+        if not candidates:
+            return {'column': None, 'match': MATCH_MISSING, 'candidates': []}
+        if len(candidates) > 1:
+            return {'column': candidates[0], 'match': MATCH_AMBIGUOUS, 'candidates': list(candidates)}
+        return {'column': candidates[0], 'match': match, 'candidates': list(candidates)}
+
+    def resolve_files(self, filenames):
+        """
+        複数のファイル名をまとめて照合する（集計の実行前の確認用）
+
+        Args:
+            filenames: アップロードされたファイル名のリスト
+
+        Returns:
+            list: ファイル名ごとの resolve の結果（'filename' に文字化けを修正したファイル名を追加）
+        """
+        return [dict(self.resolve(name), filename=repair_filename(name)) for name in filenames]
+
+
+@lru_cache(maxsize=32)
+def _cached_index(columns):
+    return FilenameIndex(columns)
+
+
+def get_filename_index(question_master_df):
+    """
+    質問マスターのファイル名の索引を返す（同じ列の質問マスターでは作成済みの索引を再利用する）
+
+    Args:
+        question_master_df: 質問マスターデータフレーム
+
+    Returns:
+        FilenameIndex: ファイル名の索引
+    """
+    return _cached_index(tuple(question_master_df.columns))
+
+
+def format_ambiguous_matches(resolutions):
+    """
+    候補の列が複数あるファイルの一覧を、警告メッセージ用の文字列にする
+
+    Args:
+        resolutions: FilenameIndex.resolve_files の結果
+
+    Returns:
+        str: 「ファイル名 → 候補1 / 候補2」を改行でつないだ文字列（該当がない場合は空文字列）
+    """
+    return '\n'.join(
+        f"{resolution['filename']} → {' / '.join(resolution['candidates'])}"
+        for resolution in resolutions if resolution['match'] == MATCH_AMBIGUOUS
+    )
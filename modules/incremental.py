@@ -0,0 +1,266 @@
+import pandas as pd
+import numpy as np
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import uuid
+
+from modules.column_blocks import ColumnBlockStore
+from modules.response_order import parse_response_times, sorted_run_positions, order_by_response_time
+
+# ログ設定
+logging.basicConfig(level=logging.INFO)
+
+# 保存形式や読み込み処理を変更した場合は値を上げ、以前の読み込み結果を無効にする
+STORE_VERSION = 2
+
+# 増分集計の保存先と容量上限（環境変数で変更可能）
+DEFAULT_STATE_DIR = os.environ.get(
+    'TRI_MERGER_STATE_DIR', os.path.join(tempfile.gettempdir(), 'tri_merger_state')
+)
+DEFAULT_STATE_MAX_BYTES = int(os.environ.get('TRI_MERGER_STATE_MAX_BYTES', 2 * 1024 * 1024 * 1024))
+
+OUTPUTS_FILE = 'outputs.json'
+
+
+def sort_survey_run(df_data):
+    """
+    1ファイル分のデータを回答日時順に並べ替える（増分集計で保存する形式）
+
+    回答日時を日時に変換し、変換できない行を除外してから安定ソートする
+    （通常の集計でファイルごとに行う処理と同じ）。
+    インデックスはファイル内の元の行位置のまま保持する。
+    回答日時の列がない場合はそのまま返す。
+
+    Args:
+        df_data: 列名変換済みの1ファイル分のデータ
+
+    Returns:
+        pandas.DataFrame: 回答日時順に並べ替えたデータ
+    """
+    if '回答日時' not in df_data.columns:
+        return df_data
+    dates = parse_response_times(df_data['回答日時'])
+    df_data = df_data.assign(回答日時=dates)
+    return df_data.take(sorted_run_positions(dates))
+
+
+def frame_fingerprint(df):
+    """
+    データフレームの内容（列名・型・値）からフィンガープリントを計算する
+
+    ColumnBlockStore の場合は、一定の行数ずつ組み立てた値からハッシュを計算する
+    （ブロックごとに型が異なるため、型は含めない）。
+
+    Args:
+        df: pandas.DataFrame、または ColumnBlockStore
+
+    Returns:
+        str: SHA-256のハッシュ値
+    """
+    digest = hashlib.sha256()
+    digest.update(json.dumps([str(c) for c in df.columns], ensure_ascii=False).encode('utf-8'))
+    if isinstance(df, ColumnBlockStore):
+        frames = df.iter_frames()
+    else:
+        digest.update(json.dumps([str(t) for t in df.dtypes], ensure_ascii=False).encode('utf-8'))
+        frames = [df]
+    if len(df.columns):
+        for frame in frames:
+            digest.update(pd.util.hash_pandas_object(frame, index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def client_result_fingerprint(client_info):
+    """
+    クライアント別の集計結果（出力ファイルの内容）のフィンガープリントを計算する
+
+    Args:
+        client_info: aggregate_data が返すクライアントごとの結果
+
+    Returns:
+        str: SHA-256のハッシュ値
+    """
+    digest = hashlib.sha256()
+    digest.update(frame_fingerprint(client_info['data']).encode('ascii'))
+    digest.update(frame_fingerprint(client_info['mapping'].astype(str)).encode('ascii'))
+    digest.update(str(client_info['base_file']).encode('utf-8'))
+    return digest.hexdigest()
+
+
+class IncrementalStore:
+    """
+    増分集計用の、ファイルごとの読み込み結果の保存先
+
+    アンケートファイルの内容・ファイル名・質問マッピング・読み込む列の組み合わせから
+    フィンガープリントを計算し、列名変換と回答日時順の並べ替えを済ませたデータと
+    質問対応表データを保存する。同じフィンガープリントのファイルは次回以降
+    Excelを解析せずに保存済みの結果を使う。
+
+    容量上限を超えた場合は、最後にアクセスされた日時が古いものから削除する（LRU）。
+    出力済みファイルのフィンガープリント（outputs.json）もここに保存する。
+    """
+
+    def __init__(self, state_dir=DEFAULT_STATE_DIR, max_bytes=DEFAULT_STATE_MAX_BYTES):
+        self.state_dir = state_dir
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def fingerprint(content, filename, q_to_text_map, column_plan=None):
+        """
+        ファイルの読み込み結果を特定するフィンガープリントを計算する
+
+        Args:
+            content: ファイルの内容（バイト列）
+            filename: 文字化け対策済みのファイル名
+            q_to_text_map: 質問番号 → 質問文 の辞書
+            column_plan: 必要列の情報（Noneの場合はすべての列を読み込む）
+
+        Returns:
+            str: SHA-256のハッシュ値
+        """
+        settings = {
+            'version': STORE_VERSION,
+            'filename': filename,
+            'mapping': sorted([str(k), str(v)] for k, v in q_to_text_map.items()),
+            'questions': None if column_plan is None else sorted(str(q) for q in column_plan['questions']),
+        }
+        digest = hashlib.sha256(content)
+        digest.update(json.dumps(settings, ensure_ascii=False).encode('utf-8'))
+        return digest.hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.state_dir, f"{key}.pkl")
+
+    def load(self, key):
+        """
+        保存済みの読み込み結果を取得する
+
+        Args:
+            key: fingerprint で計算したキー
+
+        Returns:
+            dict: {'data': DataFrame, 'rows': 元の行数, 'mapping': 質問対応表データ, 'logs': ログ}
+                  保存されていない場合は None
+        """
+        path = self._entry_path(key)
+        try:
+            entry = pd.read_pickle(path)
+            # 最終アクセス日時を更新（LRU用）
+            os.utime(path)
+            return entry
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logging.warning(f"Failed to load incremental entry {key}: {e}")
+            if os.path.exists(path):
+                os.remove(path)
+            return None
+
+    def store(self, key, entry):
+        """
+        読み込み結果を保存する
+
+        Args:
+            key: fingerprint で計算したキー
+            entry: load と同じ形式の辞書
+        """
+        os.makedirs(self.state_dir, exist_ok=True)
+        # 一時ファイルに書き込んでから置き換え、書き込み途中の結果が見えないようにする
+        tmp_path = os.path.join(self.state_dir, f".tmp-{uuid.uuid4().hex}")
+        try:
+            pd.to_pickle(entry, tmp_path)
+            os.replace(tmp_path, self._entry_path(key))
+        except Exception as e:
+            logging.warning(f"Failed to store incremental entry {key}: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        self.evict()
+
+    def evict(self):
+        """容量上限を超えている場合、最終アクセス日時の古い読み込み結果から削除する"""
+        if not os.path.isdir(self.state_dir):
+            return
+        entries = []
+        for name in os.listdir(self.state_dir):
+            if not name.endswith('.pkl') or name.startswith('.'):
+                continue
+            path = os.path.join(self.state_dir, name)
+            try:
+                entries.append((os.path.getmtime(path), os.path.getsize(path), path))
+            except OSError:
+                continue
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+            logging.info(f"Evicted incremental entry {os.path.basename(path)}")
+
+    def load_outputs(self):
+        """
+        出力済みファイルのフィンガープリントを読み込む
+
+        Returns:
+            dict: 出力ファイルのパス → フィンガープリント
+        """
+        try:
+            with open(os.path.join(self.state_dir, OUTPUTS_FILE), encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def save_outputs(self, outputs):
+        """
+        出力済みファイルのフィンガープリントを保存する
+
+        Args:
+            outputs: 出力ファイルのパス → フィンガープリント
+        """
+        os.makedirs(self.state_dir, exist_ok=True)
+        tmp_path = os.path.join(self.state_dir, f".tmp-{uuid.uuid4().hex}")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(outputs, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, os.path.join(self.state_dir, OUTPUTS_FILE))
+
+    def clear(self):
+        """保存済みの読み込み結果と出力情報をすべて削除する"""
+        shutil.rmtree(self.state_dir, ignore_errors=True)
+
+
+def merge_sorted_runs(runs):
+    """
+    回答日時順に並べ替え済みのファイルごとのデータを1つに併合する
+
+    各データのインデックスは、全ファイルを順に連結した場合の行位置に振り直す
+    （通常の集計で pd.concat(ignore_index=True) した場合と同じ）。
+    ファイルごとのデータは並べ替え済みのため、連結後の安定ソートは並び済みの区間の併合になる。
+    回答日時が同じ行は、ファイルの順序・ファイル内の行の順序を保つ。
+
+    Args:
+        runs: (sort_survey_run で並べ替えたデータ, 元の行数) のリスト（ファイルの順序）
+
+    Returns:
+        pandas.DataFrame: 併合したデータ
+    """
+    offsets = np.cumsum([0] + [rows for _, rows in runs[:-1]])
+    labels = np.concatenate([
+        df.index.to_numpy(dtype=np.int64) + offset for (df, _), offset in zip(runs, offsets)
+    ])
+    merged_df = pd.concat([df for df, _ in runs], ignore_index=True, sort=False)
+
+    if '回答日時' in merged_df.columns:
+        # 回答日時の列がないファイルの行は NaT になるため、通常の集計と同様に除外する
+        response_times, order = order_by_response_time([df for df, _ in runs])
+        merged_df['回答日時'] = response_times
+        merged_df.index = pd.Index(labels)
+        merged_df = merged_df.take(order)
+    return merged_df
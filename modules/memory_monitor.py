@@ -0,0 +1,121 @@
+import logging
+import os
+import threading
+
+# ログ設定
+logging.basicConfig(level=logging.INFO)
+
+try:
+    import psutil  # 任意: プロセスのメモリ使用量（RSS）の取得に使用
+    PSUTIL_AVAILABLE = True
+except ImportError:
+    PSUTIL_AVAILABLE = False
+
+# メモリ使用量の上限（bytes、環境変数で変更可能）
+# Streamlitのホストのメモリ制限に合わせて設定する
+DEFAULT_MEMORY_BUDGET_BYTES = int(os.environ.get('TRI_MERGER_MEMORY_BUDGET_BYTES', 1024 * 1024 * 1024))
+
+# Excelファイルのサイズに対する処理中のピークメモリの倍率（見積もり用）
+# 合成したアンケートファイル（約5MB）での実測値（集計: 約17倍、質問マスター作成: 約4.5倍）を切り上げた値
+AGGREGATION_MEMORY_FACTOR = float(os.environ.get('TRI_MERGER_AGGREGATION_MEMORY_FACTOR', 20))
+QUESTION_MASTER_MEMORY_FACTOR = float(os.environ.get('TRI_MERGER_QUESTION_MASTER_MEMORY_FACTOR', 5))
+
+# RSSを確認する間隔（秒）
+RSS_SAMPLE_INTERVAL = 0.01
+
+
+def current_rss_bytes():
+    """
+    現在のプロセスのメモリ使用量（RSS、bytes）を返す
+
+    psutil がある場合はそれを使い、ない場合は /proc/self/statm（Linux）から読み取る。
+    取得できない環境では None を返す。
+    """
+    if PSUTIL_AVAILABLE:
+        return psutil.Process().memory_info().rss
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+class RssSampler:
+    """
+    別スレッドで一定間隔ごとにRSSを確認し、最大値を記録するクラス
+
+    tracemalloc と異なり処理を遅くしないが、確認の間隔より短いピークは記録されない。
+    """
+
+    def __init__(self, interval=RSS_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.peak = current_rss_bytes() or 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='rss-sampler', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def sample(self):
+        """現在のRSSを確認して最大値を更新し、現在のRSSを返す"""
+        rss = current_rss_bytes() or 0
+        with self._lock:
+            self.peak = max(self.peak, rss)
+        return rss
+
+    def reset_peak(self):
+        """最大値を現在のRSSに戻す"""
+        rss = current_rss_bytes() or 0
+        with self._lock:
+            self.peak = rss
+
+    def stop(self):
+        """確認を停止する"""
+        self._stop.set()
+        self._thread.join()
+
+
+def estimate_peak_bytes(file_sizes, factor=AGGREGATION_MEMORY_FACTOR):
+    """
+    アップロードされたファイルを処理する場合のピークメモリを見積もる
+
+    Args:
+        file_sizes: ファイルサイズ（bytes）のリスト
+        factor: ファイルサイズに対するピークメモリの倍率
+
+    Returns:
+        int: 現在のメモリ使用量（RSS、取得できない場合は0）+ ファイルサイズの合計 × 倍率
+    """
+    total = sum(size for size in file_sizes if isinstance(size, int))
+    return int((current_rss_bytes() or 0) + total * factor)
+
+
+def check_memory_budget(file_sizes, budget_bytes=DEFAULT_MEMORY_BUDGET_BYTES,
+                        factor=AGGREGATION_MEMORY_FACTOR):
+    """
+    見積もったピークメモリが上限を超える場合に警告メッセージを返す
+
+    Args:
+        file_sizes: ファイルサイズ（bytes）のリスト
+        budget_bytes: メモリ使用量の上限（bytes、Noneまたは0の場合は確認しない）
+        factor: ファイルサイズに対するピークメモリの倍率
+
+    Returns:
+        str: 警告メッセージ（上限以内の場合は None）
+    """
+    if not budget_bytes:
+        return None
+    projected = estimate_peak_bytes(file_sizes, factor)
+    if projected <= budget_bytes:
+        return None
+    total = sum(size for size in file_sizes if isinstance(size, int))
+    message = (
+        f"メモリ不足の可能性があります: ファイルの合計 {total / 1024 / 1024:.1f}MB から見積もった"
+        f"ピークメモリ {projected / 1024 / 1024:.0f}MB が上限 {budget_bytes / 1024 / 1024:.0f}MB を超えています。"
+        f"ファイルを分けて処理するか、必要な列のみの読み込み・列ブロック保持を有効にしてください。"
+    )
+    logging.warning(message)
+    return message
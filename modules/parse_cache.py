@@ -0,0 +1,300 @@
+import pandas as pd
+import numpy as np
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import uuid
+from modules.shared_cache import get_shared_cache, KIND_WORKBOOK
+
+# ログ設定
+logging.basicConfig(level=logging.INFO)
+
+try:
+    import pyarrow  # noqa: F401  Feather形式の読み書きに使用
+    FEATHER_AVAILABLE = True
+except ImportError:
+    FEATHER_AVAILABLE = False
+
+# キャッシュの保存先と容量上限（環境変数で変更可能）
+DEFAULT_CACHE_DIR = os.environ.get(
+    'TRI_MERGER_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'tri_merger_cache')
+)
+DEFAULT_CACHE_MAX_BYTES = int(os.environ.get('TRI_MERGER_CACHE_MAX_BYTES', 1024 * 1024 * 1024))
+
+META_FILE = 'meta.json'
+
+
+class ParsedWorkbookCache:
+    """
+    解析済みアンケートファイルのディスクキャッシュ
+
+    ファイル内容のSHA-256ハッシュをキーとして、解析済みのシート
+    （dataシート・質問対応表シートのうち実際に解析したもの）とシート一覧を保存する。
+    シートは可能な限りFeather形式（列指向）で保存し、Featherで表現できない
+    シート（列名が文字列でない、型が混在している等）はpickleで保存する。
+
+    容量上限を超えた場合は、最後にアクセスされた日時が古いものから削除する（LRU）。
+    エントリごとにディレクトリを分けているため、複数プロセスから同時に利用できる。
+
+    memory_cache（SharedMemoryCache）を指定した場合は、ディスクの前にメモリ上の共有キャッシュを確認し、
+    同じプロセスの他のセッションが解析・読み込み済みのシートをそのまま共有する。
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_CACHE_MAX_BYTES, memory_cache=None):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.memory_cache = memory_cache
+
+    def __getstate__(self):
+        """
+        ワーカープロセスに渡す場合は、ディスクのキャッシュの設定だけを渡す
+
+        共有キャッシュ（SharedMemoryCache）はロックを持つためpickleできず、
+        別プロセスでは共有もできないため、ワーカープロセスではディスクのみのキャッシュとして使う。
+        """
+        state = self.__dict__.copy()
+        state['memory_cache'] = None
+        return state
+
+    @staticmethod
+    def key_for(content):
+        """ファイル内容（バイト列）からキャッシュキーを計算する"""
+        return hashlib.sha256(content).hexdigest()
+
+    def _entry_dir(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def load(self, key):
+        """
+        キャッシュからシートを読み込む
+
+        Args:
+            key: key_for で計算したキャッシュキー
+
+        Returns:
+            dict: {'sheet_names': [...], 'sheets': {シート名: DataFrame}}
+                  キャッシュに存在しない場合は None
+                  （共有キャッシュから読み込んだシートは他のセッションと共有しているため、変更しないこと）
+        """
+        if self.memory_cache is not None:
+            cached = self.memory_cache.get((KIND_WORKBOOK, key))
+            if cached is not None:
+                return cached
+
+        entry_dir = self._entry_dir(key)
+        meta_path = os.path.join(entry_dir, META_FILE)
+        try:
+            with open(meta_path, encoding='utf-8') as f:
+                meta = json.load(f)
+
+            sheets = {}
+            for sheet in meta['sheets']:
+                path = os.path.join(entry_dir, sheet['file'])
+                if sheet['format'] == 'feather':
+                    sheets[sheet['name']] = self._read_feather(path)
+                else:
+                    sheets[sheet['name']] = pd.read_pickle(path)
+
+            # 最終アクセス日時を更新（LRU用）
+            os.utime(meta_path)
+            return self._share({'sheet_names': meta['sheet_names'], 'sheets': sheets}, key)
+
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logging.warning(f"Failed to load parse cache entry {key}: {e}")
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            return None
+
+    def store(self, key, sheet_names, sheets):
+        """
+        解析済みのシートをキャッシュに保存する
+
+        同じキーのエントリが既にある場合は、まだ保存していないシートだけを追加する
+        （質問マスター作成時に質問対応表シートだけを保存し、集計時にdataシートを追加する等）。
+
+        Args:
+            key: key_for で計算したキャッシュキー
+            sheet_names: ブック内のシート名のリスト
+            sheets: {シート名: DataFrame} の辞書
+        """
+        self._share_sheets(key, sheet_names, sheets)
+        entry_dir = self._entry_dir(key)
+        meta_path = os.path.join(entry_dir, META_FILE)
+        if os.path.exists(meta_path):
+            self._add_sheets(key, meta_path, sheets)
+            return
+
+        # 一時ディレクトリに書き込んでからリネームし、書き込み途中のエントリが見えないようにする
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_dir = os.path.join(self.cache_dir, f".tmp-{uuid.uuid4().hex}")
+        os.makedirs(tmp_dir)
+        try:
+            meta_sheets = []
+            for i, (name, df) in enumerate(sheets.items()):
+                file_format = self._write_sheet(df, os.path.join(tmp_dir, f"sheet{i}"))
+                meta_sheets.append({'name': name, 'file': f"sheet{i}.{file_format}", 'format': file_format})
+
+            with open(os.path.join(tmp_dir, META_FILE), 'w', encoding='utf-8') as f:
+                json.dump({'sheet_names': list(sheet_names), 'sheets': meta_sheets}, f, ensure_ascii=False)
+
+            os.rename(tmp_dir, entry_dir)
+        except OSError:
+            # 他のプロセスが同じエントリを先に保存した場合など
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            return
+        except Exception as e:
+            logging.warning(f"Failed to store parse cache entry {key}: {e}")
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            return
+
+        self.evict()
+
+    def _add_sheets(self, key, meta_path, sheets):
+        """既存のエントリに、まだ保存していないシートを追加する"""
+        entry_dir = os.path.dirname(meta_path)
+        try:
+            with open(meta_path, encoding='utf-8') as f:
+                meta = json.load(f)
+            stored = {sheet['name'] for sheet in meta['sheets']}
+            new_sheets = {name: df for name, df in sheets.items() if name not in stored}
+            if not new_sheets:
+                return
+
+            # シートのファイルを書き込んでから meta.json を置き換える（meta.json にないファイルは読み込まれない）
+            for name, df in new_sheets.items():
+                file_id = f"sheet-{uuid.uuid4().hex[:12]}"
+                file_format = self._write_sheet(df, os.path.join(entry_dir, file_id))
+                meta['sheets'].append({'name': name, 'file': f"{file_id}.{file_format}", 'format': file_format})
+
+            tmp_meta_path = os.path.join(entry_dir, f".tmp-{uuid.uuid4().hex}")
+            with open(tmp_meta_path, 'w', encoding='utf-8') as f:
+                json.dump(meta, f, ensure_ascii=False)
+            os.replace(tmp_meta_path, meta_path)
+        except Exception as e:
+            # 削除と同時に追加した場合など（追加できなかったシートは次回も解析する）
+            logging.warning(f"Failed to add sheets to parse cache entry {key}: {e}")
+            return
+
+        self.evict()
+
+    def _share_sheets(self, key, sheet_names, sheets):
+        """解析したシートを共有キャッシュのエントリに追加する"""
+        if self.memory_cache is None:
+            return
+        cached = self.memory_cache.peek((KIND_WORKBOOK, key))
+        if cached is None:
+            self._share({'sheet_names': list(sheet_names), 'sheets': dict(sheets)}, key)
+        elif not set(sheets) <= set(cached['sheets']):
+            # 共有しているエントリは変更せず、シートを追加した新しいエントリに置き換える
+            merged = {'sheet_names': cached['sheet_names'], 'sheets': {**sheets, **cached['sheets']}}
+            self.memory_cache.replace((KIND_WORKBOOK, key), merged)
+
+    def _share(self, entry, key):
+        """読み込んだシートを共有キャッシュに保存し、共有キャッシュにある値を返す"""
+        if self.memory_cache is None:
+            return entry
+        return self.memory_cache.put((KIND_WORKBOOK, key), entry)
+
+    @staticmethod
+    def _read_feather(path):
+        """Featherを読み込み、文字列列の欠損値をExcelから直接読み込んだ場合と同じNaNに揃える"""
+        df = pd.read_feather(path)
+        object_columns = df.columns[df.dtypes == object]
+        if len(object_columns):
+            df[object_columns] = df[object_columns].where(df[object_columns].notna(), np.nan)
+        return df
+
+    @staticmethod
+    def _write_sheet(df, path_without_ext):
+        """シートをFeather形式で保存し、できない場合はpickleで保存する。保存形式を返す"""
+        columns = list(df.columns)
+        if (FEATHER_AVAILABLE
+                and all(isinstance(c, str) for c in columns)
+                and len(set(columns)) == len(columns)
+                and isinstance(df.index, pd.RangeIndex) and df.index.start == 0 and df.index.step == 1):
+            try:
+                df.to_feather(f"{path_without_ext}.feather")
+                return 'feather'
+            except Exception:
+                # 型が混在した列などFeatherで表現できない場合
+                if os.path.exists(f"{path_without_ext}.feather"):
+                    os.remove(f"{path_without_ext}.feather")
+        df.to_pickle(f"{path_without_ext}.pkl")
+        return 'pkl'
+
+    def entries(self):
+        """
+        キャッシュのエントリ一覧を返す
+
+        Returns:
+            pandas.DataFrame: キー、シート名、サイズ（bytes）、最終アクセス日時の一覧
+                              （最終アクセス日時の新しい順）
+        """
+        rows = []
+        if os.path.isdir(self.cache_dir):
+            for key in os.listdir(self.cache_dir):
+                entry_dir = self._entry_dir(key)
+                meta_path = os.path.join(entry_dir, META_FILE)
+                if key.startswith('.') or not os.path.exists(meta_path):
+                    continue
+                try:
+                    with open(meta_path, encoding='utf-8') as f:
+                        meta = json.load(f)
+                    size = sum(
+                        os.path.getsize(os.path.join(entry_dir, name)) for name in os.listdir(entry_dir)
+                    )
+                    rows.append({
+                        'キー': key,
+                        'シート': ', '.join(sheet['name'] for sheet in meta['sheets']),
+                        'サイズ(bytes)': size,
+                        '最終アクセス': pd.Timestamp(os.path.getmtime(meta_path), unit='s'),
+                    })
+                except OSError:
+                    # 削除と同時に参照した場合
+                    continue
+
+        entries_df = pd.DataFrame(rows, columns=['キー', 'シート', 'サイズ(bytes)', '最終アクセス'])
+        return entries_df.sort_values('最終アクセス', ascending=False, ignore_index=True)
+
+    def total_bytes(self):
+        """キャッシュの合計サイズ（bytes）を返す"""
+        return int(self.entries()['サイズ(bytes)'].sum())
+
+    def evict(self):
+        """容量上限を超えている場合、最終アクセス日時の古いエントリから削除する"""
+        entries_df = self.entries()
+        total = int(entries_df['サイズ(bytes)'].sum())
+        for row in entries_df.iloc[::-1].itertuples(index=False):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(self._entry_dir(row[0]), ignore_errors=True)
+            total -= row[2]
+            logging.info(f"Evicted parse cache entry {row[0]}")
+
+    def clear(self):
+        """キャッシュをすべて削除する（共有キャッシュの解析済みシートも削除する）"""
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+        if self.memory_cache is not None:
+            self.memory_cache.clear(KIND_WORKBOOK)
+
+
+_default_cache = None
+
+
+def get_default_cache():
+    """
+    既定の設定（環境変数 TRI_MERGER_CACHE_DIR / TRI_MERGER_CACHE_MAX_BYTES）のキャッシュを返す
+
+    プロセス内の共有キャッシュ（get_shared_cache）をメモリ上のキャッシュとして使う。
+
+    Returns:
+        ParsedWorkbookCache: 既定のキャッシュ
+    """
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = ParsedWorkbookCache(memory_cache=get_shared_cache())
+    return _default_cache
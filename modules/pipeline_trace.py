@@ -0,0 +1,324 @@
+import pandas as pd
+import json
+import logging
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+from modules.memory_monitor import current_rss_bytes, RssSampler
+
+# ログ設定
+logging.basicConfig(level=logging.INFO)
+
+# 区間の種類
+KIND_STAGE = 'stage'
+KIND_FILE = 'file'
+KIND_CLIENT = 'client'
+
+# 表示用の列名（to_frame）
+FRAME_COLUMNS = {
+    'kind': '種類',
+    'stage': '処理',
+    'name': '対象',
+    'start': '開始(秒)',
+    'seconds': '処理時間(秒)',
+    'rows': '行数',
+    'cols': '列数',
+    'bytes': 'ファイルサイズ(bytes)',
+    'peak_bytes': 'ピークメモリ(bytes)',
+    'retained_bytes': '増加メモリ(bytes)',
+    'rss_bytes': '終了時のRSS(bytes)',
+}
+MEMORY_COLUMNS = ['peak_bytes', 'retained_bytes', 'rss_bytes']
+KIND_LABELS = {KIND_STAGE: '処理段階', KIND_FILE: 'ファイル', KIND_CLIENT: 'クライアント'}
+
+# メモリの計測方法
+MEMORY_TRACEMALLOC = 'tracemalloc'
+MEMORY_RSS = 'rss'
+
+# tracemalloc はプロセス全体で1つのため、同時に実行している計測の数で開始・停止を管理する
+_tracemalloc_lock = threading.Lock()
+_tracemalloc_users = 0
+_tracemalloc_started = False
+
+
+def _acquire_tracemalloc():
+    """tracemalloc の利用を開始する（最初の利用者が開始する）"""
+    global _tracemalloc_users, _tracemalloc_started
+    with _tracemalloc_lock:
+        if _tracemalloc_users == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _tracemalloc_started = True
+        _tracemalloc_users += 1
+
+
+def _release_tracemalloc():
+    """tracemalloc の利用を終了する（このモジュールで開始した場合は、最後の利用者が停止する）"""
+    global _tracemalloc_users, _tracemalloc_started
+    with _tracemalloc_lock:
+        _tracemalloc_users -= 1
+        if _tracemalloc_users == 0 and _tracemalloc_started:
+            tracemalloc.stop()
+            _tracemalloc_started = False
+
+
+def _reset_tracemalloc_peak():
+    """
+    他の計測が実行中でない場合だけ tracemalloc のピークをリセットする
+
+    Returns:
+        bool: リセットした場合True（他の計測が実行中の場合はFalse）
+    """
+    with _tracemalloc_lock:
+        if _tracemalloc_users != 1:
+            return False
+        tracemalloc.reset_peak()
+        return True
+
+
+class PipelineTrace:
+    """
+    集計処理の計測結果（処理段階・ファイル・クライアントごとの処理時間と件数）を記録するクラス
+
+    各区間は辞書として記録する。
+        kind: 区間の種類（'stage': 処理段階, 'file': ファイル, 'client': クライアント）
+        stage: 処理段階の名前（例: '読み込み', '結合'）
+        name: 対象のファイル名・クライアント名（処理段階の場合は空文字）
+        start: 計測開始からの経過秒数
+        seconds: 処理時間（秒）
+        rows / cols / bytes: 行数・列数・読み込んだ（出力した）ファイルのバイト数（該当しない場合は None）
+
+    track_memory を指定した場合は区間ごとのメモリも記録する。
+        'tracemalloc'（True）: Pythonが確保したメモリを tracemalloc で正確に計測する
+                              （Excelの解析などは数倍以上遅くなる）
+        'rss': 別スレッドでプロセスのメモリ使用量（RSS）を一定間隔で確認する
+               （処理はほとんど遅くならないが、短いピークは記録されない）
+        peak_bytes: 区間内のピークメモリ（区間開始時からの増加分）
+        retained_bytes: 区間終了時に残っているメモリ（区間開始時からの増加分）
+        rss_bytes: 区間終了時のプロセスのメモリ使用量（RSS）
+
+    どちらの方法でも計測値はプロセス全体のメモリであり、同じプロセスで同時に実行している
+    他の処理（Streamlitの他のセッションの集計など）が確保したメモリも含む。
+    tracemalloc はプロセス内の計測で共有し、ピークは他の計測が実行中でない場合だけリセットする。
+    他の計測の実行中に開始した区間のピークは区間開始時より前のピークを含みうるため、peak_bytes は None とする。
+
+    使い方:
+        trace = PipelineTrace()
+        with trace.span('結合') as span:
+            merged_df = pd.concat(...)
+            span.update(rows=len(merged_df), cols=len(merged_df.columns))
+    """
+
+    def __init__(self, track_memory=False):
+        self.started_at = datetime.now().isoformat(timespec='seconds')
+        self.track_memory = MEMORY_TRACEMALLOC if track_memory is True else (track_memory or False)
+        if self.track_memory == MEMORY_RSS and current_rss_bytes() is None:
+            logging.warning("RSS is not available on this platform; using tracemalloc instead.")
+            self.track_memory = MEMORY_TRACEMALLOC
+        self.spans = []
+        self._origin = time.perf_counter()
+        self._memory_stack = []
+        self._tracing = False
+        self._rss_sampler = None
+
+    def begin(self, stage, name='', kind=KIND_STAGE, **metrics):
+        """
+        区間の計測を開始する（with で囲めない処理用、end で終了する）
+
+        Args:
+            stage: 処理段階の名前
+            name: 対象のファイル名・クライアント名
+            kind: 区間の種類
+            **metrics: rows / cols / bytes の初期値
+
+        Returns:
+            dict: 記録する区間
+        """
+        record = self._new_record(stage, name, kind, time.perf_counter() - self._origin, metrics)
+        record['_memory'] = self._enter_memory() if self.track_memory else None
+        return record
+
+    def end(self, record, **metrics):
+        """
+        begin で開始した区間の計測を終了して記録する
+
+        Args:
+            record: begin が返した区間
+            **metrics: rows / cols / bytes
+        """
+        record['seconds'] = time.perf_counter() - self._origin - record['start']
+        memory = record.pop('_memory')
+        if memory is not None:
+            record.update(self._exit_memory(memory))
+        record.update(metrics)
+        self.spans.append(record)
+        return record
+
+    @contextmanager
+    def span(self, stage, name='', kind=KIND_STAGE, **metrics):
+        """
+        with ブロック内の処理時間を1つの区間として記録する
+
+        Args:
+            stage: 処理段階の名前
+            name: 対象のファイル名・クライアント名
+            kind: 区間の種類
+            **metrics: rows / cols / bytes の初期値
+
+        Yields:
+            dict: 記録する区間（ブロック内で rows などを update できる）
+        """
+        record = self.begin(stage, name, kind, **metrics)
+        try:
+            yield record
+        finally:
+            self.end(record)
+
+    def add(self, stage, seconds, name='', kind=KIND_STAGE, start=None, **metrics):
+        """
+        別の場所（ワーカープロセスなど）で計測した区間を記録する
+
+        Args:
+            stage: 処理段階の名前
+            seconds: 処理時間（秒）
+            name: 対象のファイル名・クライアント名
+            kind: 区間の種類
+            start: 計測開始からの経過秒数（Noneの場合は現在から処理時間を引いた値）
+            **metrics: rows / cols / bytes / peak_bytes / retained_bytes
+        """
+        if start is None:
+            start = max(time.perf_counter() - self._origin - seconds, 0.0)
+        record = self._new_record(stage, name, kind, start, metrics)
+        record['seconds'] = seconds
+        self.spans.append(record)
+        return record
+
+    @staticmethod
+    def _new_record(stage, name, kind, start, metrics):
+        record = {
+            'kind': kind,
+            'stage': stage,
+            'name': name,
+            'start': start,
+            'seconds': None,
+            'rows': None,
+            'cols': None,
+            'bytes': None,
+            'peak_bytes': None,
+            'retained_bytes': None,
+            'rss_bytes': None,
+        }
+        record.update(metrics)
+        return record
+
+    def _memory_usage(self):
+        """計測方法に応じて、現在のメモリ使用量と前回のリセット以降のピークを返す"""
+        if self.track_memory == MEMORY_RSS:
+            if self._rss_sampler is None:
+                self._rss_sampler = RssSampler()
+            current = self._rss_sampler.sample()
+            return current, self._rss_sampler.peak
+        if not self._tracing:
+            _acquire_tracemalloc()
+            self._tracing = True
+        return tracemalloc.get_traced_memory()
+
+    def _reset_peak(self):
+        """ピークをリセットする（他の計測が実行中でリセットできない場合はFalseを返す）"""
+        if self.track_memory == MEMORY_RSS:
+            self._rss_sampler.reset_peak()
+            return True
+        return _reset_tracemalloc_peak()
+
+    def _enter_memory(self):
+        """区間の開始時のメモリを記録する（入れ子の区間のピークは外側の区間にも反映する）"""
+        current, peak = self._memory_usage()
+        if self._memory_stack:
+            self._memory_stack[-1]['peak'] = max(self._memory_stack[-1]['peak'], peak)
+        memory = {'start': current, 'peak': current, 'peak_valid': self._reset_peak()}
+        self._memory_stack.append(memory)
+        return memory
+
+    def _exit_memory(self, memory):
+        """区間の終了時のメモリから、ピーク・残っているメモリを求める"""
+        current, peak = self._memory_usage()
+        self._memory_stack = [frame for frame in self._memory_stack if frame is not memory]
+        memory['peak'] = max(memory['peak'], peak)
+        if self._memory_stack:
+            self._memory_stack[-1]['peak'] = max(self._memory_stack[-1]['peak'], memory['peak'])
+        return {
+            'peak_bytes': memory['peak'] - memory['start'] if memory['peak_valid'] else None,
+            'retained_bytes': current - memory['start'],
+            'rss_bytes': current_rss_bytes(),
+        }
+
+    def close(self):
+        """メモリの計測のために開始した tracemalloc・RSSの確認を停止する"""
+        if self._tracing:
+            _release_tracemalloc()
+            self._tracing = False
+        if self._rss_sampler is not None:
+            self._rss_sampler.stop()
+            self._rss_sampler = None
+        self._memory_stack = []
+
+    def to_records(self):
+        """
+        記録した区間を開始順に並べた辞書のリストを返す
+
+        Returns:
+            list: 区間の辞書のリスト
+        """
+        return sorted((dict(span) for span in self.spans), key=lambda span: span['start'])
+
+    def to_frame(self):
+        """
+        記録した区間を表示用のデータフレームとして返す（開始順、列名は日本語）
+
+        Returns:
+            pandas.DataFrame: 区間の一覧
+        """
+        return records_to_frame(self.to_records())
+
+    def to_json(self):
+        """
+        記録した区間をJSON文字列として返す
+
+        Returns:
+            str: {'started_at': 計測開始日時, 'total_seconds': 合計時間, 'spans': 区間のリスト}
+        """
+        records = self.to_records()
+        payload = {
+            'started_at': self.started_at,
+            'total_seconds': total_seconds(records),
+            'spans': records,
+        }
+        return json.dumps(payload, ensure_ascii=False, indent=1)
+
+
+def total_seconds(records):
+    """処理段階の区間の処理時間の合計を返す"""
+    return sum(record['seconds'] or 0 for record in records if record['kind'] == KIND_STAGE)
+
+
+def records_to_frame(records):
+    """
+    区間の辞書のリスト（PipelineTrace.to_records）を表示用のデータフレームに変換する
+
+    Args:
+        records: 区間の辞書のリスト
+
+    Returns:
+        pandas.DataFrame: 区間の一覧（列名は日本語、行数などは欠損値対応の整数型）
+                          メモリを計測していない場合、メモリの列は含めない
+    """
+    frame = pd.DataFrame(list(records), columns=list(FRAME_COLUMNS))
+    frame['kind'] = frame['kind'].map(KIND_LABELS).fillna(frame['kind'])
+    for column in ('rows', 'cols', 'bytes', *MEMORY_COLUMNS):
+        frame[column] = frame[column].astype('Int64')
+    if frame[MEMORY_COLUMNS].isna().all().all():
+        frame = frame.drop(columns=MEMORY_COLUMNS)
+    frame['start'] = frame['start'].astype(float).round(3)
+    frame['seconds'] = frame['seconds'].astype(float).round(3)
+    return frame.rename(columns=FRAME_COLUMNS)
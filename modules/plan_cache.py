@@ -0,0 +1,186 @@
+import json
+import logging
+import os
+import tempfile
+import uuid
+import numpy as np
+from modules.shared_cache import get_shared_cache, KIND_CLIENT_PLAN
+
+# ログ設定
+logging.basicConfig(level=logging.INFO)
+
+# 集計計画の保存先と保存数の上限（環境変数で変更可能）
+DEFAULT_PLAN_CACHE_DIR = os.environ.get(
+    'TRI_MERGER_PLAN_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'tri_merger_plans')
+)
+DEFAULT_PLAN_CACHE_MAX_ENTRIES = int(os.environ.get('TRI_MERGER_PLAN_CACHE_MAX_ENTRIES', 100))
+
+
+def plan_to_json(plan, indent=None):
+    """
+    集計計画をJSON文字列にする（numpy の数値は Python の数値に、それ以外の値は文字列に変換する）
+
+    Args:
+        plan: 集計計画（compile_client_plan の戻り値）
+        indent: インデント（Noneの場合は1行）
+
+    Returns:
+        str: JSON文字列
+    """
+    def default(value):
+        if isinstance(value, np.generic):
+            return value.item()
+        return str(value)
+
+    return json.dumps(plan, ensure_ascii=False, indent=indent, default=default)
+
+
+class ClientPlanCache:
+    """
+    クライアント別の集計計画のキャッシュ
+
+    集計計画の入力（クライアント設定・質問マスター・中間データの列・質問対応表）のハッシュをキーとして、
+    集計計画をJSONファイルで保存する。memory_cache（SharedMemoryCache）を指定した場合は、
+    ディスクの前にメモリ上の共有キャッシュを確認する。
+    JSONに変換すると値が変わる集計計画（列名が文字列・数値以外の場合など）はディスクに保存しない。
+    保存数の上限を超えた場合は、最後にアクセスされた日時が古いものから削除する。
+    """
+
+    def __init__(self, cache_dir=DEFAULT_PLAN_CACHE_DIR, max_entries=DEFAULT_PLAN_CACHE_MAX_ENTRIES,
+                 memory_cache=None):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.memory_cache = memory_cache
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def load(self, key):
+        """
+        キャッシュから集計計画を読み込む
+
+        Args:
+            key: 集計計画の入力のハッシュ（client_plan_key）
+
+        Returns:
+            dict: 集計計画（存在しない場合は None、他のセッションと共有しているため変更しないこと）
+        """
+        if self.memory_cache is not None:
+            cached = self.memory_cache.get((KIND_CLIENT_PLAN, key))
+            if cached is not None:
+                return cached
+        path = self._path(key)
+        try:
+            with open(path, encoding='utf-8') as f:
+                plan = json.load(f)
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return self._share(plan, key)
+
+    def store(self, key, plan):
+        """
+        集計計画をキャッシュに保存する
+
+        Args:
+            key: 集計計画の入力のハッシュ（client_plan_key）
+            plan: 集計計画
+
+        Returns:
+            dict: キャッシュにある集計計画（共有キャッシュに同じキーの値がある場合はその値）
+        """
+        plan = self._share(plan, key)
+        serialized = plan_to_json(plan)
+        if json.loads(serialized) != plan:
+            logging.info(f"Client plan {key} cannot be stored as JSON without changes; keeping it in memory only")
+            return plan
+
+        # 一時ファイルに書き込んでからリネームし、書き込み途中のファイルが見えないようにする
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp_path = os.path.join(self.cache_dir, f".tmp-{uuid.uuid4().hex}")
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(serialized)
+            os.replace(tmp_path, self._path(key))
+        except OSError as e:
+            logging.warning(f"Failed to store client plan {key}: {e}")
+            return plan
+        self.evict()
+        return plan
+
+    def get_or_create(self, key, factory):
+        """
+        キャッシュから集計計画を取得し、ない場合は factory で作成して保存する
+
+        Args:
+            key: 集計計画の入力のハッシュ（client_plan_key）
+            factory: 集計計画を作成する関数（引数なし）
+
+        Returns:
+            dict: 集計計画
+            bool: キャッシュにあった場合True
+        """
+        plan = self.load(key)
+        if plan is not None:
+            return plan, True
+        return self.store(key, factory()), False
+
+    def _keys_by_access(self):
+        """保存済みのキーを最終アクセス日時の新しい順に返す"""
+        if not os.path.isdir(self.cache_dir):
+            return []
+        paths = []
+        for name in os.listdir(self.cache_dir):
+            if name.startswith('.') or not name.endswith('.json'):
+                continue
+            try:
+                paths.append((os.path.getmtime(os.path.join(self.cache_dir, name)), name[:-len('.json')]))
+            except OSError:
+                continue
+        return [key for _, key in sorted(paths, reverse=True)]
+
+    def evict(self):
+        """保存数の上限を超えている場合、最終アクセス日時の古い集計計画から削除する"""
+        for key in self._keys_by_access()[self.max_entries:]:
+            try:
+                os.remove(self._path(key))
+                logging.info(f"Evicted client plan {key}")
+            except OSError:
+                continue
+
+    def __len__(self):
+        return len(self._keys_by_access())
+
+    def clear(self):
+        """キャッシュをすべて削除する（共有キャッシュの集計計画も削除する）"""
+        for key in self._keys_by_access():
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                continue
+        if self.memory_cache is not None:
+            self.memory_cache.clear(KIND_CLIENT_PLAN)
+
+    def _share(self, plan, key):
+        """集計計画を共有キャッシュに保存し、共有キャッシュにある値を返す"""
+        if self.memory_cache is None:
+            return plan
+        return self.memory_cache.put((KIND_CLIENT_PLAN, key), plan)
+
+
+_default_plan_cache = None
+
+
+def get_default_plan_cache():
+    """
+    既定の設定（環境変数 TRI_MERGER_PLAN_CACHE_DIR / TRI_MERGER_PLAN_CACHE_MAX_ENTRIES）のキャッシュを返す
+
+    プロセス内の共有キャッシュ（get_shared_cache）をメモリ上のキャッシュとして使う。
+
+    Returns:
+        ClientPlanCache: 既定のキャッシュ
+    """
+    global _default_plan_cache
+    if _default_plan_cache is None:
+        _default_plan_cache = ClientPlanCache(memory_cache=get_shared_cache())
+    return _default_plan_cache
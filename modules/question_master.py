@@ -1,17 +1,24 @@
 import pandas as pd
+import numpy as np
 import io
 import logging
+from modules.workbook_loader import load_survey_workbook
+from modules.filename_index import repair_filename
+from modules.pipeline_trace import PipelineTrace, KIND_FILE
 
 # ログ設定
 logging.basicConfig(level=logging.INFO)
 
-def create_question_master(uploaded_files):
+def create_question_master(uploaded_files, cache=None, trace=None):
     """
     アップロードされたExcelファイルから「質問対応表」を読み込み、
     質問マスターファイルを作成する。
     
     Args:
         uploaded_files: Streamlitのfile_uploaderから取得したファイルリスト
+        cache: 解析済みシートのキャッシュ（ParsedWorkbookCache、Noneの場合は使用しない）
+        trace: PipelineTrace を渡すと、ファイルごとの読み込みと質問マスターの作成の
+               処理時間（track_memory=True の場合はメモリも）を記録する
     
     Returns:
         pandas.DataFrame: 質問マスターデータフレーム
@@ -21,118 +28,178 @@ def create_question_master(uploaded_files):
         raise ValueError("ファイルがアップロードされていません。少なくとも1つのExcelファイルを選択してください。")
     
     logging.info(f"Received {len(uploaded_files)} files for processing")
-    master_list = []
-    
-    for uploaded_file in uploaded_files:
-        # ファイル名の文字化け対策
-        original_filename = uploaded_file.name
-        filename = original_filename
-        
-        # デバッグ用ログ
-        logging.info(f"Original filename: {repr(original_filename)}")
-        logging.info(f"Filename bytes: {original_filename.encode('utf-8', errors='replace')}")
-        
-        # 文字化けの検出と修正
-        try:
-            # 一般的な文字化けパターンをチェック
-            if any(ord(c) > 127 and ord(c) < 256 for c in filename):
-                # Latin-1でエンコードされた可能性がある場合
-                try:
-                    filename = filename.encode('latin-1').decode('utf-8')
-                except:
-                    pass
-            
-            # それでも文字化けしている場合は、安全なファイル名を生成
-            if '�' in filename or any(ord(c) > 0xFFFF for c in filename):
-                import hashlib
-                # ファイル名のハッシュ値を使用
-                file_hash = hashlib.md5(uploaded_file.name.encode('utf-8', errors='ignore')).hexdigest()[:8]
-                filename = f"file_{file_hash}.xlsx"
-                logging.warning(f"Filename contains invalid characters. Using safe name: {filename}")
-        except Exception:
-            # エラーが発生した場合は、安全なデフォルト名を使用
-            import time
-            filename = f"file_{int(time.time())}.xlsx"
-        
-        if filename.endswith('.xlsx') and not filename.startswith('~'):
-            try:
-                # ヘッダーなしで読み込み、手動で設定する
-                df_q = pd.read_excel(uploaded_file, sheet_name='質問対応表', header=None)
-                
-                # 3行目(index=2)をヘッダーとして設定
-                df_q.columns = df_q.iloc[2]
-                # 4行目(index=3)以降をデータとして使用
-                df_q = df_q.iloc[3:].reset_index(drop=True)
-
-                # 必要な列だけを抽出
-                df_q = df_q[['番号', '内容']]
-                # 質問文が書かれている行のみを抽出（'番号'列が'Q-'で始まる行）
-                df_q = df_q[df_q['番号'].astype(str).str.startswith('Q-')].copy()
-                
-                # ファイル名を保存（文字化け対策済み）
-                df_q['ファイル名'] = filename
-                # 元のファイル名も保存（表示用）
-                df_q['元ファイル名'] = original_filename
-                master_list.append(df_q)
-
-            except Exception as e:
-                raise Exception(f"Error processing {filename}: {e}")
-
-    if not master_list:
+    if trace is None:
+        trace = PipelineTrace()
+    file_questions = _read_file_questions(uploaded_files, cache, trace)
+    if not file_questions:
         raise ValueError("読み込むファイルが見つかりませんでした。")
 
-    master_df = pd.concat(master_list, ignore_index=True)
-    master_df.rename(columns={'番号': '質問番号', '内容': '質問文'}, inplace=True)
+    build_span = trace.begin('質問マスターの作成')
+    master_df = build_question_master(file_questions)
+    trace.end(build_span, rows=len(master_df), cols=len(master_df.columns))
+
+    return master_df
 
-    # 基準となるファイル（ファイル名でソートして最初のファイル）を特定
-    file_list = sorted(list(set([df['ファイル名'].iloc[0] for df in master_list])))
-    if not file_list:
-        raise ValueError("基準となるファイルが見つかりません。")
-    base_file = file_list[0]
-    
-    # 基準ファイルの質問順序を保持（重複を除外）
-    base_order_df = master_df[master_df['ファイル名'] == base_file][['質問文']].drop_duplicates().copy()
-    
-    # 質問文をキーにしてピボット処理
-    pivot_df = master_df.pivot_table(
-        index='質問文',
-        columns='ファイル名',
-        values='質問番号',
-        aggfunc='first'
-    ).reset_index()
 
-    # 基準ファイルの質問リストを取得
-    base_questions_list = base_order_df['質問文'].tolist()
+def update_question_master(existing_df, uploaded_files, cache=None, trace=None):
+    """
+    既存の質問マスターに、新しいファイルの質問対応表を追加する
 
-    # pivot_dfを基準ファイルの質問とそれ以外に分割
-    df_base = pivot_df[pivot_df['質問文'].isin(base_questions_list)].copy()
-    df_other = pivot_df[~pivot_df['質問文'].isin(base_questions_list)].copy()
+    過去のファイルは読み込まず、新しいファイルの質問行だけを処理する。
+    - 既存の行の順序・初出ファイルは変更しない
+    - 既存の質問文には、新しいファイルの質問番号を追加する
+    - 新しい質問文は既存の行の後に質問文の順で追加し、初出ファイルは
+      その質問文を含む新しいファイルのうち、ファイル名でソートして最初のファイルとする
+    - 新しいファイルの列は既存の列の後にファイル名の順で追加する
+    そのため、すべてのファイルから create_question_master で作り直した場合とは
+    行の順序・初出ファイルが異なることがある。
 
-    # 基準ファイルの質問をその順序通りにソート
-    df_base['質問文'] = pd.Categorical(df_base['質問文'], categories=base_questions_list, ordered=True)
-    df_base = df_base.sort_values('質問文')
+    Args:
+        existing_df: 既存の質問マスター（'質問文'列を含むデータフレーム）
+        uploaded_files: 追加するExcelファイル（または SurveyWorkbook）のリスト
+        cache: 解析済みシートのキャッシュ（ParsedWorkbookCache、Noneの場合は使用しない）
+        trace: PipelineTrace を渡すと、ファイルごとの読み込みと質問マスターの更新の処理時間を記録する
 
-    # その他の質問を質問文でソート
-    df_other = df_other.sort_values('質問文')
+    Returns:
+        pandas.DataFrame: 更新した質問マスター（既存のデータフレームは変更しない）
+    """
+    if not uploaded_files:
+        raise ValueError("ファイルがアップロードされていません。少なくとも1つのExcelファイルを選択してください。")
+    if '質問文' not in existing_df.columns:
+        raise ValueError("既存の質問マスターに '質問文' 列がありません。質問マスター作成機能で作成したファイルを選択してください。")
+
+    logging.info(f"Received {len(uploaded_files)} files to add to the question master")
+    if trace is None:
+        trace = PipelineTrace()
+    file_questions = _read_file_questions(uploaded_files, cache, trace)
+    if not file_questions:
+        raise ValueError("読み込むファイルが見つかりませんでした。")
 
-    # 2つのDataFrameを結合
-    final_df = pd.concat([df_base, df_other], ignore_index=True)
+    duplicated = sorted({filename for filename, _ in file_questions if filename in existing_df.columns})
+    if duplicated:
+        raise ValueError(f"既に質問マスターに含まれているファイルがあります: {', '.join(duplicated)}")
+
+    update_span = trace.begin('質問マスターの更新')
+    # 既存の質問文の行番号（同じ質問文が複数ある場合は最初の行）
+    positions = {}
+    for i, text in enumerate(existing_df['質問文'].tolist()):
+        positions.setdefault(text, i)
+
+    file_numbers = {}  # ファイル名 -> {質問文: 質問番号}
+    first_files = {}   # 新しい質問文 -> 初出ファイル
+    for filename, df_q in file_questions:
+        df_q = df_q[df_q['内容'].notna()]
+        numbers = file_numbers.setdefault(filename, {})
+        for number, text in zip(df_q['番号'].tolist(), df_q['内容'].tolist()):
+            numbers.setdefault(text, number)
+            if text not in positions:
+                first_file = first_files.get(text)
+                if first_file is None or filename < first_file:
+                    first_files[text] = filename
+
+    new_questions = sorted(first_files)
+    for i, text in enumerate(new_questions, start=len(existing_df)):
+        positions[text] = i
+    new_rows = {'質問文': new_questions}
+    if '初出ファイル' in existing_df.columns:
+        new_rows['初出ファイル'] = [first_files[text] for text in new_questions]
+    updated_df = pd.concat([existing_df, pd.DataFrame(new_rows)], ignore_index=True)
+
+    for filename in sorted(name for name, numbers in file_numbers.items() if numbers):
+        column = [np.nan] * len(updated_df)
+        for text, number in file_numbers[filename].items():
+            column[positions[text]] = number
+        updated_df[filename] = column
+    trace.end(update_span, rows=len(updated_df), cols=len(updated_df.columns))
+
+    logging.info(f"Added {len(file_numbers)} files and {len(new_questions)} new questions to the question master")
+    return updated_df
+
+
+def build_question_master(file_questions):
+    """
+    ファイルごとの質問行から質問マスターを作成する
 
-    # 各質問が最初に登場したファイルを取得
-    master_df_sorted = master_df.sort_values('ファイル名')
-    first_appearance = master_df_sorted.groupby('質問文')['ファイル名'].first().reset_index()
-    first_appearance.rename(columns={'ファイル名': '初出ファイル'}, inplace=True)
+    質問行を1回だけ走査して、質問文ごとの各ファイルの質問番号と初出ファイルを辞書に集め、
+    最後に一度だけデータフレームを作成する。
+    - 行の順序: 基準ファイル（ファイル名でソートして最初のファイル）の質問をその順序で並べ、
+      それ以外の質問を質問文の順に続ける
+    - 各ファイルの列: その質問文の最初の質問番号（同じ質問文が複数ある場合）
+    - 初出ファイル: その質問文を含むファイルのうち、ファイル名でソートして最初のファイル
+    - 質問文が空の行は使用しない
 
-    # 初出ファイル情報をマージ
-    final_df = pd.merge(final_df, first_appearance, on='質問文', how='left')
+    Args:
+        file_questions: (ファイル名, '番号'と'内容'の列を持つデータフレーム) のリスト（アップロード順）
+
+    Returns:
+        pandas.DataFrame: 質問文・初出ファイル・ファイル名ごとの質問番号の列を持つ質問マスター
+    """
+    filenames = sorted({filename for filename, df_q in file_questions if len(df_q)})
+    if not filenames:
+        raise ValueError("基準となるファイルが見つかりません。")
+    base_file = filenames[0]
+
+    file_numbers = {}  # ファイル名 -> {質問文: 質問番号}
+    first_files = {}   # 質問文 -> 初出ファイル
+    base_order = {}    # 基準ファイルの質問文（登場順、値は使用しない）
+    for filename, df_q in file_questions:
+        df_q = df_q[df_q['内容'].notna()]
+        numbers = file_numbers.setdefault(filename, {})
+        for number, text in zip(df_q['番号'].tolist(), df_q['内容'].tolist()):
+            numbers.setdefault(text, number)
+            first_file = first_files.get(text)
+            if first_file is None or filename < first_file:
+                first_files[text] = filename
+        if filename == base_file:
+            base_order.update(dict.fromkeys(df_q['内容'].tolist()))
+
+    questions = list(base_order) + sorted(text for text in first_files if text not in base_order)
+    positions = {text: i for i, text in enumerate(questions)}
+
+    data = {
+        '質問文': questions,
+        '初出ファイル': [first_files[text] for text in questions],
+    }
+    for filename in sorted(name for name, numbers in file_numbers.items() if numbers):
+        column = [np.nan] * len(questions)
+        for text, number in file_numbers[filename].items():
+            column[positions[text]] = number
+        data[filename] = column
+    return pd.DataFrame(data)
+
+
+def _read_file_questions(uploaded_files, cache, trace):
+    """
+    各ファイルの質問対応表から質問行を読み込む
+
+    Args:
+        uploaded_files: アップロードされたExcelファイル（または SurveyWorkbook）のリスト
+        cache: 解析済みシートのキャッシュ（Noneの場合は使用しない）
+        trace: 処理時間の記録先（PipelineTrace）
+
+    Returns:
+        list: (文字化け対策済みのファイル名, '番号'と'内容'の列を持つデータフレーム) のリスト
+    """
+    file_questions = []
+    for uploaded_file in uploaded_files:
+        # ファイル名の文字化け対策（データ集計でのファイル名の照合と共通）
+        filename = repair_filename(uploaded_file.name)
+        logging.info(f"Original filename: {repr(uploaded_file.name)}")
+
+        if filename.endswith('.xlsx') and not filename.startswith('~'):
+            file_size = getattr(uploaded_file, 'size', None)
+            with trace.span('質問対応表の読み込み', filename, KIND_FILE,
+                            bytes=file_size if isinstance(file_size, int) else None) as span:
+                try:
+                    # ファイルを一度だけ開き、質問対応表から質問行を抽出する
+                    # （3行目をヘッダー、4行目以降をデータとして扱う）
+                    df_q = load_survey_workbook(uploaded_file, cache).master_questions()
 
-    # 列の順序を調整（初出ファイルを質問文の隣に）
-    cols = final_df.columns.tolist()
-    cols.insert(1, cols.pop(cols.index('初出ファイル')))
-    final_df = final_df[cols]
+                    # ファイル名（文字化け対策済み）と一緒に保存
+                    file_questions.append((filename, df_q))
+                    span.update(rows=len(df_q))
 
-    # すべてのファイルで質問番号が存在しない行（完全に空の行）を削除
-    file_columns = [f for f in final_df.columns if f not in ['質問文', '初出ファイル']]
-    cleaned_df = final_df.dropna(subset=file_columns, how='all')
+                except Exception as e:
+                    raise Exception(f"Error processing {filename}: {e}")
 
-    return cleaned_df
\ No newline at end of file
+    return file_questions
@@ -0,0 +1,95 @@
+import pandas as pd
+import numpy as np
+import logging
+from pandas.api.types import is_datetime64_any_dtype
+from pandas.tseries.api import guess_datetime_format
+
+# ログ設定
+logging.basicConfig(level=logging.INFO)
+
+
+def parse_response_times(values):
+    """
+    1ファイル分の回答日時を日時型に変換する
+
+    既に日時型の場合はそのまま返す。文字列の場合は最初の文字列から書式を推定し、
+    明示的な書式と cache=True で変換する（同じ値が多い場合は一度だけ解析される）。
+    推定した書式に合わない値だけを個別に解析し直し、それでも変換できない値は NaT にする。
+
+    Args:
+        values: 回答日時の列（pandas.Series）
+
+    Returns:
+        pandas.Series: 日時型の回答日時（インデックスは values と同じ）
+    """
+    if is_datetime64_any_dtype(values.dtype):
+        return values
+
+    first_text = next((value for value in values if isinstance(value, str)), None)
+    date_format = guess_datetime_format(first_text) if first_text is not None else None
+    if date_format is None:
+        return pd.to_datetime(values, errors='coerce', cache=True)
+
+    parsed = pd.to_datetime(values, format=date_format, errors='coerce', cache=True)
+    failed = parsed.isna()
+    if failed.any():
+        retry = failed & values.notna()
+        if retry.any():
+            parsed[retry] = pd.to_datetime(values[retry], format='mixed', errors='coerce', cache=True)
+    return parsed
+
+
+def sorted_run_positions(dates):
+    """
+    1ファイル分の回答日時から、日時が有効な行の位置を回答日時順（同じ日時は元の順）に返す
+
+    Args:
+        dates: 日時型の回答日時（pandas.Series）
+
+    Returns:
+        numpy.ndarray: 行位置（0始まり）の配列
+    """
+    valid = np.flatnonzero(dates.notna().to_numpy())
+    values = dates.to_numpy()[valid]
+    return valid[np.argsort(values, kind='stable')]
+
+
+def order_by_response_time(frames):
+    """
+    ファイルごとのデータを連結した場合の、回答日時順の行の並びを求める
+
+    ファイルごとに回答日時を変換して並べ替え（並べ替え済みの区間）、
+    それらを安定ソートで併合する。並べ替え済みの区間の連結は timsort で
+    区間同士の併合として処理されるため、全体を一から並べ替えるより速い。
+    回答日時が同じ行はファイルの順序・ファイル内の行の順序を保ち、
+    回答日時がない（変換できない）行は除外する。
+
+    Args:
+        frames: ファイルごとのデータフレームのリスト（連結する順）
+
+    Returns:
+        pandas.Series: 変換済みの回答日時（連結した位置をインデックスとする、全行分）
+        numpy.ndarray: 回答日時順に並べた、有効な行の連結した位置
+    """
+    all_dates = []
+    run_dates = []
+    run_positions = []
+    start = 0
+    for df in frames:
+        if '回答日時' in df.columns:
+            dates = parse_response_times(df['回答日時']).reset_index(drop=True)
+        else:
+            # 回答日時の列がないファイルの行は、全体を連結した場合と同様に NaT として除外する
+            dates = pd.Series(pd.NaT, index=pd.RangeIndex(len(df)), dtype='datetime64[ns]')
+        positions = sorted_run_positions(dates)
+        all_dates.append(dates)
+        run_dates.append(dates.to_numpy()[positions])
+        run_positions.append(positions + start)
+        start += len(df)
+
+    if not all_dates:
+        return pd.Series([], dtype='datetime64[ns]'), np.array([], dtype=np.int64)
+
+    all_dates = pd.concat(all_dates, ignore_index=True)
+    merge_order = np.argsort(np.concatenate(run_dates), kind='stable')
+    return all_dates, np.concatenate(run_positions).astype(np.int64)[merge_order]
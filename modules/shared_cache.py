@@ -0,0 +1,278 @@
+import pandas as pd
+import logging
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from modules.column_blocks import ColumnBlockStore
+
+# ログ設定
+logging.basicConfig(level=logging.INFO)
+
+# 共有キャッシュの容量上限（bytes、環境変数で変更可能）
+DEFAULT_SHARED_CACHE_MAX_BYTES = int(os.environ.get('TRI_MERGER_SHARED_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+
+# キャッシュする値の種類（キーの1つ目の要素）
+KIND_WORKBOOK = 'workbook'
+KIND_AGGREGATION = 'aggregation'
+KIND_CLIENT_PLAN = 'client_plan'
+KIND_LABELS = {KIND_WORKBOOK: '解析済みファイル', KIND_AGGREGATION: '集計結果', KIND_CLIENT_PLAN: '集計計画'}
+
+
+def estimate_bytes(value, seen=None):
+    """
+    キャッシュする値のメモリ使用量（bytes）を見積もる
+
+    データフレーム・ColumnBlockStore は文字列の中身も含めた使用量、
+    辞書・リスト・タプルは要素の合計とする。
+    同じデータフレームを複数の要素から参照している場合は、1回だけ数える。
+
+    Args:
+        value: キャッシュする値
+        seen: 見積もり済みのデータフレーム等の id() の集合（要素の見積もりで共有する）
+
+    Returns:
+        int: メモリ使用量の見積もり（bytes）
+    """
+    if seen is None:
+        seen = set()
+    if isinstance(value, (pd.DataFrame, pd.Series, ColumnBlockStore)):
+        if id(value) in seen:
+            return 0
+        seen.add(id(value))
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(index=True, deep=True))
+    if isinstance(value, ColumnBlockStore):
+        return value.memory_usage()
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(
+            estimate_bytes(k, seen) + estimate_bytes(v, seen) for k, v in value.items()
+        )
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(estimate_bytes(v, seen) for v in value)
+    return sys.getsizeof(value)
+
+
+class SharedMemoryCache:
+    """
+    プロセス内のすべてのセッションで共有する、メモリ上のキャッシュ
+
+    Streamlitのセッションは同じプロセスのスレッドで実行されるため、解析済みのシートや
+    集計結果をここに保存すると、同じファイルを扱う他のセッションが同じオブジェクトを参照できる。
+    キーはファイル内容のハッシュなどを含むタプル（例: ('workbook', SHA-256)）とする。
+
+    キャッシュした値は複数のセッションから参照されるため、読み取り専用として扱い、変更しないこと。
+    容量上限を超えた場合は、最後に参照された日時が古いものから削除する（LRU）。
+    削除しても、値を参照しているセッションがある間はそのセッションのメモリに残る。
+    """
+
+    def __init__(self, max_bytes=DEFAULT_SHARED_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # キー -> {'value', 'bytes', 'accessed'}（古い順）
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self._key_locks = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    @property
+    def total_bytes(self):
+        """キャッシュしている値のメモリ使用量の合計（bytes）"""
+        return self._total_bytes
+
+    def _lookup(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            entry['accessed'] = time.time()
+            return entry['value']
+
+    def get(self, key):
+        """
+        キャッシュから値を取得する
+
+        Args:
+            key: キー
+
+        Returns:
+            object: キャッシュした値（存在しない場合は None）
+        """
+        value = self._lookup(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def peek(self, key):
+        """
+        キャッシュから値を取得する（再利用の回数・最終アクセス日時を更新しない）
+
+        Args:
+            key: キー
+
+        Returns:
+            object: キャッシュした値（存在しない場合は None）
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            return None if entry is None else entry['value']
+
+    def put(self, key, value, nbytes=None):
+        """
+        値をキャッシュに保存する
+
+        同じキーの値が既にある場合はそれを残し、既存の値を返す（セッション間で同じオブジェクトを共有するため）。
+        容量上限より大きい値は保存しない。
+
+        Args:
+            key: キー
+            value: 保存する値
+            nbytes: 値のメモリ使用量（bytes、Noneの場合は estimate_bytes で見積もる）
+
+        Returns:
+            object: キャッシュにある値（保存しなかった場合は value）
+        """
+        if nbytes is None:
+            nbytes = estimate_bytes(value)
+        if nbytes > self.max_bytes:
+            logging.info(f"Shared cache entry {key[:1]} ({nbytes} bytes) exceeds the budget; not cached")
+            return value
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry['value']
+            self._entries[key] = {'value': value, 'bytes': nbytes, 'accessed': time.time()}
+            self._total_bytes += nbytes
+            self._evict_locked()
+        return value
+
+    def replace(self, key, value, nbytes=None):
+        """
+        値をキャッシュに保存する（同じキーの値が既にある場合は置き換える）
+
+        既存の値に要素を追加した値（解析済みのシートを追加したエントリなど）を保存する場合に使う。
+        置き換え前の値を参照しているセッションは、そのまま置き換え前の値を使い続ける。
+
+        Args:
+            key: キー
+            value: 保存する値
+            nbytes: 値のメモリ使用量（bytes、Noneの場合は estimate_bytes で見積もる）
+
+        Returns:
+            object: value
+        """
+        if nbytes is None:
+            nbytes = estimate_bytes(value)
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._total_bytes -= entry['bytes']
+            if nbytes > self.max_bytes:
+                logging.info(f"Shared cache entry {key[:1]} ({nbytes} bytes) exceeds the budget; not cached")
+                return value
+            self._entries[key] = {'value': value, 'bytes': nbytes, 'accessed': time.time()}
+            self._total_bytes += nbytes
+            self._evict_locked()
+        return value
+
+    def get_or_create(self, key, factory, nbytes=None):
+        """
+        キャッシュから値を取得し、ない場合は factory で作成して保存する
+
+        同じキーの値を複数のセッションが同時に要求した場合は、1つのセッションだけが作成し、
+        他のセッションはその完了を待って同じ値を使う。
+
+        Args:
+            key: キー
+            factory: 値を作成する関数（引数なし）
+            nbytes: 値のメモリ使用量（bytes、Noneの場合は estimate_bytes で見積もる）
+
+        Returns:
+            object: キャッシュにある値、または作成した値
+            bool: キャッシュにあった場合True
+        """
+        value = self.get(key)
+        if value is not None:
+            return value, True
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            # 待っている間に他のセッションが作成した場合
+            value = self._lookup(key)
+            if value is not None:
+                return value, True
+            try:
+                value = factory()
+                return self.put(key, value, nbytes), False
+            finally:
+                with self._lock:
+                    self._key_locks.pop(key, None)
+
+    def _evict_locked(self):
+        """容量上限を超えている間、最後に参照された日時の古い値から削除する（ロック取得済みで呼ぶ）"""
+        while self._total_bytes > self.max_bytes and self._entries:
+            key, entry = self._entries.popitem(last=False)
+            self._total_bytes -= entry['bytes']
+            logging.info(f"Evicted shared cache entry {key[:1]} ({entry['bytes']} bytes)")
+
+    def entries(self):
+        """
+        キャッシュのエントリ一覧を返す
+
+        Returns:
+            pandas.DataFrame: 種類、キー、サイズ（bytes）、最終アクセス日時の一覧（最終アクセス日時の新しい順）
+        """
+        with self._lock:
+            rows = [
+                {
+                    '種類': KIND_LABELS.get(key[0], key[0]),
+                    'キー': str(key[1])[:16] if len(key) > 1 else '',
+                    'サイズ(bytes)': entry['bytes'],
+                    '最終アクセス': pd.Timestamp(entry['accessed'], unit='s'),
+                }
+                for key, entry in reversed(self._entries.items())
+            ]
+        return pd.DataFrame(rows, columns=['種類', 'キー', 'サイズ(bytes)', '最終アクセス'])
+
+    def clear(self, kind=None):
+        """
+        キャッシュを削除する
+
+        Args:
+            kind: 削除する値の種類（キーの1つ目の要素、Noneの場合はすべて削除する）
+        """
+        with self._lock:
+            for key in [key for key in self._entries if kind is None or key[0] == kind]:
+                self._total_bytes -= self._entries.pop(key)['bytes']
+
+
+_shared_cache = None
+_shared_cache_lock = threading.Lock()
+
+
+def get_shared_cache():
+    """
+    プロセス内で共有するキャッシュ（容量上限は環境変数 TRI_MERGER_SHARED_CACHE_MAX_BYTES）を返す
+
+    Returns:
+        SharedMemoryCache: 共有キャッシュ
+    """
+    global _shared_cache
+    with _shared_cache_lock:
+        if _shared_cache is None:
+            _shared_cache = SharedMemoryCache()
+        return _shared_cache
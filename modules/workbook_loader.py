@@ -0,0 +1,263 @@
+import pandas as pd
+import io
+import logging
+import os
+
+# ログ設定
+logging.basicConfig(level=logging.INFO)
+
+DATA_SHEET = 'data'
+QUESTION_SHEET = '質問対応表'
+
+
+class SurveyWorkbook:
+    """
+    アンケートExcelファイルを一度だけ開き、必要なシートをまとめて提供するクラス
+
+    pd.ExcelFile でファイルを一度だけ開き、dataシート・質問対応表シート・
+    シート一覧を同じハンドルから読み込む。各シートは初回アクセス時に一度だけ
+    解析され、以降はキャッシュされた結果を返す。
+
+    Attributes:
+        name: ファイル名（アップロード時の名前）
+        size: ファイルサイズ（bytes、不明な場合は 'unknown'）
+    """
+
+    def __init__(self, uploaded_file):
+        self.source = uploaded_file
+        self.name = getattr(uploaded_file, 'name', '')
+        self.size = getattr(uploaded_file, 'size', 'unknown')
+        self._excel_file = None
+        self._sheet_names = None
+        self._sheets = {}
+        self._cache = None
+        self._cache_key = None
+
+    @property
+    def excel_file(self):
+        """開いた pd.ExcelFile（初回アクセス時に一度だけ開く）"""
+        if self._excel_file is None:
+            self._excel_file = pd.ExcelFile(self.source)
+        return self._excel_file
+
+    @property
+    def sheet_names(self):
+        """ブック内のシート名のリスト"""
+        if self._sheet_names is None:
+            self._sheet_names = self.excel_file.sheet_names
+        return self._sheet_names
+
+    def read_bytes(self):
+        """元ファイルの内容をバイト列として返す（ワーカープロセスへの受け渡し用）"""
+        if hasattr(self.source, 'getvalue'):
+            return self.source.getvalue()
+        self.source.seek(0)
+        content = self.source.read()
+        self.source.seek(0)
+        return content
+
+    def has_sheet(self, sheet_name):
+        """指定したシートが存在するかを返す"""
+        return sheet_name in self.sheet_names
+
+    def _parse(self, sheet_name, **kwargs):
+        """シートを一度だけ解析して保持する（use_cache の後は解析済みシートのキャッシュにも保存する）"""
+        if sheet_name not in self._sheets:
+            self._sheets[sheet_name] = self.excel_file.parse(sheet_name, **kwargs)
+            if self._cache is not None:
+                self._cache.store(self._cache_key, self.sheet_names, {sheet_name: self._sheets[sheet_name]})
+        return self._sheets[sheet_name]
+
+    @property
+    def data(self):
+        """dataシートのデータフレーム"""
+        return self._parse(DATA_SHEET)
+
+    @property
+    def is_data_parsed(self):
+        """dataシートを解析済み（キャッシュからの読み込みを含む）かを返す"""
+        return DATA_SHEET in self._sheets
+
+    @property
+    def data_columns(self):
+        """dataシートの列名のリスト（未解析の場合はヘッダー行のみを読み込む）"""
+        if DATA_SHEET in self._sheets:
+            return list(self._sheets[DATA_SHEET].columns)
+        return list(self.excel_file.parse(DATA_SHEET, nrows=0).columns)
+
+    def read_data(self, usecols=None):
+        """
+        dataシートを読み込む
+
+        Args:
+            usecols: 読み込む列の位置のリスト（Noneの場合はすべての列）
+
+        Returns:
+            pandas.DataFrame: dataシートのデータフレーム
+        """
+        if usecols is None:
+            return self.data
+        if DATA_SHEET in self._sheets:
+            return self._sheets[DATA_SHEET].iloc[:, usecols]
+        # 指定した列だけを読み込む（列を絞った結果はキャッシュしない）
+        return self.excel_file.parse(DATA_SHEET, usecols=usecols)
+
+    @property
+    def question_sheet(self):
+        """
+        質問対応表シートをヘッダーなしで読み込んだ生のデータフレーム
+
+        シートが存在しない場合は None を返す。
+        """
+        if not self.has_sheet(QUESTION_SHEET):
+            return None
+        return self._parse(QUESTION_SHEET, header=None)
+
+    def question_mapping(self):
+        """
+        質問対応表シートから質問とその選択肢を抽出する
+
+        Returns:
+            list: 質問対応表と同じ形式の辞書のリスト
+                  [{'番号': 'Q-001', '条件': '必須回答', '内容': '質問文', '区分': 'S/A'},
+                   {'番号': '1', '条件': '', '内容': '選択肢1', '区分': ''}, ...]
+        """
+        raw_df = self.question_sheet
+        if raw_df is None:
+            return []
+
+        # 2行目(index=1)をヘッダーとして扱い、3行目以降をデータとする
+        question_df = raw_df.iloc[2:]
+
+        mapping_data = []
+        for row in question_df.itertuples(index=False):
+            # 空行をスキップ
+            if pd.isna(row[0]) and pd.isna(row[2]):
+                continue
+
+            # 4列の構造に変換
+            mapping_data.append({
+                '番号': str(row[0]) if pd.notna(row[0]) else '',
+                '条件': str(row[1]) if pd.notna(row[1]) else '',
+                '内容': str(row[2]) if pd.notna(row[2]) else '',
+                '区分': str(row[3]) if pd.notna(row[3]) else ''
+            })
+
+        return mapping_data
+
+    def master_questions(self):
+        """
+        質問マスター作成用に、質問対応表から質問行（番号と内容）を抽出する
+
+        Returns:
+            pandas.DataFrame: '番号'（Q-で始まる）と '内容' の2列のデータフレーム
+        """
+        df_q = self.question_sheet
+        if df_q is None:
+            raise ValueError(f"Worksheet named '{QUESTION_SHEET}' not found")
+
+        # 3行目(index=2)をヘッダーとして設定
+        df_q = df_q.iloc[3:].set_axis(df_q.iloc[2], axis=1).reset_index(drop=True)
+
+        # 必要な列だけを抽出
+        df_q = df_q[['番号', '内容']]
+        # 質問文が書かれている行のみを抽出（'番号'列が'Q-'で始まる行）
+        return df_q[df_q['番号'].astype(str).str.startswith('Q-')].copy()
+
+    def use_cache(self, cache):
+        """
+        解析済みシートのキャッシュを利用する
+
+        キャッシュに同じ内容のファイルがあれば解析済みのシートを読み込む。
+        ここではシートを解析せず、以降に実際に解析したシート（質問マスター作成時の質問対応表、
+        集計時のdataシート）をその時点でキャッシュに保存する。
+        列を絞って読み込んだdataシート（read_data の usecols 指定）は保存しない。
+
+        Args:
+            cache: ParsedWorkbookCache
+
+        Returns:
+            bool: キャッシュから読み込めた場合True
+        """
+        # 質問マスター作成時に計算したキー（SessionSurveyFile）があれば、ファイル内容のハッシュを計算し直さない
+        self._cache_key = getattr(self.source, 'cache_key', None) or cache.key_for(self.read_bytes())
+        self._cache = cache
+        cached = cache.load(self._cache_key)
+        if cached is None:
+            return False
+        self._sheet_names = cached['sheet_names']
+        self._sheets.update(cached['sheets'])
+        return True
+
+    def close(self):
+        """開いているExcelファイルを閉じる（解析済みのシートは保持する）"""
+        if self._excel_file is not None:
+            self._excel_file.close()
+            self._excel_file = None
+
+
+class LocalSurveyFile(io.BytesIO):
+    """
+    ディスク上のExcelファイルを、Streamlitのアップロードファイルと同じように扱うためのクラス
+
+    ファイル内容をメモリに読み込み、name（ファイル名のみ）と size を持たせる。
+    コマンドラインからの一括処理で aggregate_data / create_question_master に渡すために使用する。
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            super().__init__(f.read())
+        self.path = path
+        self.name = os.path.basename(path)
+        self.size = os.path.getsize(path)
+
+
+class SessionSurveyFile(io.BytesIO):
+    """
+    質問マスター作成で読み込んだファイルを、データ集計ページに引き継ぐためのクラス
+
+    SurveyWorkbook は開いたExcelファイルと解析済みのシートを保持するため、セッション状態には
+    ファイル内容・name・size と解析済みシートのキャッシュキーだけを持つこのクラスを保存する。
+    データ集計ページではアップロードファイルと同じように load_survey_workbook に渡す。
+    """
+
+    def __init__(self, content, name, size, cache_key=None):
+        super().__init__(content)
+        self.name = name
+        self.size = size
+        self.cache_key = cache_key
+
+    @classmethod
+    def from_workbook(cls, workbook):
+        """
+        SurveyWorkbook から作成する（開いているExcelファイルは閉じる）
+
+        Args:
+            workbook: SurveyWorkbook
+
+        Returns:
+            SessionSurveyFile: ファイル内容とキャッシュキーだけを持つファイル
+        """
+        workbook.close()
+        return cls(workbook.read_bytes(), workbook.name, workbook.size, workbook._cache_key)
+
+
+def load_survey_workbook(uploaded_file, cache=None):
+    """
+    アップロードされたファイルを SurveyWorkbook として読み込む
+
+    既に SurveyWorkbook の場合はそのまま返す（解析済みのシートを再利用するため）。
+
+    Args:
+        uploaded_file: アップロードされたExcelファイル、または SurveyWorkbook
+        cache: 解析済みシートのキャッシュ（ParsedWorkbookCache、Noneの場合は使用しない）
+
+    Returns:
+        SurveyWorkbook: ファイルを一度だけ開くワークブックローダー
+    """
+    if isinstance(uploaded_file, SurveyWorkbook):
+        return uploaded_file
+    workbook = SurveyWorkbook(uploaded_file)
+    if cache is not None:
+        workbook.use_cache(cache)
+    return workbook
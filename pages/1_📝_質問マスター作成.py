@@ -2,7 +2,10 @@ import streamlit as st
 import pandas as pd
 import io
 from modules.auth import check_password  # 一時的にコメントアウト
-from modules.question_master import create_question_master
+from modules.question_master import create_question_master, update_question_master
+from modules.parse_cache import get_default_cache
+from modules.workbook_loader import load_survey_workbook, SessionSurveyFile
+from modules.memory_monitor import check_memory_budget, QUESTION_MASTER_MEMORY_FACTOR
 
 # 認証チェック（一時的にコメントアウト - ファイルアップロード問題の調査のため）
 if not check_password():
@@ -28,8 +31,39 @@ st.markdown("""
 各ファイルの質問番号を対応付けるマスターファイルです。
 """)
 
+# 作成方法の選択
+mode = st.radio(
+    "作成方法",
+    ["新しく作成", "既存の質問マスターにファイルを追加"],
+    horizontal=True,
+    help="「既存の質問マスターにファイルを追加」では、過去のファイルを読み込まずに新しいファイルの質問だけを追加します。既存の行の順序と初出ファイルは変わりません。"
+)
+add_mode = mode == "既存の質問マスターにファイルを追加"
+
+existing_master_df = None
+if add_mode:
+    st.markdown("### 既存の質問マスター")
+    use_session_master = False
+    if 'question_master' in st.session_state:
+        use_session_master = st.checkbox(
+            "このセッションで作成した質問マスターに追加",
+            value=True,
+            help="チェックを外すと、ダウンロード済みの質問マスターファイルを選択できます"
+        )
+    if use_session_master:
+        existing_master_df = st.session_state.question_master
+    else:
+        existing_master_file = st.file_uploader(
+            "質問マスターを選択",
+            type=['xlsx'],
+            key="existing_question_master",
+            help="質問マスター作成機能で作成したファイルを選択してください"
+        )
+        if existing_master_file:
+            existing_master_df = pd.read_excel(existing_master_file)
+
 # ファイルアップロード
-st.markdown("### アンケートファイルをアップロード")
+st.markdown("### 追加するアンケートファイルをアップロード" if add_mode else "### アンケートファイルをアップロード")
 st.info("📌 ファイルサイズ制限: 各ファイル50MB以内")
 
 # デバッグ情報の表示（Squadbase環境での問題調査用）
@@ -52,9 +86,26 @@ if uploaded_files:
     with st.expander("アップロードファイル詳細"):
         for i, file in enumerate(uploaded_files):
             st.text(f"{i+1}. {file.name} - {file.size:,} bytes")
+    # メモリ使用量の見積もり（作成の実行前に警告する、ファイルサイズが変わった場合だけ確認する）
+    memory_inputs = tuple(file.size for file in uploaded_files)
+    memory_check = st.session_state.get('question_master_memory_check', (None, None))
+    if memory_check[0] != memory_inputs:
+        memory_check = (memory_inputs, check_memory_budget(list(memory_inputs), factor=QUESTION_MASTER_MEMORY_FACTOR))
+        st.session_state.question_master_memory_check = memory_check
+    memory_warning = memory_check[1]
+    if memory_warning:
+        st.warning(f"⚠️ {memory_warning}")
+
+use_cache = st.checkbox(
+    "解析済みファイルのキャッシュを使用",
+    value=True,
+    help="同じ内容のファイルを再度アップロードした場合、前回の解析結果を再利用します（データ集計ページと共通）"
+)
 
 # 作成ボタン
-if st.button("📋 質問マスターを作成", type="primary", disabled=not uploaded_files):
+button_label = "➕ 質問マスターに追加" if add_mode else "📋 質問マスターを作成"
+button_disabled = not uploaded_files or (add_mode and existing_master_df is None)
+if st.button(button_label, type="primary", disabled=button_disabled):
     try:
         # デバッグ情報を表示
         st.info(f"📂 {len(uploaded_files)}個のファイルを処理中...")
@@ -62,13 +113,33 @@ if st.button("📋 質問マスターを作成", type="primary", disabled=not up
             st.text(f"  - ファイル{i+1}: {file.name} ({file.size:,} bytes)")
         
         with st.spinner("質問マスターを作成中..."):
-            # 質問マスター作成
-            master_df = create_question_master(uploaded_files)
+            # 各ファイルを一度だけ開き、解析したシートはデータ集計ページでも再利用する
+            cache = get_default_cache() if use_cache else None
+            workbooks = [load_survey_workbook(file, cache) for file in uploaded_files]
+
+            if add_mode:
+                # 新しいファイルの質問だけを既存の質問マスターに追加
+                master_df = update_question_master(existing_master_df, workbooks, cache=cache)
+            else:
+                # 質問マスター作成
+                master_df = create_question_master(workbooks, cache=cache)
+
+            # Excelファイルを閉じ、データ集計ページにはファイル内容とキャッシュキーだけを引き継ぐ
+            # （解析済みのシートはセッション状態に保持しない）
+            survey_files = [SessionSurveyFile.from_workbook(workbook) for workbook in workbooks]
+            if add_mode and use_session_master:
+                # このセッションで読み込んだファイルに追加する（同じ名前のファイルは新しいものに置き換える）
+                added_names = {file.name for file in survey_files}
+                survey_files = [
+                    file for file in st.session_state.get('survey_workbooks', [])
+                    if file.name not in added_names
+                ] + survey_files
             
             # セッション状態に保存
             st.session_state.question_master = master_df
+            st.session_state.survey_workbooks = survey_files
             
-        st.success("✅ 質問マスターの作成が完了しました！")
+        st.success("✅ 質問マスターへのファイルの追加が完了しました！" if add_mode else "✅ 質問マスターの作成が完了しました！")
         
     except ValueError as e:
         st.error(f"⚠️ 入力エラー: {str(e)}")
@@ -137,6 +208,14 @@ with st.expander("ℹ️ 使い方"):
     3. **確認**: 作成された質問マスターをプレビューで確認
     4. **ダウンロード**: 質問マスターファイルをダウンロード
     
+    ### ファイルの追加
+    新しいアンケートファイルが届いた場合は「既存の質問マスターにファイルを追加」を選び、
+    作成済みの質問マスター（このセッションで作成したもの、またはダウンロードしたファイル）に
+    新しいファイルだけを追加できます。既存の行の順序と初出ファイルは変わらず、
+    新しい質問は最後に追加されます。
+    
+    作成・追加に使ったアンケートファイルは、データ集計ページでそのまま利用できます（再アップロードは不要です）。
+    
     ### 注意事項
     - アップロードするファイルには「質問対応表」シートが必要です
     - 質問対応表の3行目がヘッダー、4行目以降がデータとして処理されます
@@ -1,8 +1,24 @@
 import streamlit as st
 import pandas as pd
-import io
+import os
+import uuid
 from modules.auth import check_password  # 一時的にコメントアウト
-from modules.aggregation import aggregate_data
+from modules.aggregation import aggregate_data, summarize_client_plan, PARALLEL_MIN_FILES, PROGRESS_WEIGHTS
+from modules.background_job import BackgroundJob, STATUS_DONE, STATUS_CANCELLED
+from modules.parse_cache import get_default_cache
+from modules.shared_cache import get_shared_cache
+from modules.plan_cache import get_default_plan_cache, plan_to_json
+from modules.filename_index import (
+    get_filename_index, format_ambiguous_matches, MATCH_EXACT, MATCH_AMBIGUOUS, MATCH_MISSING, MATCH_LABELS
+)
+from modules.export import (
+    write_merged_workbook, remove_temp_export, build_client_workbook, build_client_workbook_template,
+    personalize_client_workbook
+)
+from modules.pipeline_trace import (
+    PipelineTrace, total_seconds, KIND_STAGE, KIND_FILE, KIND_CLIENT, MEMORY_RSS, MEMORY_TRACEMALLOC
+)
+from modules.memory_monitor import check_memory_budget, DEFAULT_MEMORY_BUDGET_BYTES, AGGREGATION_MEMORY_FACTOR
 
 # 認証チェック（一時的にコメントアウト - ファイルアップロード問題の調査のため）
 if not check_password():
@@ -27,29 +43,76 @@ if 'aggregation_results' not in st.session_state:
     st.session_state.aggregation_results = None
 if 'logs' not in st.session_state:
     st.session_state.logs = []
+if 'aggregation_run_id' not in st.session_state:
+    st.session_state.aggregation_run_id = None
+if 'export_cache' not in st.session_state:
+    st.session_state.export_cache = {}
+if 'memory_report' not in st.session_state:
+    st.session_state.memory_report = []
+if 'client_plan' not in st.session_state:
+    st.session_state.client_plan = []
+if 'pipeline_trace' not in st.session_state:
+    st.session_state.pipeline_trace = None
+if 'aggregation_job' not in st.session_state:
+    st.session_state.aggregation_job = None
+if 'memory_check' not in st.session_state:
+    st.session_state.memory_check = (None, None)  # (ファイルサイズと上限, 警告メッセージ)
+
+
+def clear_export_cache():
+    """作成済みのExcelファイルのキャッシュを削除する（中間データの一時ファイルも削除する）"""
+    export_cache = st.session_state.export_cache
+    for key, value in export_cache.items():
+        if key != 'run_id' and isinstance(value, str):
+            remove_temp_export(value)
+    export_cache.clear()
+
 
 # ファイルアップロードセクション
 col1, col2, col3 = st.columns(3)
 
 with col1:
     st.markdown("### 1. アンケートデータファイル")
-    st.info("📌 ファイルサイズ制限: 各ファイル50MB以内")
-    data_files = st.file_uploader(
-        "Excelファイルを選択",
-        type=['xlsx'],
-        accept_multiple_files=True,
-        key="data_files",
-        help="dataシートを含むアンケートファイルを複数選択できます"
-    )
+    data_files = None
+    session_workbooks = st.session_state.get('survey_workbooks')
+    if session_workbooks and st.checkbox(
+        f"質問マスター作成で読み込んだファイルを使用（{len(session_workbooks)}個）",
+        value=True,
+        help="質問マスター作成ページでアップロードしたファイルをそのまま使います（再アップロードは不要です。解析済みのシートはキャッシュから再利用します）"
+    ):
+        data_files = session_workbooks
+        for file in session_workbooks:
+            st.caption(f"・{file.name}")
+    else:
+        st.info("📌 ファイルサイズ制限: 各ファイル50MB以内")
+        data_files = st.file_uploader(
+            "Excelファイルを選択",
+            type=['xlsx'],
+            accept_multiple_files=True,
+            key="data_files",
+            help="dataシートを含むアンケートファイルを複数選択できます"
+        )
 
 with col2:
     st.markdown("### 2. 質問マスターファイル")
-    question_master_file = st.file_uploader(
-        "質問マスターを選択",
-        type=['xlsx'],
-        key="question_master",
-        help="質問マスター作成機能で生成したファイルを選択"
+    question_master_file = None
+    session_master_df = st.session_state.get('question_master')
+    use_session_master = isinstance(session_master_df, pd.DataFrame) and st.checkbox(
+        "質問マスター作成で作成した質問マスターを使用",
+        value=True,
+        help="質問マスター作成ページで作成した質問マスターをそのまま使います（ダウンロード・再アップロードは不要です）"
     )
+    if use_session_master:
+        file_count = len([col for col in session_master_df.columns if col not in ['質問文', '初出ファイル']])
+        st.caption(f"質問数: {len(session_master_df)}、ファイル数: {file_count}")
+    else:
+        question_master_file = st.file_uploader(
+            "質問マスターを選択",
+            type=['xlsx'],
+            key="question_master_file",
+            help="質問マスター作成機能で生成したファイルを選択"
+        )
+    has_question_master = use_session_master or question_master_file is not None
 
 with col3:
     st.markdown("### 3. クライアント設定ファイル")
@@ -60,16 +123,212 @@ with col3:
         help="クライアント別の集計設定ファイルを選択"
     )
 
-# 集計実行ボタン
-if st.button("🚀 集計を実行", type="primary", disabled=not (data_files and question_master_file and client_settings_file)):
+# 詳細設定
+with st.expander("⚙️ 詳細設定"):
+    max_workers = st.number_input(
+        "ファイル読み込みの並列数",
+        min_value=1,
+        max_value=os.cpu_count() or 1,
+        value=os.cpu_count() or 1,
+        help=f"複数のアンケートファイルを並列に読み込みます。ファイル数が{PARALLEL_MIN_FILES}未満の場合や1を指定した場合は逐次処理します。"
+    )
+    column_projection = st.checkbox(
+        "集計に必要な列のみ読み込む",
+        value=False,
+        help="固定質問といずれかのクライアントが集計する質問の列（FA列を含む）と NO・回答日時 だけを読み込みます。中間データもこれらの列のみになります。"
+    )
+    column_blocks = st.checkbox(
+        "ファイルごとの列ブロックのまま保持する",
+        value=False,
+        help="全ファイルを横に連結せず、ファイルごとの列のまま保持します。ファイルごとに質問が大きく異なる場合にメモリ使用量を削減できます。集計結果は変わりません。"
+    )
+    optimize_memory = st.checkbox(
+        "列の型を最適化してメモリ使用量を削減",
+        value=True,
+        help="選択肢の列を小さい整数型・カテゴリ型に、自由回答の列をArrow形式の文字列型に変換します。出力されるExcelの内容は変わりません。"
+    )
+    memory_modes = {
+        "計測しない": False,
+        "RSS（軽量）": MEMORY_RSS,
+        "tracemalloc（詳細・処理が遅くなります）": MEMORY_TRACEMALLOC,
+    }
+    track_memory = memory_modes[st.selectbox(
+        "処理段階ごとのメモリ使用量の計測",
+        list(memory_modes),
+        help="処理時間の内訳に、処理段階・ファイル・クライアントごとのピークメモリと増加メモリを追加します。"
+             "RSSは一定間隔でプロセスのメモリ使用量を確認します。tracemallocはPythonが確保したメモリを正確に計測しますが、Excelの解析が数倍以上遅くなります。"
+    )]
+    memory_budget_mb = st.number_input(
+        "メモリ使用量の上限 (MB)",
+        min_value=0,
+        value=DEFAULT_MEMORY_BUDGET_BYTES // (1024 * 1024),
+        help="アップロードしたファイルのサイズから見積もったピークメモリがこの値を超える場合に警告します（0の場合は確認しません）"
+    )
+    use_cache = st.checkbox(
+        "解析済みファイルのキャッシュを使用",
+        value=True,
+        help="同じ内容のファイルを再度アップロードした場合、前回の解析結果を再利用します（質問マスター作成ページと共通）。"
+             "同じファイル・設定の集計結果は、他のユーザーのセッションとも共有して再利用します。"
+    )
+
+    # キャッシュの確認と削除
+    parse_cache = get_default_cache()
+    cache_entries = parse_cache.entries()
+    st.caption(
+        f"キャッシュ: {len(cache_entries)}件 / "
+        f"{cache_entries['サイズ(bytes)'].sum() / 1024 / 1024:.1f}MB "
+        f"（上限 {parse_cache.max_bytes / 1024 / 1024:.0f}MB）"
+    )
+    if not cache_entries.empty:
+        st.dataframe(cache_entries, use_container_width=True)
+
+    # プロセス内の共有キャッシュ（すべてのセッションで共通）
+    shared_cache = get_shared_cache()
+    st.caption(
+        f"共有メモリキャッシュ: {len(shared_cache)}件 / "
+        f"{shared_cache.total_bytes / 1024 / 1024:.1f}MB "
+        f"（上限 {shared_cache.max_bytes / 1024 / 1024:.0f}MB、再利用 {shared_cache.hits}回）"
+    )
+    if len(shared_cache):
+        st.dataframe(shared_cache.entries(), use_container_width=True)
+
+    # クライアント別の集計計画のキャッシュ
+    plan_cache = get_default_plan_cache()
+    plan_count = len(plan_cache)
+    st.caption(f"集計計画のキャッシュ: {plan_count}件（上限 {plan_cache.max_entries}件）")
+    if st.button("🗑️ キャッシュを削除", disabled=cache_entries.empty and not len(shared_cache) and not plan_count):
+        parse_cache.clear()
+        shared_cache.clear()
+        plan_cache.clear()
+        clear_export_cache()
+        st.rerun()
+
+# メモリ使用量の見積もり（集計の実行前に警告する）
+# 再実行のたびに見積もり・ログ出力しないよう、ファイルサイズと上限が変わった場合だけ確認する
+if data_files:
+    memory_inputs = (tuple(file.size for file in data_files), memory_budget_mb)
+    if st.session_state.memory_check[0] != memory_inputs:
+        st.session_state.memory_check = (memory_inputs, check_memory_budget(
+            list(memory_inputs[0]), memory_budget_mb * 1024 * 1024, AGGREGATION_MEMORY_FACTOR
+        ))
+    memory_warning = st.session_state.memory_check[1]
+    if memory_warning:
+        st.warning(f"⚠️ {memory_warning}")
+
+# ファイル名と質問マスターの列の照合（集計の実行前に、対応する列がない・候補が複数あるファイルを確認する）
+if data_files and has_question_master:
+    if use_session_master:
+        master_columns_df = session_master_df
+    else:
+        master_columns_df = pd.read_excel(question_master_file, nrows=0)
+        question_master_file.seek(0)
+    resolutions = get_filename_index(master_columns_df).resolve_files([file.name for file in data_files])
+    if any(resolution['match'] == MATCH_AMBIGUOUS for resolution in resolutions):
+        st.warning(
+            "⚠️ 質問マスターに対応する列の候補が複数あるファイルがあります（最初の候補の列を使用します）。"
+            "意図した列と異なる場合はファイル名を変更してください。\n\n"
+            + format_ambiguous_matches(resolutions).replace('\n', '\n\n')
+        )
+    missing_files = [resolution['filename'] for resolution in resolutions if resolution['match'] == MATCH_MISSING]
+    if missing_files:
+        st.warning(
+            f"⚠️ 質問マスターに対応する列がないファイルがあります（最初のファイル列のマッピングを代替使用します）: "
+            f"{', '.join(missing_files)}"
+        )
+    if any(resolution['match'] != MATCH_EXACT for resolution in resolutions):
+        with st.expander("🔎 ファイル名と質問マスターの列の対応を表示"):
+            st.dataframe(pd.DataFrame([
+                {
+                    'ファイル名': resolution['filename'],
+                    '照合結果': MATCH_LABELS[resolution['match']],
+                    '質問マスターの列': ' / '.join(resolution['candidates']),
+                }
+                for resolution in resolutions
+            ]), use_container_width=True, hide_index=True)
+
+def run_aggregation_job(data_files, question_master_df, client_settings_df, options, trace):
+    """バックグラウンドのジョブで実行する処理（集計結果・ログ・列ごとのメモリ使用量・集計計画・計測結果を返す）"""
+
+    def run(progress_callback):
+        memory_report = []
+        plan_report = []
+        try:
+            results, merged_df, logs = aggregate_data(
+                data_files, question_master_df, client_settings_df,
+                memory_report=memory_report, plan_report=plan_report, trace=trace,
+                progress_callback=progress_callback, **options
+            )
+        finally:
+            trace.close()
+        return {
+            'results': results, 'merged_df': merged_df, 'logs': logs,
+            'memory_report': memory_report, 'client_plan': plan_report, 'trace': trace,
+        }
+
+    return BackgroundJob(run, stage_weights=PROGRESS_WEIGHTS, name='aggregation').start()
+
+
+def attach_job_results(job):
+    """終了したジョブの結果をセッションに保存し、結果またはエラーを表示する"""
+    st.session_state.aggregation_job = None
+    if job.status == STATUS_DONE:
+        # 結果を保存
+        st.session_state.aggregation_results = job.result['results']
+        st.session_state.merged_df = job.result['merged_df']
+        st.session_state.logs = job.result['logs']
+        st.session_state.memory_report = job.result['memory_report']
+        st.session_state.client_plan = job.result['client_plan']
+        st.session_state.pipeline_trace = job.result['trace']
+        # 集計実行ごとのIDを更新し、作成済みのExcelファイルを無効にする
+        st.session_state.aggregation_run_id = uuid.uuid4().hex
+        st.success(f"✅ 集計が完了しました！（{job.elapsed_seconds:.1f}秒）")
+    elif job.status == STATUS_CANCELLED:
+        st.warning("⏹️ 集計を中止しました。")
+    elif isinstance(job.error, PermissionError):
+        st.error("❌ ファイルアクセスエラー: ファイルが開かれている可能性があります。")
+    elif isinstance(job.error, pd.errors.EmptyDataError):
+        st.error("❌ 空のファイルが含まれています。")
+    else:
+        st.error(f"❌ エラーが発生しました: {str(job.error)}")
+        st.error("ファイルが破損しているか、形式が正しくない可能性があります。")
+
+
+@st.fragment(run_every=1.0)
+def show_job_progress():
+    """実行中のジョブの進捗を定期的に表示し、終了したらページ全体を再実行して結果を表示する"""
+    job = st.session_state.get('aggregation_job')
+    if job is None:
+        return
+    if not job.is_running:
+        st.rerun()
+    eta = job.eta_seconds
+    status_text = f"{job.stage} {job.detail}".strip() or "準備中"
+    if eta is not None:
+        status_text += f"（経過 {job.elapsed_seconds:.0f}秒、残り約 {eta:.0f}秒）"
+    st.progress(job.progress, text=f"データを処理中... {status_text}")
+    if job.cancel_requested:
+        st.caption("中止しています（処理中のファイル・クライアントが終わると中止します）...")
+    elif st.button("⏹️ 集計を中止", key="cancel_aggregation"):
+        job.cancel()
+
+
+# 終了したジョブの結果を反映
+aggregation_job = st.session_state.get('aggregation_job')
+if aggregation_job is not None and not aggregation_job.is_running:
+    attach_job_results(aggregation_job)
+    aggregation_job = None
+
+# 集計実行ボタン（集計はバックグラウンドで実行し、進捗を表示する）
+inputs_ready = data_files and has_question_master and client_settings_file
+if st.button("🚀 集計を実行", type="primary", disabled=not inputs_ready or aggregation_job is not None):
     try:
         # ファイルサイズチェック
         for file in data_files:
-            if file.size > 50 * 1024 * 1024:  # 50MB
+            if isinstance(file.size, int) and file.size > 50 * 1024 * 1024:  # 50MB
                 st.error(f"❌ ファイル '{file.name}' が50MBを超えています。")
                 st.stop()
         
-        if question_master_file.size > 50 * 1024 * 1024:
+        if question_master_file is not None and question_master_file.size > 50 * 1024 * 1024:
             st.error("❌ 質問マスターファイルが50MBを超えています。")
             st.stop()
             
@@ -77,199 +336,202 @@ if st.button("🚀 集計を実行", type="primary", disabled=not (data_files an
             st.error("❌ クライアント設定ファイルが50MBを超えています。")
             st.stop()
         
-        with st.spinner("データを処理中..."):
-            # ファイルの読み込み
+        # ファイルの読み込み
+        if use_session_master:
+            question_master_df = session_master_df
+        else:
             question_master_df = pd.read_excel(question_master_file)
-            client_settings_df = pd.read_excel(client_settings_file)
-            
-            # 集計処理
-            results, merged_df, logs = aggregate_data(data_files, question_master_df, client_settings_df)
-            
-            # 結果を保存
-            st.session_state.aggregation_results = results
-            st.session_state.merged_df = merged_df
-            st.session_state.logs = logs
-            
-        st.success("✅ 集計が完了しました！")
+        client_settings_df = pd.read_excel(client_settings_file)
+
+        # 集計処理をバックグラウンドで開始
+        options = {
+            'max_workers': max_workers,
+            'column_projection': column_projection,
+            'cache': get_default_cache() if use_cache else None,
+            'result_cache': get_shared_cache() if use_cache else None,
+            'plan_cache': get_default_plan_cache() if use_cache else None,
+            'optimize_memory': optimize_memory,
+            'column_blocks': column_blocks,
+        }
+        st.session_state.aggregation_job = run_aggregation_job(
+            list(data_files), question_master_df, client_settings_df, options,
+            PipelineTrace(track_memory=track_memory)
+        )
         
-    except PermissionError:
-        st.error("❌ ファイルアクセスエラー: ファイルが開かれている可能性があります。")
     except pd.errors.EmptyDataError:
         st.error("❌ 空のファイルが含まれています。")
     except Exception as e:
         st.error(f"❌ エラーが発生しました: {str(e)}")
         st.error("ファイルが破損しているか、形式が正しくない可能性があります。")
 
+show_job_progress()
+
 # ログ表示
 if st.session_state.logs:
     with st.expander("📝 処理ログを表示"):
         for log in st.session_state.logs:
             st.text(log)
 
+# 列ごとのメモリ使用量
+if st.session_state.memory_report:
+    with st.expander("💾 列ごとのメモリ使用量を表示"):
+        report_df = pd.DataFrame(st.session_state.memory_report)
+        st.caption(
+            f"合計: {report_df['変換前(bytes)'].sum() / 1024 / 1024:.1f}MB → "
+            f"{report_df['変換後(bytes)'].sum() / 1024 / 1024:.1f}MB"
+        )
+        st.dataframe(
+            report_df.sort_values('変換前(bytes)', ascending=False, ignore_index=True),
+            use_container_width=True
+        )
+
+# クライアント別の集計計画（選んだ列・出力する列名・マッピング行）
+if st.session_state.client_plan:
+    with st.expander("🧭 クライアント別の集計計画を表示"):
+        client_plan = {'clients': st.session_state.client_plan}
+        st.dataframe(summarize_client_plan(client_plan), use_container_width=True, hide_index=True)
+        st.download_button(
+            label="📥 集計計画をJSONでダウンロード",
+            data=plan_to_json(client_plan, indent=2).encode('utf-8'),
+            file_name="client_plan.json",
+            mime="application/json",
+        )
+
 # 結果表示とダウンロード
+def get_export(export_key, builder):
+    """
+    ダウンロード用Excelファイルを集計実行ごとにキャッシュして返す
+
+    Args:
+        export_key: ファイルの識別子
+        builder: キャッシュにない場合にファイルを作成する関数（内容のbytes、または一時ファイルのパスを返す）
+
+    Returns:
+        bytes | str: Excelファイルの内容、または一時ファイルのパス
+    """
+    export_cache = st.session_state.export_cache
+    if export_cache.get('run_id') != st.session_state.aggregation_run_id:
+        # 前回の集計結果の一時ファイルを削除
+        clear_export_cache()
+        export_cache['run_id'] = st.session_state.aggregation_run_id
+    if export_key not in export_cache:
+        export_cache[export_key] = traced_export(export_key, builder)
+    return export_cache[export_key]
+
+
+def traced_export(export_key, builder):
+    """Excelファイルの作成を、集計結果の処理時間の内訳に「出力」として記録する"""
+    trace = st.session_state.pipeline_trace
+    if trace is None:
+        return builder()
+    if export_key.startswith('client:'):
+        span = trace.span('出力', export_key[len('client:'):], KIND_CLIENT)
+    else:
+        span = trace.span('出力', '中間データ')
+    try:
+        with span as record:
+            export = builder()
+            record['bytes'] = len(export) if isinstance(export, bytes) else os.path.getsize(export)
+    finally:
+        trace.close()
+    return export
+
+
+def build_client_export(client_info):
+    """
+    クライアント別のExcelファイルを作成する
+
+    出力グループ（データとマッピングが同じクライアント）のExcelファイルは一度だけ作成してキャッシュし、
+    同じグループのクライアントでは基準ファイル名だけを置き換える。
+    """
+    output_group = client_info.get('output_group')
+    if output_group is None:
+        return build_client_workbook(client_info)
+    export_cache = st.session_state.export_cache
+    template_key = f"template:{output_group}"
+    if template_key not in export_cache:
+        export_cache[template_key] = build_client_workbook_template(client_info)
+    return personalize_client_workbook(export_cache[template_key], client_info)
+
+
+def has_export(export_key):
+    """現在の集計実行のExcelファイルが作成済みかを返す（一時ファイルが容量上限で削除された場合はFalse）"""
+    export_cache = st.session_state.export_cache
+    if export_cache.get('run_id') != st.session_state.aggregation_run_id or export_key not in export_cache:
+        return False
+    if isinstance(export_cache[export_key], str) and not os.path.exists(export_cache[export_key]):
+        del export_cache[export_key]
+        return False
+    return True
+
+
 if st.session_state.aggregation_results:
     st.markdown("---")
     st.markdown("## 📥 集計結果のダウンロード")
-    
+    st.caption("Excelファイルは「作成」ボタンを押したときに作成され、この集計結果の間は再利用されます。")
+
     # 中間データのダウンロード
     if 'merged_df' in st.session_state:
         st.markdown("### 中間データ（全結合データ）")
-        buffer = io.BytesIO()
-        with pd.ExcelWriter(buffer, engine='xlsxwriter') as writer:
-            st.session_state.merged_df.to_excel(writer, sheet_name='全結合データ', index=False)
-
-            # Set Calibri font for all cells
-            workbook = writer.book
-            worksheet = writer.sheets['全結合データ']
-
-            # Create format with Calibri font
-            calibri_format = workbook.add_format({'font_name': 'Calibri'})
+        if not has_export('merged'):
+            if st.button("📦 中間データのExcelを作成", key="build_merged"):
+                with st.spinner("中間データのExcelを作成中..."):
+                    # 一定のメモリ使用量で一時ファイルへ書き出す
+                    get_export('merged', lambda: write_merged_workbook(st.session_state.merged_df))
+
+        if has_export('merged'):
+            with open(get_export('merged', None), 'rb') as merged_file:
+                st.download_button(
+                    label="📄 中間データをダウンロード",
+                    data=merged_file,
+                    file_name="中間データ_全件結合済み.xlsx",
+                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+                )
 
-            # Apply font to all rows
-            for row in range(len(st.session_state.merged_df) + 1):  # +1 for header
-                worksheet.set_row(row, None, calibri_format)
-        buffer.seek(0)
-        
-        st.download_button(
-            label="📄 中間データをダウンロード",
-            data=buffer,
-            file_name="中間データ_全件結合済み.xlsx",
-            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-        )
-    
     # クライアント別データのダウンロード
     st.markdown("### クライアント別集計結果")
-    
+
     for client_name, client_info in st.session_state.aggregation_results.items():
         st.markdown(f"#### {client_name}")
-        
+
         # データのプレビュー
         with st.expander(f"{client_name}のデータをプレビュー"):
             st.dataframe(client_info['data'].head(10))
-        
-        # Excelファイルの作成
-        buffer = io.BytesIO()
-        with pd.ExcelWriter(buffer, engine='xlsxwriter') as writer:
-            # データシート
-            client_info['data'].to_excel(writer, sheet_name='元データ', index=False)
-
-            # 基準ファイル情報
-            base_info_df = pd.DataFrame([{'基準ファイル名': client_info['base_file']}])
-            base_info_df.to_excel(writer, sheet_name='基準ファイル情報', index=False)
-
-            # マッピング情報 (新フォーマット: 質問対応表形式)
-            mapping_df = None
-            formatted_df = None
-
-            if not client_info['mapping'].empty:
-                mapping_df = client_info['mapping'].copy()
-
-                # 質問対応表形式の場合 (4列: 番号, 条件, 内容, 区分)
-                if '番号' in mapping_df.columns and '内容' in mapping_df.columns:
-                    # 質問別にセパレータ行を追加してフォーマット
-                    formatted_mapping = []
-                    current_question = None
-
-                    for _, row in mapping_df.iterrows():
-                        # 質問の開始 (Q-で始まる番号)
-                        if str(row['番号']).startswith('Q-'):
-                            # 前の質問の後に空行を追加 (最初の質問以外)
-                            if current_question is not None:
-                                formatted_mapping.append({
-                                    '番号': '', '条件': '', '内容': '', '区分': ''
-                                })
-                            current_question = row['番号']
-
-                        formatted_mapping.append(row.to_dict())
-
-                    # フォーマット済みデータフレームを作成
-                    formatted_df = pd.DataFrame(formatted_mapping)
-                    formatted_df.to_excel(writer, sheet_name='基準質問マッピング', index=False)
-                else:
-                    # 古いフォーマットのフォールバック
-                    if '質問番号' in mapping_df.columns and '質問文' in mapping_df.columns:
-                        mapping_df = mapping_df[['質問番号', '質問文']]
-                    mapping_df.to_excel(writer, sheet_name='基準質問マッピング', index=False)
-
-            # Set Calibri font for all sheets
-            workbook = writer.book
-            calibri_format = workbook.add_format({'font_name': 'Calibri'})
-
-            # Apply font to all sheets
-            for sheet_name, worksheet in writer.sheets.items():
-                if sheet_name == '元データ':
-                    for row in range(len(client_info['data']) + 1):
-                        worksheet.set_row(row, None, calibri_format)
-                elif sheet_name == '基準ファイル情報':
-                    for row in range(len(base_info_df) + 1):
-                        worksheet.set_row(row, None, calibri_format)
-                elif sheet_name == '基準質問マッピング':
-                    if not client_info['mapping'].empty:
-                        # 基準質問マッピング専用のフォーマット設定
-                        header_format = workbook.add_format({
-                            'font_name': 'Calibri',
-                            'bold': True,
-                            'border': 1,
-                            'bg_color': '#F2F2F2'
-                        })
-
-                        question_format = workbook.add_format({
-                            'font_name': 'Calibri',
-                            'bold': True,
-                            'border': 1,
-                            'bg_color': '#E6F3FF'
-                        })
-
-                        choice_format = workbook.add_format({
-                            'font_name': 'Calibri',
-                            'border': 1
-                        })
-
-                        empty_format = workbook.add_format({
-                            'font_name': 'Calibri'
-                        })
-
-                        # ヘッダー行にフォーマット適用
-                        for col in range(4):  # 4列: 番号, 条件, 内容, 区分
-                            worksheet.write(0, col, ['番号', '条件', '内容', '区分'][col], header_format)
-
-                        # データ行にフォーマット適用
-                        if formatted_df is not None and '番号' in client_info['mapping'].columns:
-                            # 新フォーマットの場合: 質問対応表形式
-                            for row_idx, (_, row) in enumerate(formatted_df.iterrows(), start=1):
-                                row_format = choice_format  # デフォルト
-
-                                # 質問行 (Q-で始まる)
-                                if str(row['番号']).startswith('Q-'):
-                                    row_format = question_format
-                                # 空行
-                                elif str(row['番号']).strip() == '':
-                                    row_format = empty_format
-
-                                for col_idx, col_name in enumerate(['番号', '条件', '内容', '区分']):
-                                    cell_value = row[col_name] if col_name in row else ''
-                                    worksheet.write(row_idx, col_idx, cell_value, row_format)
-
-                            # 列幅を自動調整
-                            worksheet.set_column('A:A', 10)  # 番号
-                            worksheet.set_column('B:B', 12)  # 条件
-                            worksheet.set_column('C:C', 50)  # 内容
-                            worksheet.set_column('D:D', 8)   # 区分
-                        else:
-                            # 古いフォーマットのフォールバック
-                            if mapping_df is not None:
-                                for row in range(len(mapping_df) + 1):
-                                    worksheet.set_row(row, None, calibri_format)
-        
-        buffer.seek(0)
-        
+
+        # Excelファイルの作成（要求されたときだけ作成し、集計実行ごとにキャッシュ）
+        export_key = f"client:{client_name}"
+        if not has_export(export_key):
+            if st.button(f"📦 {client_name}のExcelを作成", key=f"build_{client_name}"):
+                with st.spinner(f"{client_name}のExcelを作成中..."):
+                    get_export(export_key, lambda: build_client_export(client_info))
+
         # ダウンロードボタン
+        if has_export(export_key):
+            st.download_button(
+                label=f"📥 {client_name}の集計結果をダウンロード",
+                data=get_export(export_key, None),
+                file_name=f"{client_name}_集計結果.xlsx",
+                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                key=f"download_{client_name}"
+            )
+
+# 処理時間の内訳（Excelファイルの作成も含む）
+if st.session_state.pipeline_trace is not None:
+    with st.expander("⏱️ 処理時間の内訳を表示"):
+        trace_records = st.session_state.pipeline_trace.to_records()
+        st.caption(f"合計: {total_seconds(trace_records):.2f}秒")
+        trace_df = st.session_state.pipeline_trace.to_frame()
+        stage_tab, file_tab, client_tab = st.tabs(["処理段階", "ファイル別", "クライアント別"])
+        for tab, kind in zip((stage_tab, file_tab, client_tab), (KIND_STAGE, KIND_FILE, KIND_CLIENT)):
+            with tab:
+                kind_df = trace_df[[record['kind'] == kind for record in trace_records]]
+                st.dataframe(kind_df.drop(columns='種類'), use_container_width=True, hide_index=True)
         st.download_button(
-            label=f"📥 {client_name}の集計結果をダウンロード",
-            data=buffer,
-            file_name=f"{client_name}_集計結果.xlsx",
-            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-            key=f"download_{client_name}"
+            label="📥 計測結果をJSONでダウンロード",
+            data=st.session_state.pipeline_trace.to_json().encode('utf-8'),
+            file_name="pipeline_trace.json",
+            mime="application/json",
+            key="download_trace"
         )
 
 # 使い方の説明
@@ -278,7 +540,9 @@ with st.expander("ℹ️ 使い方"):
     ### データ集計の手順
     
     1. **アンケートデータファイル**: 集計したい複数のアンケートExcelファイルを選択
+       （質問マスター作成で読み込んだファイルをそのまま使うこともできます）
     2. **質問マスターファイル**: 「質問マスター作成」機能で生成したファイルを選択
+       （同じセッションで作成した質問マスターはダウンロードせずにそのまま使えます）
     3. **クライアント設定ファイル**: クライアントごとの集計設定を記載したファイルを選択
     4. **集計を実行**: すべてのファイルを選択後、ボタンをクリック
     
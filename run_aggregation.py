@@ -1,168 +1,404 @@
+#!/usr/bin/env python3
+"""
+アンケートデータ集計のコマンドライン実行スクリプト
+
+Web画面（データ集計ページ）と同じ modules.aggregation.aggregate_data を使い、
+Streamlitを起動せずに集計結果をファイルへ出力する。夜間バッチなどでの利用を想定している。
+
+使用例:
+    python run_aggregation.py --data-dir data --master result/質問マスター.xlsx \\
+        --settings client_settings.xlsx --result-dir result --workers 4
+
+    # 毎月ファイルを追加する場合（前回から変更のないファイルは読み込まない）
+    python run_aggregation.py --incremental
+
+    # 処理段階ごとの処理時間をJSONで保存する
+    python run_aggregation.py --trace-file result/trace.json
+
+    # クライアント別の集計計画（選んだ列・出力する列名・マッピング行）をJSONで保存する
+    python run_aggregation.py --plan-file result/client_plan.json
+
+終了コード:
+    0: すべての出力が成功
+    1: 入力エラー・集計エラー、または一部のクライアントの出力に失敗
+"""
+
+import argparse
+import multiprocessing
 import os
-import pandas as pd
+import sys
+import time
 import logging
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from datetime import datetime
 
-def setup_logging():
+import pandas as pd
+
+from modules.aggregation import aggregate_data, PARALLEL_MIN_FILES
+from modules.question_master import create_question_master
+from modules.export import write_merged_workbook, write_client_workbooks
+from modules.parse_cache import ParsedWorkbookCache, DEFAULT_CACHE_DIR, DEFAULT_CACHE_MAX_BYTES
+from modules.plan_cache import ClientPlanCache, DEFAULT_PLAN_CACHE_DIR, plan_to_json
+from modules.workbook_loader import LocalSurveyFile
+from modules.incremental import IncrementalStore, frame_fingerprint, client_result_fingerprint
+from modules.pipeline_trace import PipelineTrace, KIND_STAGE, MEMORY_RSS, MEMORY_TRACEMALLOC
+from modules.memory_monitor import (
+    check_memory_budget, DEFAULT_MEMORY_BUDGET_BYTES, AGGREGATION_MEMORY_FACTOR, QUESTION_MASTER_MEMORY_FACTOR
+)
+
+INTERMEDIATE_FILENAME = '中間データ_全件結合済み.xlsx'
+STATE_DIRNAME = '.aggregation_state'
+
+
+def setup_logging(result_dir):
     """ロギングを設定する"""
-    log_filename = os.path.join('result', f"log_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt")
+    log_filename = os.path.join(result_dir, f"log_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt")
+    # modules のインポート時に basicConfig が呼ばれているため force=True で設定し直す
     logging.basicConfig(
         level=logging.INFO,
         format='%(asctime)s - %(levelname)s - %(message)s',
         handlers=[
             logging.FileHandler(log_filename, encoding='utf-8'),
             logging.StreamHandler()
-        ]
+        ],
+        force=True
     )
+    return log_filename
 
-def aggregate_data(data_dir, question_master_path, client_settings_path, result_dir):
+
+def show_progress(label, done, total, enabled=True):
+    """
+    進捗バーを標準エラー出力に表示する
+
+    端末の場合は同じ行を書き換え、リダイレクトされている場合は1行ずつ出力する。
     """
-    クライアント設定に基づき、アンケートデータを集計し、
-    クライアントごとに個別のExcelファイルとして出力する。
+    if not enabled:
+        return
+    width = 30
+    filled = int(width * done / total) if total else width
+    bar = '#' * filled + '-' * (width - filled)
+    interactive = sys.stderr.isatty()
+    end = '\n' if done >= total or not interactive else ''
+    prefix = '\r' if interactive else ''
+    print(f"{prefix}{label} [{bar}] {done}/{total}", end=end, file=sys.stderr, flush=True)
+
+
+def list_data_files(data_dir):
+    """データフォルダ内の集計対象のExcelファイルのパスをファイル名順に返す"""
+    return [
+        os.path.join(data_dir, filename)
+        for filename in sorted(os.listdir(data_dir))
+        if filename.endswith('.xlsx') and not filename.startswith('~')
+    ]
+
+
+def client_output_path(result_dir, client_name):
+    """クライアント別の集計結果の出力先パスを返す"""
+    return os.path.join(result_dir, f"{client_name}_集計結果.xlsx")
+
+
+def select_changed_outputs(client_results, result_dir, outputs):
+    """
+    前回の出力から内容が変わったクライアントだけを選ぶ（増分集計用）
+
+    Args:
+        client_results: aggregate_data が返すクライアント別の結果
+        result_dir: 出力先フォルダ
+        outputs: 前回の出力ファイルのパス → フィンガープリント
+
+    Returns:
+        dict: 出力が必要なクライアント別の結果
+        dict: 出力ファイルのパス → 今回のフィンガープリント
+    """
+    changed = {}
+    fingerprints = {}
+    for client_name, client_info in client_results.items():
+        path = client_output_path(result_dir, client_name)
+        fingerprints[path] = client_result_fingerprint(client_info)
+        if outputs.get(path) != fingerprints[path] or not os.path.exists(path):
+            changed[client_name] = client_info
+    return changed, fingerprints
+
+
+def write_client_outputs(client_results, result_dir, output_workers, progress=True):
+    """
+    クライアント別の集計結果を出力する
+
+    出力グループ（データとマッピングが同じクライアント）ごとに、Excelファイルを一度だけ作成し、
+    基準ファイル名だけを置き換えて各クライアントのファイルを書き込む。
+    output_workers が2以上の場合は出力グループごとにワーカープロセスで並列に書き込む。
+    プロセスプールが利用できない環境では逐次処理にフォールバックする。
+
+    Args:
+        client_results: aggregate_data が返すクライアント別の結果
+        result_dir: 出力先フォルダ
+        output_workers: 書き込みに使うワーカープロセス数（1の場合は逐次処理）
+        progress: 進捗バーを表示する場合True
+
+    Returns:
+        list: 出力に失敗したクライアント名のリスト
     """
+    groups = {}
+    for client_name, client_info in client_results.items():
+        path = client_output_path(result_dir, client_name)
+        groups.setdefault(client_info.get('output_group', client_name), []).append((client_name, client_info, path))
+    tasks = list(groups.values())
+    total = len(client_results)
+    if len(tasks) < total:
+        logging.info(f"{total}社の集計結果を{len(tasks)}種類のExcelファイルから出力します。")
+    failed = []
+    done = 0
+    show_progress("クライアント別出力", 0, total, progress)
+
+    def record(results):
+        nonlocal done
+        for client_name, path, error in results:
+            if error is None:
+                logging.info(f"'{client_name}' の集計結果を '{path}' に保存しました。")
+            else:
+                logging.error(f"'{client_name}' の出力中にエラー: {error}")
+                failed.append(client_name)
+            done += 1
+            show_progress("クライアント別出力", done, total, progress)
+
+    workers = min(output_workers, len(tasks))
+    if workers > 1:
+        try:
+            context = multiprocessing.get_context('spawn')
+            with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+                futures = {executor.submit(write_client_workbooks, group_tasks): group_tasks for group_tasks in tasks}
+                for future in as_completed(futures):
+                    try:
+                        results = future.result()
+                    except Exception as e:
+                        results = [(client_name, path, str(e)) for client_name, _, path in futures[future]]
+                    record(results)
+            return failed
+        except Exception as e:
+            logging.warning(f"並列出力に失敗したため、逐次処理に切り替えます。({e})")
+            failed = []
+            done = 0
+
+    for group_tasks in tasks:
+        try:
+            results = write_client_workbooks(group_tasks)
+        except Exception as e:
+            results = [(client_name, path, str(e)) for client_name, _, path in group_tasks]
+        record(results)
+    return failed
+
+
+def write_trace(trace, trace_file=None):
+    """
+    処理段階ごとの処理時間（メモリを計測した場合はピークメモリも）をログに出力し、
+    trace_file が指定されている場合は計測結果をJSONで保存する
+    """
+    for record in trace.to_records():
+        if record['kind'] != KIND_STAGE:
+            continue
+        message = f"  {record['stage']}: {record['seconds']:.2f}秒"
+        if record['peak_bytes'] is not None:
+            message += f"（ピーク {record['peak_bytes'] / 1024 / 1024:.1f}MB、増加 {record['retained_bytes'] / 1024 / 1024:.1f}MB）"
+        logging.info(message)
+    if trace_file:
+        with open(trace_file, 'w', encoding='utf-8') as f:
+            f.write(trace.to_json())
+        logging.info(f"処理時間の計測結果を '{trace_file}' に保存しました。")
+
+
+def run(args):
+    """
+    集計を実行する
+
+    Args:
+        args: コマンドライン引数
+
+    Returns:
+        int: 終了コード
+    """
+    started = time.perf_counter()
+
+    if not os.path.isdir(args.data_dir):
+        logging.error(f"データフォルダが見つかりません: {args.data_dir}")
+        return 1
+    data_paths = list_data_files(args.data_dir)
+    if not data_paths:
+        logging.error(f"'{args.data_dir}' に集計対象のExcelファイルがありません。")
+        return 1
+    logging.info(f"集計対象のファイル数: {len(data_paths)}")
+    file_sizes = [os.path.getsize(path) for path in data_paths]
+    # 見積もったピークメモリが上限を超える場合は、処理を始める前に警告する
+    check_memory_budget(file_sizes, args.memory_budget * 1024 * 1024, AGGREGATION_MEMORY_FACTOR)
+    trace = PipelineTrace(track_memory=args.track_memory)
+
+    cache = None
+    plan_cache = None
+    if args.cache:
+        cache = ParsedWorkbookCache(args.cache_dir, args.cache_max_bytes)
+        plan_cache = ClientPlanCache(args.plan_cache_dir)
+    store = None
+    outputs = {}
+    if args.incremental:
+        store = IncrementalStore(args.state_dir or os.path.join(args.result_dir, STATE_DIRNAME))
+        outputs = store.load_outputs()
+
     try:
-        df_master = pd.read_excel(question_master_path)
-        df_settings = pd.read_excel(client_settings_path)
+        data_files = [LocalSurveyFile(path) for path in data_paths]
+
+        if args.build_master:
+            logging.info("--- 質問マスターを作成 ---")
+            check_memory_budget(file_sizes, args.memory_budget * 1024 * 1024, QUESTION_MASTER_MEMORY_FACTOR)
+            question_master_df = create_question_master(data_files, cache=cache, trace=trace)
+            question_master_df.to_excel(args.master, index=False)
+            logging.info(f"質問マスターを '{args.master}' に保存しました。({len(question_master_df)}件)")
+        else:
+            question_master_df = pd.read_excel(args.master)
+        client_settings_df = pd.read_excel(args.settings)
     except FileNotFoundError as e:
         logging.error(f"エラー: 必要なファイルが見つかりません。 {e}")
-        return
+        return 1
+    except Exception as e:
+        logging.error(f"入力ファイルの読み込み中にエラー: {e}")
+        return 1
 
-    all_data_list = []
-    
-    logging.info("--- データ読み込みと変換処理を開始 ---")
-    for filename in os.listdir(data_dir):
-        if filename.endswith('.xlsx') and not filename.startswith('~'):
-            filepath = os.path.join(data_dir, filename)
-            logging.info(f"'{filename}' の処理を開始...")
-            
-            file_mapping = df_master[['質問文', filename]].dropna()
-            q_to_text_map = dict(zip(file_mapping[filename], file_mapping['質問文']))
-            
-            try:
-                df_data = pd.read_excel(filepath, sheet_name='data')
-                if df_data.empty:
-                    logging.warning(f"'{filename}' のdataシートは空です。スキップします。")
-                    continue
-
-                new_columns = {}
-                for col in df_data.columns:
-                    if col in q_to_text_map:
-                        new_columns[col] = q_to_text_map[col]
-                    else:
-                        for q_num, q_text in q_to_text_map.items():
-                            if str(col).startswith(q_num + '_'):
-                                suffix = str(col).replace(q_num, '')
-                                new_columns[col] = f"{q_text}{suffix}"
-                                break
-                df_data.rename(columns=new_columns, inplace=True)
-                
-                all_data_list.append(df_data)
-                logging.info(f"'{filename}' のデータを読み込み完了。({len(df_data)}件)")
+    logging.info("--- 集計処理を開始 ---")
+    plan_report = []
+    try:
+        client_results, merged_df, logs = aggregate_data(
+            data_files, question_master_df, client_settings_df,
+            max_workers=args.workers,
+            parallel_min_files=args.parallel_min_files,
+            cache=cache,
+            column_projection=args.column_projection,
+            incremental_store=store,
+            optimize_memory=args.optimize_memory,
+            column_blocks=args.column_blocks,
+            trace=trace,
+            plan_cache=plan_cache,
+            plan_report=plan_report,
+            progress_callback=lambda stage, done, total, name='': show_progress(stage, done, total, args.progress)
+        )
+    except Exception as e:
+        logging.error(f"集計中にエラー: {e}")
+        return 1
+    for message in logs:
+        logging.info(message)
+    logging.info(f"集計が完了しました。（全結合データ: {len(merged_df)}件、クライアント: {len(client_results)}社）")
+    if args.plan_file:
+        with open(args.plan_file, 'w', encoding='utf-8') as f:
+            f.write(plan_to_json({'clients': plan_report}, indent=2))
+        logging.info(f"クライアント別の集計計画を '{args.plan_file}' に保存しました。")
 
+    export_span = trace.begin('出力')
+    if not args.skip_intermediate:
+        intermediate_path = os.path.join(args.result_dir, INTERMEDIATE_FILENAME)
+        merged_fingerprint = frame_fingerprint(merged_df) if store is not None else None
+        if (store is not None and outputs.get(intermediate_path) == merged_fingerprint
+                and os.path.exists(intermediate_path)):
+            logging.info("増分集計: 中間データに変更がないため、中間ファイルの出力をスキップします。")
+        else:
+            try:
+                write_merged_workbook(merged_df, intermediate_path)
+                logging.info(f"中間ファイルを '{intermediate_path}' に保存しました。")
             except Exception as e:
-                logging.error(f"'{filename}' のデータシート処理中にエラー: {e}")
+                logging.error(f"中間ファイルの出力中にエラー: {e}")
+                trace.close()
+                return 1
+        if store is not None:
+            outputs[intermediate_path] = merged_fingerprint
+            store.save_outputs(outputs)
 
-    if not all_data_list:
-        logging.error("集計対象のデータが見つかりませんでした。")
-        return
-    
-    logging.info("--- 全データの結合処理を開始 ---")
-    merged_df = pd.concat(all_data_list, ignore_index=True, sort=False)
-    logging.info(f"全ファイルのデータを結合しました。合計: {len(merged_df)}件")
-
-    if '回答日時' in merged_df.columns:
-        merged_df['回答日時'] = pd.to_datetime(merged_df['回答日時'], errors='coerce')
-        merged_df.dropna(subset=['回答日時'], inplace=True)
-        merged_df.sort_values(by='回答日時', inplace=True)
-        logging.info(f"回答日時でソートしました。")
-        
-        # original_count = len(merged_df)
-        # merged_df = merged_df.head(100)
-        # logging.info(f"先頭100件を抽出しました。(元の件数: {original_count} -> 抽出後: {len(merged_df)})")
-
-    # 中間ファイルを出力
-    intermediate_path = os.path.join(result_dir, '中間データ_全件結合済み.xlsx')
-    merged_df.to_excel(intermediate_path, index=False)
-    logging.info(f"中間ファイルを '{intermediate_path}' に保存しました。")
-
-
-    logging.info("--- クライアント別集計処理を開始 ---")
-    for client_name, group in df_settings.groupby('クライアント名'):
-        logging.info(f"'{client_name}' の集計を開始します...")
-        
-        questions_to_aggregate = group['集計対象の質問文'].tolist()
-        
-        cols_to_select = ['NO']
-        for q in questions_to_aggregate:
-            if q in merged_df.columns:
-                cols_to_select.append(q)
-            for col in merged_df.columns:
-                if str(col).startswith(q + '_'):
-                    cols_to_select.append(col)
-        
-        cols_to_select = list(dict.fromkeys(cols_to_select))
-        
-        if '回答日時' in merged_df.columns:
-            cols_to_select.append('回答日時')
-        
-        if len(cols_to_select) <= 1:
-            logging.warning(f"'{client_name}' の集計対象の質問がデータ内に見つかりませんでした。")
-            continue
-            
-        client_data = merged_df[cols_to_select]
-        
-        output_filename = os.path.join(result_dir, f"{client_name}_集計結果.xlsx")
-        
-        # --- 出力前に列名を質問文から基準ファイルの質問番号に戻す ---
-        # 基準ファイルを特定
-        file_list = sorted([f for f in os.listdir(data_dir) if f.endswith('.xlsx') and not f.startswith('~')])
-        base_file = file_list[0] if file_list else None
-        
-        base_mapping_df = pd.DataFrame()
-        text_to_q_map = {}
-        if base_file:
-            # 基準ファイルの質問マッピングを取得
-            base_mapping_df = df_master[df_master.columns.intersection(['質問文', base_file])].copy()
-            base_mapping_df = base_mapping_df.rename(columns={base_file: '質問番号'}).dropna()
-            text_to_q_map = dict(zip(base_mapping_df['質問文'], base_mapping_df['質問番号']))
-
-        # client_dataの列名を質問文から質問番号へ再変換（FA列も考慮）
-        final_rename_map = {}
-        for col_name in client_data.columns:
-            # FA列などのサフィックスが付いているかチェック
-            is_suffixed = False
-            for q_text, q_num in text_to_q_map.items():
-                if str(col_name).startswith(q_text + '_'):
-                    suffix = str(col_name).replace(q_text, '')
-                    final_rename_map[col_name] = q_num + suffix
-                    is_suffixed = True
-                    break
-            # サフィックスがなく、完全一致する場合
-            if not is_suffixed and col_name in text_to_q_map:
-                final_rename_map[col_name] = text_to_q_map[col_name]
-
-        output_client_data = client_data.rename(columns=final_rename_map)
-        
-        # 基準ファイル情報をDataFrameにする
-        base_info_df = pd.DataFrame([{'基準ファイル名': base_file}])
-
-        with pd.ExcelWriter(output_filename) as writer:
-            output_client_data.to_excel(writer, sheet_name='元データ', index=False)
-            base_info_df.to_excel(writer, sheet_name='基準ファイル情報', index=False)
-            if not base_mapping_df.empty:
-                base_mapping_df.to_excel(writer, sheet_name='基準質問マッピング', index=False)
-            
-        logging.info(f"'{client_name}' の集計結果を '{output_filename}' に保存しました。")
+    targets = client_results
+    if store is not None:
+        targets, fingerprints = select_changed_outputs(client_results, args.result_dir, outputs)
+        logging.info(
+            f"増分集計: {len(client_results)}社のうち {len(client_results) - len(targets)}社は"
+            f"前回の出力から変更がないためスキップします。"
+        )
+
+    failed = write_client_outputs(targets, args.result_dir, args.output_workers, args.progress)
+    if store is not None:
+        # 出力に成功したクライアントだけを記録し、失敗したクライアントは次回も出力する
+        for client_name in targets:
+            path = client_output_path(args.result_dir, client_name)
+            if client_name in failed:
+                outputs.pop(path, None)
+            else:
+                outputs[path] = fingerprints[path]
+        store.save_outputs(outputs)
+    trace.end(export_span)
+    trace.close()
+    write_trace(trace, args.trace_file)
+    elapsed = time.perf_counter() - started
+    if failed:
+        logging.error(f"{len(failed)}社の出力に失敗しました: {', '.join(map(str, failed))}（{elapsed:.1f}秒）")
+        return 1
+
+    logging.info(f"すべての出力が完了しました。（{elapsed:.1f}秒）")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="アンケートデータを集計し、クライアント別のExcelファイルを出力する")
+    parser.add_argument("--data-dir", default="data", help="アンケートデータ（.xlsx）のフォルダ（デフォルト: data）")
+    parser.add_argument("--master", default=os.path.join("result", "質問マスター.xlsx"),
+                        help="質問マスターのパス（デフォルト: result/質問マスター.xlsx）")
+    parser.add_argument("--build-master", action="store_true",
+                        help="データファイルから質問マスターを作成し、--master のパスに保存してから集計する")
+    parser.add_argument("--settings", default="client_settings.xlsx",
+                        help="クライアント設定のパス（デフォルト: client_settings.xlsx）")
+    parser.add_argument("--result-dir", default="result", help="出力先フォルダ（デフォルト: result）")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="ファイル読み込みのワーカープロセス数（デフォルト: CPU数、1で逐次処理）")
+    parser.add_argument("--parallel-min-files", type=int, default=PARALLEL_MIN_FILES,
+                        help=f"並列読み込みを行う最小ファイル数（デフォルト: {PARALLEL_MIN_FILES}）")
+    parser.add_argument("--output-workers", type=int, default=os.cpu_count() or 1,
+                        help="クライアント別出力のワーカープロセス数（デフォルト: CPU数、1で逐次処理）")
+    parser.add_argument("--column-projection", action="store_true",
+                        help="集計に必要な列のみ読み込む（省メモリ。中間データもこれらの列のみになる）")
+    parser.add_argument("--optimize-memory", action="store_true",
+                        help="中間データの列の型を最適化してメモリ使用量を削減する（出力内容は変わらない）")
+    parser.add_argument("--column-blocks", action="store_true",
+                        help="全ファイルを横に連結せず、ファイルごとの列ブロックのまま保持する（列の和集合が大きい場合に省メモリ）")
+    parser.add_argument("--skip-intermediate", action="store_true", help="中間データ（全件結合）を出力しない")
+    parser.add_argument("--incremental", action="store_true",
+                        help="増分集計: 前回から変更のないファイルは読み込まず、内容が変わったクライアントだけを出力する")
+    parser.add_argument("--state-dir", default=None,
+                        help=f"増分集計の保存先（デフォルト: 出力先フォルダ/{STATE_DIRNAME}）")
+    parser.add_argument("--cache", action="store_true", help="解析済みシートのディスクキャッシュを使用する")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR, help="キャッシュの保存先")
+    parser.add_argument("--cache-max-bytes", type=int, default=DEFAULT_CACHE_MAX_BYTES, help="キャッシュの容量上限（bytes）")
+    parser.add_argument("--plan-cache-dir", default=DEFAULT_PLAN_CACHE_DIR,
+                        help="クライアント別の集計計画のキャッシュの保存先（--cache を指定した場合に使用）")
+    parser.add_argument("--plan-file", default=None,
+                        help="クライアント別の集計計画（選んだ列・出力する列名・マッピング行）をJSONで保存するパス")
+    parser.add_argument("--trace-file", default=None,
+                        help="処理段階・ファイル・クライアントごとの処理時間の計測結果をJSONで保存するパス")
+    parser.add_argument("--track-memory", nargs="?", const=MEMORY_RSS, default=False,
+                        choices=[MEMORY_RSS, MEMORY_TRACEMALLOC],
+                        help="処理段階・ファイル・クライアントごとのピークメモリを計測する"
+                             "（rss: RSSを一定間隔で確認、tracemalloc: 正確だが数倍以上遅くなる、デフォルト: rss）")
+    parser.add_argument("--memory-budget", type=int, default=DEFAULT_MEMORY_BUDGET_BYTES // (1024 * 1024),
+                        help="メモリ使用量の上限（MB）。ファイルサイズから見積もったピークメモリが超える場合に警告する（0で確認しない）")
+    parser.add_argument("--no-progress", dest="progress", action="store_false", help="進捗バーを表示しない")
+
+    args = parser.parse_args(argv)
+    if args.workers is not None and args.workers < 1:
+        parser.error("--workers は1以上を指定してください。")
+    if args.output_workers < 1:
+        parser.error("--output-workers は1以上を指定してください。")
+
+    os.makedirs(args.result_dir, exist_ok=True)
+    if args.build_master and os.path.dirname(args.master):
+        os.makedirs(os.path.dirname(args.master), exist_ok=True)
+    setup_logging(args.result_dir)
+
+    try:
+        return run(args)
+    except KeyboardInterrupt:
+        logging.error("中断されました。")
+        return 130
 
 
 if __name__ == '__main__':
-    setup_logging()
-    DATA_DIR = 'data'
-    RESULT_DIR = 'result'
-    QUESTION_MASTER_PATH = os.path.join(RESULT_DIR, '質問マスター.xlsx')
-    CLIENT_SETTINGS_PATH = 'client_settings.xlsx'
-    
-    if not os.path.exists(RESULT_DIR):
-        os.makedirs(RESULT_DIR)
-        
-    aggregate_data(DATA_DIR, QUESTION_MASTER_PATH, CLIENT_SETTINGS_PATH, RESULT_DIR)
+    sys.exit(main())
@@ -40,14 +40,26 @@ def run_e2e_tests():
         app_process.wait()
 
 
+def run_benchmarks():
+    """ベンチマークを実行（小サイズのみ、結果は benchmarks/results/ に保存）"""
+    print("\n=== ベンチマークを実行中 ===")
+    cmd = [sys.executable, "benchmarks/run_benchmarks.py", "--sizes", "small"]
+    result = subprocess.run(cmd)
+    return result.returncode
+
+
 def main():
     parser = argparse.ArgumentParser(description="テストを実行")
     parser.add_argument("--unit", action="store_true", help="ユニットテストのみ実行")
     parser.add_argument("--e2e", action="store_true", help="E2Eテストのみ実行")
     parser.add_argument("--all", action="store_true", help="すべてのテストを実行（デフォルト）")
+    parser.add_argument("--bench", action="store_true", help="ベンチマークのみ実行（--all には含まれない）")
     
     args = parser.parse_args()
     
+    if args.bench:
+        sys.exit(run_benchmarks())
+
     # 引数が指定されていない場合はすべて実行
     if not any([args.unit, args.e2e]):
         args.all = True
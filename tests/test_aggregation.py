@@ -0,0 +1,318 @@
+"""
+modules.aggregation のテスト
+
+合成したアンケートファイル（benchmarks/generate_survey_workbooks.py）で集計し、
+クライアント別の結果を以前の実装（変更前のクライアント別の処理をそのまま残したもの）と比較する。
+"""
+
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.generate_survey_workbooks import generate_benchmark_dataset
+from modules.aggregation import aggregate_data, extract_question_mapping_from_survey, FIXED_QUESTIONS
+from modules.question_master import create_question_master
+from modules import parse_cache
+from modules.parse_cache import ParsedWorkbookCache, get_default_cache
+from modules.pipeline_trace import PipelineTrace
+from modules.plan_cache import ClientPlanCache
+from modules.shared_cache import SharedMemoryCache
+from modules.workbook_loader import LocalSurveyFile
+
+
+@pytest.fixture(scope='module')
+def dataset(tmp_path_factory):
+    """合成したアンケートファイル・クライアント設定と、重複した質問文・空のセルを含む質問マスター"""
+    output_dir = tmp_path_factory.mktemp('survey')
+    paths = generate_benchmark_dataset(
+        str(output_dir), files=3, respondents=40, questions=16, clients=4, questions_per_client=4, seed=3
+    )
+    data_paths = paths['data_paths']
+    master_df = create_question_master([LocalSurveyFile(path) for path in data_paths])
+    file_columns = [col for col in master_df.columns if col.endswith('.xlsx')]
+
+    # 同じ質問文の行を追加する（最初のファイル列は空、後のファイル列に別の質問番号）
+    duplicated = {'質問文': master_df['質問文'].iloc[-1], '初出ファイル': file_columns[-1]}
+    duplicated.update({col: np.nan for col in file_columns})
+    duplicated[file_columns[-1]] = 'Q-999'
+    master_df = pd.concat([master_df, pd.DataFrame([duplicated])], ignore_index=True)
+
+    # 複数のファイル列に質問番号がある質問文と、空のセルがあることを確認する
+    assert (master_df[file_columns].notna().sum(axis=1) > 1).any()
+    assert master_df[file_columns].isna().any().any()
+    assert master_df['質問文'].duplicated().any()
+
+    return {
+        'data_paths': data_paths,
+        'master_df': master_df,
+        'settings_df': pd.read_excel(paths['settings_path']),
+    }
+
+
+def expected_client_results(merged_df, question_master_df, client_settings_df, comprehensive_question_mapping):
+    """以前の実装のクライアント別集計（変更前の aggregate_data のクライアント別の処理をそのまま残したもの）"""
+    logs = []
+    # クライアント別の集計
+    client_results = {}
+    logs.append("--- クライアント別集計処理を開始 ---")
+    
+    for client_name, group in client_settings_df.groupby('クライアント名'):
+        logs.append(f"'{client_name}' の集計を開始します...")
+        
+        # クライアント設定から質問を取得
+        questions_to_aggregate = group['集計対象の質問文'].tolist()
+        
+        # 固定質問を追加（重複を除外）
+        all_questions = list(dict.fromkeys(FIXED_QUESTIONS + questions_to_aggregate))
+        logs.append(f"'{client_name}' には固定質問を含む合計 {len(all_questions)} 個の質問を集計します。")
+        
+        cols_to_select = ['NO']
+        for q in all_questions:
+            if q in merged_df.columns:
+                cols_to_select.append(q)
+            for col in merged_df.columns:
+                if str(col).startswith(q + '_'):
+                    cols_to_select.append(col)
+        
+        cols_to_select = list(dict.fromkeys(cols_to_select))
+        
+        if '回答日時' in merged_df.columns:
+            cols_to_select.append('回答日時')
+        
+        if len(cols_to_select) <= 1:
+            logs.append(f"'{client_name}' の集計対象の質問がデータ内に見つかりませんでした。")
+            continue
+            
+        client_data = merged_df[cols_to_select]
+        
+        base_mapping_df = pd.DataFrame()
+        text_to_q_map = {}
+        
+        # すべてのファイルから質問マッピングを収集（固定質問を含む全質問を確実にマッピング）
+        for file_col in question_master_df.columns:
+            if file_col != '質問文' and file_col.endswith('.xlsx'):
+                temp_mapping = question_master_df[['質問文', file_col]].dropna()
+                for _, row in temp_mapping.iterrows():
+                    if row['質問文'] not in text_to_q_map:
+                        text_to_q_map[row['質問文']] = row[file_col]
+        
+        # 🆕 質問対応表形式のマッピングを作成（質問 + 選択肢を含む）
+        # クライアントの質問リストに該当する質問対応表データを抽出
+        client_mapping_data = []
+
+        for question_text in all_questions:
+            # comprehensive_question_mapping から該当する質問とその選択肢を探す
+            question_found = False
+            for mapping_entry in comprehensive_question_mapping:
+                # 質問のメイン行を探す（番号がQ-で始まり、内容が質問文と一致）
+                if (mapping_entry['番号'].startswith('Q-') and
+                    mapping_entry['内容'] == question_text):
+
+                    # 質問のメイン行を追加
+                    client_mapping_data.append(mapping_entry)
+                    question_found = True
+
+                    # この質問の選択肢も探して追加
+                    question_index = comprehensive_question_mapping.index(mapping_entry)
+
+                    # 質問の直後から次の質問までの選択肢を収集
+                    for i in range(question_index + 1, len(comprehensive_question_mapping)):
+                        choice_entry = comprehensive_question_mapping[i]
+
+                        # 次の質問（Q-で始まる）が見つかったら停止
+                        if choice_entry['番号'].startswith('Q-'):
+                            break
+
+                        # 選択肢（数字の番号で内容がある）を追加
+                        if (choice_entry['番号'].isdigit() and
+                            choice_entry['内容'].strip()):
+                            client_mapping_data.append(choice_entry)
+
+                    break
+
+            # もし質問対応表に見つからない場合は、従来の方法でフォールバック
+            if not question_found:
+                matching_rows = question_master_df[question_master_df['質問文'] == question_text]
+                if not matching_rows.empty:
+                    row = matching_rows.iloc[0]
+                    for col in question_master_df.columns:
+                        if col.endswith('.xlsx') and pd.notna(row[col]):
+                            client_mapping_data.append({
+                                '番号': row[col],
+                                '条件': '',
+                                '内容': question_text,
+                                '区分': ''
+                            })
+                            break
+
+        # DataFrameを作成
+        if client_mapping_data:
+            base_mapping_df = pd.DataFrame(client_mapping_data)
+            # 列の順序を調整
+            base_mapping_df = base_mapping_df[['番号', '条件', '内容', '区分']]
+        else:
+            # フォールバック：空のDataFrame
+            base_mapping_df = pd.DataFrame(columns=['番号', '条件', '内容', '区分'])
+
+        logs.append(f"'{client_name}' のマッピング: {len(base_mapping_df)}行（質問+選択肢を含む）")
+
+        # client_dataの列名を質問文から質問番号へ再変換（FA列も考慮）
+        final_rename_map = {}
+        for col_name in client_data.columns:
+            # FA列などのサフィックスが付いているかチェック
+            is_suffixed = False
+            for q_text, q_num in text_to_q_map.items():
+                if str(col_name).startswith(q_text + '_'):
+                    suffix = str(col_name).replace(q_text, '')
+                    final_rename_map[col_name] = q_num + suffix
+                    is_suffixed = True
+                    break
+            # サフィックスがなく、完全一致する場合
+            if not is_suffixed and col_name in text_to_q_map:
+                final_rename_map[col_name] = text_to_q_map[col_name]
+
+        output_client_data = client_data.rename(columns=final_rename_map)
+        
+        client_results[client_name] = {
+            'data': output_client_data,
+            'base_file': f"{client_name}専用マッピング",
+            'mapping': base_mapping_df
+        }
+        
+        logs.append(f"'{client_name}' の集計が完了しました。")
+    
+    return client_results
+
+
+def test_client_output_matches_old_question_map(dataset):
+    data_files = [LocalSurveyFile(path) for path in dataset['data_paths']]
+    client_results, merged_df, _ = aggregate_data(
+        data_files, dataset['master_df'], dataset['settings_df'], max_workers=1
+    )
+    question_mapping = [
+        entry for path in dataset['data_paths']
+        for entry in extract_question_mapping_from_survey(LocalSurveyFile(path))
+    ]
+    expected = expected_client_results(merged_df, dataset['master_df'], dataset['settings_df'], question_mapping)
+
+    assert list(client_results) == list(expected)
+    for client_name, expected_info in expected.items():
+        client_info = client_results[client_name]
+        pd.testing.assert_frame_equal(client_info['data'], expected_info['data'])
+        pd.testing.assert_frame_equal(client_info['mapping'], expected_info['mapping'])
+        assert client_info['base_file'] == expected_info['base_file']
+
+
+def test_parallel_ingestion_with_default_cache(dataset, tmp_path, monkeypatch):
+    # 既定のキャッシュ（メモリ上の共有キャッシュ付き）と同じ構成で、保存先だけをテスト用にする
+    monkeypatch.setattr(
+        parse_cache, '_default_cache', ParsedWorkbookCache(str(tmp_path), memory_cache=SharedMemoryCache())
+    )
+    cache = get_default_cache()
+    assert cache.memory_cache is not None
+
+    client_results, merged_df, logs = aggregate_data(
+        [LocalSurveyFile(path) for path in dataset['data_paths']], dataset['master_df'], dataset['settings_df'],
+        max_workers=2, parallel_min_files=2, cache=cache
+    )
+    assert any('プロセスで並列に読み込みます' in message for message in logs)
+    assert not any('逐次処理に切り替えます' in message for message in logs)
+
+    serial_results, serial_merged_df, _ = aggregate_data(
+        [LocalSurveyFile(path) for path in dataset['data_paths']], dataset['master_df'], dataset['settings_df'],
+        max_workers=1
+    )
+    pd.testing.assert_frame_equal(merged_df, serial_merged_df)
+    for client_name, client_info in serial_results.items():
+        pd.testing.assert_frame_equal(client_results[client_name]['data'], client_info['data'])
+
+
+@pytest.mark.parametrize('column_projection', [False, True], ids=['all-columns', 'projection'])
+def test_second_run_reuses_client_plan(dataset, tmp_path, column_projection):
+    plan_cache = ClientPlanCache(str(tmp_path))
+
+    def run(plan_cache):
+        trace = PipelineTrace()
+        client_results, merged_df, logs = aggregate_data(
+            [LocalSurveyFile(path) for path in dataset['data_paths']], dataset['master_df'], dataset['settings_df'],
+            max_workers=1, column_projection=column_projection, plan_cache=plan_cache, trace=trace
+        )
+        stages = {span['stage'] for span in trace.spans}
+        return client_results, merged_df, logs, stages
+
+    first_results, first_merged, first_logs, first_stages = run(plan_cache)
+    assert len(plan_cache) == 1
+    assert '集計計画の作成' in first_stages
+
+    # 2回目はデータの読み込み前に集計計画のキャッシュを確認し、集計計画を作成しない
+    second_results, second_merged, second_logs, second_stages = run(plan_cache)
+    assert any('集計計画をキャッシュから再利用しました' in message for message in second_logs)
+    assert '集計計画の照合' in second_stages
+    assert '集計計画の作成' not in second_stages
+
+    expected_results, expected_merged, _, _ = run(None)
+    for merged_df in (first_merged, second_merged):
+        pd.testing.assert_frame_equal(merged_df, expected_merged)
+    for client_results in (first_results, second_results):
+        assert list(client_results) == list(expected_results)
+        for client_name, expected_info in expected_results.items():
+            pd.testing.assert_frame_equal(client_results[client_name]['data'], expected_info['data'])
+            pd.testing.assert_frame_equal(client_results[client_name]['mapping'], expected_info['mapping'])
+            assert client_results[client_name]['output_group'] == expected_info['output_group']
+
+
+@pytest.mark.parametrize('column_projection', [False, True], ids=['all-columns', 'projection'])
+def test_parallel_ingestion_matches_serial(dataset, column_projection):
+    def run(max_workers):
+        return aggregate_data(
+            [LocalSurveyFile(path) for path in dataset['data_paths']], dataset['master_df'], dataset['settings_df'],
+            max_workers=max_workers, parallel_min_files=2, column_projection=column_projection
+        )
+
+    parallel_results, parallel_merged, parallel_logs = run(2)
+    # 逐次処理に切り替わった場合も同じ結果になるため、並列で読み込んだことを確認する
+    assert any('2プロセスで並列に読み込みます' in message for message in parallel_logs)
+    assert not any('逐次処理に切り替えます' in message for message in parallel_logs)
+
+    serial_results, serial_merged, serial_logs = run(1)
+    assert not any('並列に読み込みます' in message for message in serial_logs)
+
+    pd.testing.assert_frame_equal(parallel_merged, serial_merged)
+    assert list(parallel_results) == list(serial_results)
+    for client_name, serial_info in serial_results.items():
+        parallel_info = parallel_results[client_name]
+        pd.testing.assert_frame_equal(parallel_info['data'], serial_info['data'])
+        pd.testing.assert_frame_equal(parallel_info['mapping'], serial_info['mapping'])
+        assert parallel_info['base_file'] == serial_info['base_file']
+        assert parallel_info['output_group'] == serial_info['output_group']
+    # ファイルごとのログもアップロード順に同じ内容になる
+    assert [m for m in parallel_logs if '並列に読み込みます' not in m] == serial_logs
+
+
+def test_ambiguous_filename_uses_first_candidate(dataset):
+    data_paths = dataset['data_paths']
+    first_col = os.path.basename(data_paths[0])
+    stem = first_col[:-len('.xlsx')]
+
+    # 正規化すると同じ名前になる列（コピーしたファイルの列）を後ろに追加し、質問番号を入れ替えておく
+    master_df = dataset['master_df'].copy()
+    master_df[f"{stem} - コピー.xlsx"] = master_df[first_col].iloc[::-1].to_numpy()
+    data_files = [LocalSurveyFile(path) for path in data_paths]
+    data_files[0].name = f"{stem} (2).xlsx"
+
+    client_results, merged_df, logs = aggregate_data(data_files, master_df, dataset['settings_df'], max_workers=1)
+    assert any('最初の候補の列を使用します' in message for message in logs)
+    assert any(f"最初の候補の '{first_col}' 列を使用します" in message for message in logs)
+
+    # 最初の候補（元のファイルの列）のマッピングで集計した結果と同じになる
+    expected_results, expected_merged, _ = aggregate_data(
+        [LocalSurveyFile(path) for path in data_paths], dataset['master_df'], dataset['settings_df'], max_workers=1
+    )
+    pd.testing.assert_frame_equal(merged_df, expected_merged)
+    for client_name, expected_info in expected_results.items():
+        pd.testing.assert_frame_equal(client_results[client_name]['data'], expected_info['data'])
@@ -0,0 +1,41 @@
+"""
+modules.export のテスト（中間データの一時ファイルの削除）
+"""
+
+import os
+import sys
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules import export
+from modules.export import write_merged_workbook, remove_temp_export, remove_temp_exports
+
+
+def test_temp_exports_are_removed(tmp_path, monkeypatch):
+    monkeypatch.setattr(export, 'DEFAULT_EXPORT_DIR', str(tmp_path))
+    merged_df = pd.DataFrame({'NO': range(200), '質問': ['回答'] * 200})
+
+    first = write_merged_workbook(merged_df)
+    assert os.path.dirname(first) == str(tmp_path)
+    remove_temp_export(first)
+    assert not os.path.exists(first)
+
+    # 容量上限を超えた場合は古い一時ファイルから削除する（作成したファイルは残す）
+    old = write_merged_workbook(merged_df)
+    os.utime(old, (0, 0))
+    monkeypatch.setattr(export, 'DEFAULT_EXPORT_MAX_BYTES', os.path.getsize(old))
+    new = write_merged_workbook(merged_df)
+    assert not os.path.exists(old)
+    assert os.path.exists(new)
+
+    # プロセスの終了時に残っている一時ファイルを削除する
+    remove_temp_exports()
+    assert os.listdir(tmp_path) == []
+
+    # 出力先を指定した場合は削除の対象にしない
+    path = str(tmp_path / '中間データ.xlsx')
+    write_merged_workbook(merged_df, path)
+    remove_temp_exports()
+    assert os.path.exists(path)
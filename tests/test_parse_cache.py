@@ -0,0 +1,79 @@
+"""
+modules.parse_cache / SurveyWorkbook.use_cache のテスト
+
+キャッシュに保存するのは実際に解析したシートだけで、dataシートは集計で初めて読み込んだときに
+既存のエントリへ追加されることを確認する。
+"""
+
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.generate_survey_workbooks import generate_benchmark_dataset
+from modules.parse_cache import ParsedWorkbookCache
+from modules.shared_cache import SharedMemoryCache
+from modules.workbook_loader import (
+    DATA_SHEET, QUESTION_SHEET, LocalSurveyFile, SessionSurveyFile, SurveyWorkbook, load_survey_workbook,
+)
+
+
+@pytest.fixture(scope='module')
+def data_path(tmp_path_factory):
+    paths = generate_benchmark_dataset(
+        str(tmp_path_factory.mktemp('survey')), files=1, respondents=20, questions=8, clients=2,
+        questions_per_client=2, seed=5
+    )
+    return paths['data_paths'][0]
+
+
+@pytest.mark.parametrize('memory_cache', [None, SharedMemoryCache()], ids=['disk', 'memory'])
+def test_cache_stores_only_parsed_sheets(data_path, tmp_path, memory_cache):
+    cache = ParsedWorkbookCache(str(tmp_path), memory_cache=memory_cache)
+
+    # 質問マスター作成: キャッシュがない場合は質問対応表だけを解析して保存する
+    workbook = SurveyWorkbook(LocalSurveyFile(data_path))
+    assert not workbook.use_cache(cache)
+    master_questions = workbook.master_questions()
+    assert not workbook.is_data_parsed
+    assert cache.entries()['シート'].tolist() == [QUESTION_SHEET]
+
+    # 集計: 質問対応表はキャッシュから読み込み、初めて読み込んだdataシートをエントリに追加する
+    workbook = SurveyWorkbook(LocalSurveyFile(data_path))
+    assert workbook.use_cache(cache)
+    pd.testing.assert_frame_equal(workbook.master_questions(), master_questions)
+    assert not workbook.is_data_parsed
+    data = workbook.data
+    assert sorted(cache.entries()['シート'].iloc[0].split(', ')) == sorted([QUESTION_SHEET, DATA_SHEET])
+
+    # 次回はdataシートもキャッシュから読み込む（ディスクのみのキャッシュでも同じ）
+    for reader_cache in (cache, ParsedWorkbookCache(str(tmp_path))):
+        workbook = SurveyWorkbook(LocalSurveyFile(data_path))
+        assert workbook.use_cache(reader_cache)
+        assert workbook.is_data_parsed
+        pd.testing.assert_frame_equal(workbook.data, data)
+
+
+def test_session_survey_file_keeps_only_content_and_cache_key(data_path, tmp_path, monkeypatch):
+    cache = ParsedWorkbookCache(str(tmp_path))
+    workbook = load_survey_workbook(LocalSurveyFile(data_path), cache)
+    workbook.master_questions()
+
+    # セッション状態に保存するファイルは、開いたExcelファイルと解析済みのシートを持たない
+    session_file = SessionSurveyFile.from_workbook(workbook)
+    assert workbook._excel_file is None
+    assert not hasattr(session_file, '_sheets')
+    assert (session_file.name, session_file.size) == (workbook.name, workbook.size)
+    assert session_file.getvalue() == workbook.read_bytes()
+    assert session_file.cache_key == cache.key_for(session_file.getvalue())
+
+    # データ集計では保存したキーで解析済みの質問対応表を読み込む（ファイル内容のハッシュは計算し直さない）
+    monkeypatch.setattr(cache, 'key_for', lambda content: pytest.fail('key_for should not be called'))
+    reloaded = load_survey_workbook(session_file, cache)
+    assert reloaded._cache_key == session_file.cache_key
+    assert not reloaded.is_data_parsed
+    assert reloaded.question_mapping() == SurveyWorkbook(LocalSurveyFile(data_path)).question_mapping()
+    pd.testing.assert_frame_equal(reloaded.data, SurveyWorkbook(LocalSurveyFile(data_path)).data)
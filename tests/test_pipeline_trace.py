@@ -0,0 +1,34 @@
+"""
+modules.pipeline_trace のテスト（tracemalloc を使うメモリの計測）
+"""
+
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.pipeline_trace import PipelineTrace, MEMORY_TRACEMALLOC
+
+
+def test_concurrent_traces_share_tracemalloc():
+    assert not tracemalloc.is_tracing()
+    first = PipelineTrace(track_memory=MEMORY_TRACEMALLOC)
+    second = PipelineTrace(track_memory=MEMORY_TRACEMALLOC)
+
+    with first.span('読み込み') as outer:
+        # 他の計測が実行中の区間はピークをリセットできないため、ピークを記録しない
+        with second.span('読み込み'):
+            data = [bytes(1024) for _ in range(1000)]
+        # 先に終了した計測は、他の計測が使っている tracemalloc を停止しない
+        second.close()
+        assert tracemalloc.is_tracing()
+        with first.span('結合'):
+            data = data + [bytes(1024) for _ in range(1000)]
+    first.close()
+    assert not tracemalloc.is_tracing()
+
+    assert second.spans[0]['peak_bytes'] is None
+    assert second.spans[0]['retained_bytes'] is not None
+    assert outer['peak_bytes'] >= 1024 * 1000
+    assert first.to_records()[1]['peak_bytes'] >= 1024 * 1000
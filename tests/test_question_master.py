@@ -0,0 +1,181 @@
+"""
+modules.question_master のテスト
+
+合成したアンケートファイル（benchmarks/generate_survey_workbooks.py）から作成した質問マスターを、
+以前の実装（pivot_table・Categorical の並べ替え・groupby().first()・merge・dropna で作成する処理）と比較する。
+"""
+
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.generate_survey_workbooks import generate_benchmark_dataset, generate_survey_workbook, question_pool
+from modules.question_master import create_question_master
+from modules.workbook_loader import LocalSurveyFile
+
+
+def old_create_question_master(uploaded_files):
+    """以前の実装（変更前の create_question_master をそのまま残したもの）"""
+    # ファイルが空の場合のエラーチェック
+    if not uploaded_files:
+        raise ValueError("ファイルがアップロードされていません。少なくとも1つのExcelファイルを選択してください。")
+
+    master_list = []
+
+    for uploaded_file in uploaded_files:
+        # ファイル名の文字化け対策
+        original_filename = uploaded_file.name
+        filename = original_filename
+
+        # 文字化けの検出と修正
+        try:
+            # 一般的な文字化けパターンをチェック
+            if any(ord(c) > 127 and ord(c) < 256 for c in filename):
+                # Latin-1でエンコードされた可能性がある場合
+                try:
+                    filename = filename.encode('latin-1').decode('utf-8')
+                except:
+                    pass
+
+            # それでも文字化けしている場合は、安全なファイル名を生成
+            if '�' in filename or any(ord(c) > 0xFFFF for c in filename):
+                import hashlib
+                # ファイル名のハッシュ値を使用
+                file_hash = hashlib.md5(uploaded_file.name.encode('utf-8', errors='ignore')).hexdigest()[:8]
+                filename = f"file_{file_hash}.xlsx"
+        except Exception:
+            # エラーが発生した場合は、安全なデフォルト名を使用
+            import time
+            filename = f"file_{int(time.time())}.xlsx"
+
+        if filename.endswith('.xlsx') and not filename.startswith('~'):
+            try:
+                # ヘッダーなしで読み込み、手動で設定する
+                df_q = pd.read_excel(uploaded_file, sheet_name='質問対応表', header=None)
+
+                # 3行目(index=2)をヘッダーとして設定
+                df_q.columns = df_q.iloc[2]
+                # 4行目(index=3)以降をデータとして使用
+                df_q = df_q.iloc[3:].reset_index(drop=True)
+
+                # 必要な列だけを抽出
+                df_q = df_q[['番号', '内容']]
+                # 質問文が書かれている行のみを抽出（'番号'列が'Q-'で始まる行）
+                df_q = df_q[df_q['番号'].astype(str).str.startswith('Q-')].copy()
+
+                # ファイル名を保存（文字化け対策済み）
+                df_q['ファイル名'] = filename
+                # 元のファイル名も保存（表示用）
+                df_q['元ファイル名'] = original_filename
+                master_list.append(df_q)
+
+            except Exception as e:
+                raise Exception(f"Error processing {filename}: {e}")
+
+    if not master_list:
+        raise ValueError("読み込むファイルが見つかりませんでした。")
+
+    master_df = pd.concat(master_list, ignore_index=True)
+    master_df.rename(columns={'番号': '質問番号', '内容': '質問文'}, inplace=True)
+
+    # 基準となるファイル（ファイル名でソートして最初のファイル）を特定
+    file_list = sorted(list(set([df['ファイル名'].iloc[0] for df in master_list])))
+    if not file_list:
+        raise ValueError("基準となるファイルが見つかりません。")
+    base_file = file_list[0]
+
+    # 基準ファイルの質問順序を保持（重複を除外）
+    base_order_df = master_df[master_df['ファイル名'] == base_file][['質問文']].drop_duplicates().copy()
+
+    # 質問文をキーにしてピボット処理
+    pivot_df = master_df.pivot_table(
+        index='質問文',
+        columns='ファイル名',
+        values='質問番号',
+        aggfunc='first'
+    ).reset_index()
+
+    # 基準ファイルの質問リストを取得
+    base_questions_list = base_order_df['質問文'].tolist()
+
+    # pivot_dfを基準ファイルの質問とそれ以外に分割
+    df_base = pivot_df[pivot_df['質問文'].isin(base_questions_list)].copy()
+    df_other = pivot_df[~pivot_df['質問文'].isin(base_questions_list)].copy()
+
+    # 基準ファイルの質問をその順序通りにソート
+    df_base['質問文'] = pd.Categorical(df_base['質問文'], categories=base_questions_list, ordered=True)
+    df_base = df_base.sort_values('質問文')
+
+    # その他の質問を質問文でソート
+    df_other = df_other.sort_values('質問文')
+
+    # 2つのDataFrameを結合
+    final_df = pd.concat([df_base, df_other], ignore_index=True)
+
+    # 各質問が最初に登場したファイルを取得
+    master_df_sorted = master_df.sort_values('ファイル名')
+    first_appearance = master_df_sorted.groupby('質問文')['ファイル名'].first().reset_index()
+    first_appearance.rename(columns={'ファイル名': '初出ファイル'}, inplace=True)
+
+    # 初出ファイル情報をマージ
+    final_df = pd.merge(final_df, first_appearance, on='質問文', how='left')
+
+    # 列の順序を調整（初出ファイルを質問文の隣に）
+    cols = final_df.columns.tolist()
+    cols.insert(1, cols.pop(cols.index('初出ファイル')))
+    final_df = final_df[cols]
+
+    # すべてのファイルで質問番号が存在しない行（完全に空の行）を削除
+    file_columns = [f for f in final_df.columns if f not in ['質問文', '初出ファイル']]
+    cleaned_df = final_df.dropna(subset=file_columns, how='all')
+
+    return cleaned_df
+
+
+@pytest.fixture(scope='module')
+def survey_paths(tmp_path_factory):
+    """合成したアンケートファイルと、同じ質問文を複数回含むファイル（ファイル名の順で基準ファイルになる）"""
+    output_dir = tmp_path_factory.mktemp('survey')
+    paths = generate_benchmark_dataset(
+        str(output_dir), files=4, respondents=5, questions=14, clients=1, questions_per_client=1, seed=7
+    )['data_paths']
+
+    # 基準ファイル内・他のファイルとの間で質問文が重複する（別の質問番号が付く）ファイル
+    pool = question_pool(12)
+    duplicated = [pool[3], pool[0], pool[3], pool[11], pool[0]]
+    generate_survey_workbook(str(output_dir / 'a_duplicates.xlsx'), duplicated, respondents=5, seed=11)
+    generate_survey_workbook(str(output_dir / 'z_duplicates.xlsx'), duplicated[::-1], respondents=5, seed=12)
+    return [str(output_dir / 'z_duplicates.xlsx')] + paths[::-1] + [str(output_dir / 'a_duplicates.xlsx')]
+
+
+def test_master_matches_old_implementation(survey_paths):
+    expected = old_create_question_master([LocalSurveyFile(path) for path in survey_paths])
+    assert expected['質問文'].duplicated().sum() == 0
+    assert len(expected.columns) == len(survey_paths) + 2
+
+    master_df = create_question_master([LocalSurveyFile(path) for path in survey_paths])
+    pd.testing.assert_frame_equal(master_df, expected)
+
+
+def test_master_matches_old_implementation_for_each_base_file(survey_paths):
+    # 基準ファイル（ファイル名の順で最初のファイル）が異なる組み合わせ
+    for start in range(len(survey_paths) - 1):
+        files = survey_paths[start:start + 2]
+        expected = old_create_question_master([LocalSurveyFile(path) for path in files])
+        master_df = create_question_master([LocalSurveyFile(path) for path in files])
+        pd.testing.assert_frame_equal(master_df, expected)
+
+
+def test_file_without_question_sheet_raises_like_old_implementation(survey_paths, tmp_path):
+    path = str(tmp_path / 'no_question_sheet.xlsx')
+    pd.DataFrame({'NO': [1, 2], 'Q-001': [1, 2]}).to_excel(path, sheet_name='data', index=False)
+    files = [survey_paths[0], path]
+
+    with pytest.raises(Exception, match='Error processing no_question_sheet.xlsx'):
+        old_create_question_master([LocalSurveyFile(p) for p in files])
+    with pytest.raises(Exception, match='Error processing no_question_sheet.xlsx'):
+        create_question_master([LocalSurveyFile(p) for p in files])
@@ -0,0 +1,82 @@
+"""
+modules.response_order のテスト
+
+ファイルごとの並べ替え済みの区間を併合した行の並びが、以前の実装（全ファイルを連結してから
+pd.to_datetime → dropna → sort_values する処理）と同じになることを確認する。
+"""
+
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.incremental import merge_sorted_runs, sort_survey_run
+from modules.response_order import order_by_response_time
+
+
+def old_sort(frames, kind='quicksort'):
+    """以前の実装: 連結してから回答日時を変換し、全体を並べ替える"""
+    merged_df = pd.concat(frames, ignore_index=True, sort=False)
+    merged_df['回答日時'] = pd.to_datetime(merged_df['回答日時'], errors='coerce')
+    merged_df.dropna(subset=['回答日時'], inplace=True)
+    merged_df.sort_values(by='回答日時', inplace=True, kind=kind)
+    return merged_df
+
+
+def new_sort(frames):
+    """aggregate_data の並べ替え: ファイルごとの区間を併合した順に、連結したデータから行を取り出す"""
+    merged_df = pd.concat(frames, ignore_index=True, sort=False)
+    response_times, order = order_by_response_time(frames)
+    merged_df['回答日時'] = response_times
+    return merged_df.take(order)
+
+
+def make_frames(seed, files=5, rows=200, ties=True):
+    """回答日時が文字列・日時型のファイル、変換できない値・回答日時の列がないファイルを含むデータ"""
+    rng = np.random.default_rng(seed)
+    frames = []
+    for i in range(files):
+        if ties:
+            # ファイルをまたいで同じ回答日時が多数ある
+            minutes = rng.integers(0, 30, rows)
+        else:
+            minutes = rng.permutation(files * rows)[:rows] + i * 0.1
+        dates = pd.Timestamp('2024-04-01') + pd.to_timedelta(minutes, unit='min')
+        df = pd.DataFrame({'NO': [f"{i}-{j}" for j in range(rows)], 'Q1': rng.integers(1, 5, rows)})
+        df['回答日時'] = dates.strftime('%Y/%m/%d %H:%M:%S') if i % 2 else dates
+        if i % 2:
+            df.loc[5::17, '回答日時'] = '不明'
+        frames.append(df)
+    frames.append(pd.DataFrame({'NO': ['x-0', 'x-1'], 'Q1': [1, 2]}))
+    return frames
+
+
+def test_ties_keep_file_order_then_row_order():
+    frames = [
+        pd.DataFrame({'回答日時': pd.to_datetime(['2024-04-01 10:00', '2024-04-01 10:05', '2024-04-01 10:05'])}),
+        pd.DataFrame({'回答日時': ['2024/04/01 09:00', '2024/04/01 10:05', '不明']}),
+        pd.DataFrame({'回答日時': pd.to_datetime(['2024-04-01 10:05', '2024-04-01 10:00'])}),
+    ]
+    _, order = order_by_response_time(frames)
+    # 連結した位置: 1つ目のファイル 0-2、2つ目 3-5（5は変換できないため除外）、3つ目 6-7
+    assert order.tolist() == [3, 0, 7, 1, 2, 4, 6]
+
+
+def test_order_matches_old_sort_with_ties_across_files():
+    frames = make_frames(seed=1)
+    # 同じ回答日時の行は、ファイルの順序・ファイル内の順序（安定ソートと同じ順）になる
+    pd.testing.assert_frame_equal(new_sort(frames), old_sort(frames, kind='stable'))
+
+
+def test_order_matches_old_sort_without_ties():
+    frames = make_frames(seed=2, ties=False)
+    pd.testing.assert_frame_equal(new_sort(frames), old_sort(frames))
+
+
+def test_incremental_merge_matches_old_sort():
+    frames = make_frames(seed=3)
+    runs = [(sort_survey_run(df), len(df)) for df in frames]
+    pd.testing.assert_frame_equal(merge_sorted_runs(runs), old_sort(frames, kind='stable'))
@@ -0,0 +1,32 @@
+"""
+modules.shared_cache のテスト
+"""
+
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.shared_cache import SharedMemoryCache, estimate_bytes
+
+
+def test_frame_referenced_from_several_values_is_counted_once():
+    df = pd.DataFrame({'NO': np.arange(1000), 'Q-001': ['選択肢'] * 1000})
+    frame_bytes = estimate_bytes(df)
+    assert frame_bytes >= df.memory_usage(index=True, deep=True).sum()
+
+    # 集計結果のように、同じデータフレームを複数の値から参照する場合
+    shared = {'merged': df, 'clients': {'A社': {'data': df}, 'B社': {'data': df}}, 'frames': [df, df]}
+    assert frame_bytes < estimate_bytes(shared) < 2 * frame_bytes
+
+    # 別のデータフレームはそれぞれ数える
+    copies = {'merged': df, 'clients': {'A社': {'data': df.copy()}}}
+    assert estimate_bytes(copies) > 2 * frame_bytes
+
+    cache = SharedMemoryCache(max_bytes=int(1.5 * frame_bytes))
+    cache.put(('aggregation', 'run'), shared)
+    assert ('aggregation', 'run') in cache
+    assert cache.total_bytes == estimate_bytes(shared)
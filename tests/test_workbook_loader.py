@@ -0,0 +1,106 @@
+"""
+modules.workbook_loader のテスト
+
+SurveyWorkbook.question_mapping()（質問対応表をヘッダーなしで一度だけ解析する）の結果を、
+以前の実装（pd.read_excel(..., sheet_name='質問対応表', header=1) で読み込む処理）と比較する。
+"""
+
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.generate_survey_workbooks import generate_benchmark_dataset
+from modules.workbook_loader import LocalSurveyFile, SurveyWorkbook
+
+
+def old_extract_question_mapping_from_survey(uploaded_file):
+    """以前の実装（変更前の extract_question_mapping_from_survey をそのまま残したもの）"""
+    # 質問対応表シートが存在するかチェック
+    xl_file = pd.ExcelFile(uploaded_file)
+    if '質問対応表' not in xl_file.sheet_names:
+        return []
+
+    # 質問対応表シートを読み込み
+    question_df = pd.read_excel(uploaded_file, sheet_name='質問対応表', header=1)
+
+    # データをクリーンアップ
+    mapping_data = []
+    for _, row in question_df.iterrows():
+        # 空行をスキップ
+        if pd.isna(row.iloc[0]) and pd.isna(row.iloc[2]):
+            continue
+
+        # 4列の構造に変換
+        entry = {
+            '番号': str(row.iloc[0]) if pd.notna(row.iloc[0]) else '',
+            '条件': str(row.iloc[1]) if pd.notna(row.iloc[1]) else '',
+            '内容': str(row.iloc[2]) if pd.notna(row.iloc[2]) else '',
+            '区分': str(row.iloc[3]) if pd.notna(row.iloc[3]) else ''
+        }
+        mapping_data.append(entry)
+
+    return mapping_data
+
+
+def write_question_sheet(path, rows):
+    """質問対応表シート（ヘッダーなし）とdataシートを持つファイルを作成する"""
+    with pd.ExcelWriter(path, engine='xlsxwriter') as writer:
+        pd.DataFrame({'NO': [1]}).to_excel(writer, sheet_name='data', index=False)
+        pd.DataFrame(rows).to_excel(writer, sheet_name='質問対応表', index=False, header=False)
+    return path
+
+
+@pytest.fixture(scope='module')
+def survey_paths(tmp_path_factory):
+    output_dir = tmp_path_factory.mktemp('survey')
+    paths = generate_benchmark_dataset(
+        str(output_dir), files=2, respondents=5, questions=10, clients=1, questions_per_client=1, seed=9
+    )['data_paths']
+
+    # 2行目にも値がある質問対応表（整数・小数の選択肢番号、空のセル、区分が数値の行を含む）
+    paths.append(write_question_sheet(str(output_dir / 'second_row_header.xlsx'), [
+        ['質問対応表', None, None, None],
+        ['番号', '条件', '内容', '区分'],
+        ['Q-001', '必須回答', '年齢を教えてください。', 'SA'],
+        [1, None, '20代', None],
+        [2, None, '30代', None],
+        [None, None, None, None],
+        ['Q-002', None, '好きな数字', 3],
+        [1.5, '条件あり', 10, None],
+        [None, None, '番号のない選択肢', None],
+    ]))
+    # 選択肢番号だけの列（文字列を含まない番号の列）
+    paths.append(write_question_sheet(str(output_dir / 'numeric_only.xlsx'), [
+        [None, None, None, None],
+        [None, None, None, None],
+        [1, '必須回答', '選択肢1', 'SA'],
+        [2, None, '選択肢2', None],
+        [None, None, None, None],
+        [3, None, '選択肢3', None],
+    ]))
+    return paths
+
+
+def test_question_mapping_matches_old_header_path(survey_paths):
+    for path in survey_paths:
+        expected = old_extract_question_mapping_from_survey(LocalSurveyFile(path))
+        assert expected
+        assert SurveyWorkbook(LocalSurveyFile(path)).question_mapping() == expected
+
+
+def test_integer_choice_numbers_are_not_converted_to_float(survey_paths):
+    mapping = SurveyWorkbook(LocalSurveyFile(survey_paths[0])).question_mapping()
+    choice_numbers = [entry['番号'] for entry in mapping if entry['内容'].startswith('選択肢')]
+    assert choice_numbers
+    assert all(number.isdigit() for number in choice_numbers)
+
+
+def test_file_without_question_sheet(tmp_path):
+    path = str(tmp_path / 'no_question_sheet.xlsx')
+    pd.DataFrame({'NO': [1]}).to_excel(path, sheet_name='data', index=False)
+    assert SurveyWorkbook(LocalSurveyFile(path)).question_mapping() == []
+    assert old_extract_question_mapping_from_survey(LocalSurveyFile(path)) == []